@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+
+"""
+Script to benchmark the tracking pipeline on synthetic thermal frames.
+"""
+
+from benchmark.main import main
+
+
+main()
@@ -0,0 +1,134 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import time
+
+from cptv import CPTVReader
+import cv2
+import numpy as np
+
+from load.clip import Clip
+from ml_tools import opticalflow, tools
+from track.framebuffer import Frame
+
+
+def load_scaled_frames(filename):
+    """ Loads the thermal frames of a cptv file, scaled as they are for calculating optical flow """
+    scaled = []
+    with open(filename, "rb") as f:
+        for frame_number, frame in enumerate(CPTVReader(f)):
+            frame = Frame(frame.pix, None, None, frame_number)
+            frame.scale_thermal()
+            scaled.append(frame.scaled_thermal)
+    return scaled
+
+
+def time_backend(backend, clips_frames, high_quality=False, threads=2):
+    """
+    Calculates optical flow between every pair of frames in each clip
+    :return: milliseconds per frame
+    """
+    opt_flow = opticalflow.create_optical_flow(backend, high_quality)
+    cv2.setNumThreads(threads)
+    total = 0
+    num_frames = 0
+    for frames in clips_frames:
+        for prev, current in zip(frames[:-1], frames[1:]):
+            flow = np.zeros(current.shape + (2,), dtype=np.float32)
+            start = time.perf_counter()
+            opt_flow.calc(prev, current, flow)
+            total += time.perf_counter() - start
+            num_frames += 1
+    return total * 1000 / max(1, num_frames)
+
+
+def classification_accuracy(config, backend, filenames, model_file, kerasmodel=False):
+    """
+    Classifies the human tagged tracks of each clip with optical flow from backend, clips need a metadata file
+    alongside them like those used by load.py
+    :return: fraction of tracks whose best label matches the tag, number of tracks
+    """
+    # tensorflow is only needed when measuring accuracy
+    from classify.clipclassifier import ClipClassifier
+
+    config.use_opt_flow = True
+    config.tracking.flow_backend = backend
+    config.classify_tracking.flow_backend = backend
+    classifier = ClipClassifier(
+        config, config.classify_tracking, model_file, kerasmodel
+    )
+    labels = classifier.classifier.labels
+    correct = 0
+    total = 0
+    for filename in filenames:
+        metadata_filename = os.path.splitext(filename)[0] + ".txt"
+        if not os.path.isfile(metadata_filename):
+            logging.warning("No metadata found for %s", filename)
+            continue
+        metadata = tools.load_clip_metadata(metadata_filename)
+        clip = Clip(config.classify_tracking, filename)
+        clip.load_metadata(metadata, True, config.load.tag_precedence)
+        if not classifier.track_extractor.parse_clip(clip):
+            continue
+        clip.calculate_track_flow()
+        for track in clip.tracks:
+            prediction = classifier.identify_track(clip, track)
+            if prediction is None or prediction.best_label_index is None:
+                continue
+            total += 1
+            if labels[prediction.best_label_index] == track.tag:
+                correct += 1
+        classifier.predictions.clear_predictions()
+    return correct / max(1, total), total
+
+
+def flow_backends(
+    config,
+    filenames,
+    backends=None,
+    model_file=None,
+    kerasmodel=False,
+    high_quality=False,
+):
+    """
+    Measures the speed of each optical flow backend, and if model_file is given the classification accuracy
+    :return: dictionary of backend to a dictionary of results
+    """
+    if backends is None:
+        backends = list(opticalflow.BACKENDS.keys())
+    clips_frames = [load_scaled_frames(filename) for filename in filenames]
+    results = {}
+    for backend in backends:
+        try:
+            ms_per_frame = time_backend(
+                backend, clips_frames, high_quality, config.tracking.flow_threads
+            )
+        except AttributeError:
+            logging.warning("Optical flow backend %s is not available", backend)
+            continue
+        results[backend] = {"ms_per_frame": ms_per_frame}
+        if model_file:
+            accuracy, tracks = classification_accuracy(
+                config, backend, filenames, model_file, kerasmodel
+            )
+            results[backend]["accuracy"] = accuracy
+            results[backend]["tracks"] = tracks
+    return results
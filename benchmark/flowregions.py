@@ -0,0 +1,79 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+import numpy as np
+
+from load.cliptrackextractor import ClipTrackExtractor
+from .synthetic import synthetic_frames, create_clip, track_frames
+
+
+def track_with_flow(tracking_config, frames, flow_mode, opt_flow=None):
+    """
+    Tracks frames calculating optical flow with flow_mode
+    :param opt_flow: (optional) optical flow algorithm to use instead of the configured one
+    :return: clip, seconds taken
+    """
+    tracking_config.flow_mode = flow_mode
+    extractor = ClipTrackExtractor(tracking_config, True, False)
+    clip = create_clip(extractor, frames)
+    if opt_flow is not None:
+        clip.frame_buffer.opt_flow = opt_flow
+    start = time.perf_counter()
+    track_frames(extractor, clip, frames)
+    return clip, time.perf_counter() - start
+
+
+def flow_differences(clip, other_clip):
+    """
+    Compares the flow of clip to other_clip inside every track region, tracking is not affected by flow
+    so both clips have the same tracks.
+    :return: array of absolute differences of flow_h and flow_v for all track pixels
+    """
+    differences = []
+    for track in clip.tracks:
+        for region in track.bounds_history:
+            frame = clip.frame_buffer.get_frame(region.frame_number)
+            other_frame = other_clip.frame_buffer.get_frame(region.frame_number)
+            differences.append(
+                np.abs(region.subimage(frame.flow) - region.subimage(other_frame.flow))
+            )
+    if len(differences) == 0:
+        return np.zeros(0)
+    return np.concatenate([difference.reshape(-1) for difference in differences])
+
+
+def flow_regions(tracking_config, num_frames=200, width=160, height=120, opt_flow=None):
+    """
+    Compares calculating optical flow for the full frame to only around regions
+    :return: dictionary of flow mode to frames per second, and differences in flow for track regions
+    """
+    frames = synthetic_frames(num_frames, width, height)
+    full_clip, full_time = track_with_flow(
+        tracking_config, frames, ClipTrackExtractor.FLOW_FULL, opt_flow
+    )
+    regions_clip, regions_time = track_with_flow(
+        tracking_config, frames, ClipTrackExtractor.FLOW_REGIONS, opt_flow
+    )
+    fps = {
+        ClipTrackExtractor.FLOW_FULL: num_frames / full_time,
+        ClipTrackExtractor.FLOW_REGIONS: num_frames / regions_time,
+    }
+    return fps, flow_differences(full_clip, regions_clip)
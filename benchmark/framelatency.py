@@ -0,0 +1,118 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from load.cliptrackextractor import ClipTrackExtractor
+from load.frameworkspace import FrameWorkspace
+from ml_tools import tools
+from .synthetic import synthetic_frames, create_clip
+
+
+def allocating_frame(extractor, clip, thermal, prev_filtered):
+    """ The frame processing of ClipTrackExtractor._process_frame before it used a FrameWorkspace """
+    filtered = np.float32(thermal.copy())
+    filtered = filtered - clip.background
+    filtered = filtered - np.median(filtered)
+    filtered[filtered < 0] = 0
+    mask = np.zeros(filtered.shape)
+    edge = extractor.config.edge_pixels
+    height, width = filtered.shape
+
+    edgeless_filtered = clip.crop_rectangle.subimage(filtered)
+    thresh, mass = tools.blur_and_return_as_mask(
+        edgeless_filtered, threshold=clip.threshold
+    )
+    dilated = np.uint8(thresh)
+    if extractor.config.dilation_pixels > 0:
+        dilated = cv2.dilate(dilated, extractor.dilate_kernel, iterations=1)
+    labels, small_mask, stats, _ = cv2.connectedComponentsWithStats(dilated)
+    mask[edge : height - edge, edge : width - edge] = small_mask
+    if prev_filtered is not None:
+        delta_frame = np.abs(filtered - prev_filtered)
+        for i in range(1, labels):
+            x, y, w, h = stats[i, :4]
+            np.var(delta_frame[y + edge : y + edge + h, x + edge : x + edge + w])
+    return filtered
+
+
+def workspace_frame(extractor, clip, thermal, prev_filtered, workspace):
+    """ The frame processing of ClipTrackExtractor._process_frame, without region matching """
+    filtered, mask = workspace.next_outputs()
+    extractor._get_filtered_frame(clip, thermal, workspace, out=filtered)
+    edgeless_filtered = clip.crop_rectangle.subimage(filtered)
+    thresh, mass = workspace.blur_and_threshold(edgeless_filtered, clip.threshold)
+    dilated = thresh
+    if extractor.config.dilation_pixels > 0:
+        dilated = workspace.dilate(dilated, extractor.dilate_kernel)
+    labels, stats = workspace.connected_components(dilated, mask)
+    if prev_filtered is not None:
+        edge = extractor.config.edge_pixels
+        for i in range(1, labels):
+            x, y, w, h = stats[i, :4]
+            window = np.s_[y + edge : y + edge + h, x + edge : x + edge + w]
+            np.var(np.abs(filtered[window] - prev_filtered[window]))
+    return filtered
+
+
+def time_frames(process, frames):
+    """ Returns the time taken to process each frame in milliseconds """
+    times = np.empty(len(frames))
+    prev_filtered = None
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        prev_filtered = process(frame, prev_filtered)
+        times[i] = (time.perf_counter() - start) * 1000
+    return times
+
+
+def frame_latency(tracking_config, num_frames=500, width=160, height=120):
+    """
+    Measures per frame latency of frame processing with and without a FrameWorkspace, as well as the
+    full ClipTrackExtractor._process_frame
+    :return: dictionary of name to per frame times in milliseconds
+    """
+    frames = synthetic_frames(num_frames, width, height)
+    extractor = ClipTrackExtractor(tracking_config, False, False, keep_frames=False)
+    clip = create_clip(extractor, frames)
+    workspace = FrameWorkspace(
+        (height, width),
+        tracking_config.edge_pixels,
+        FrameWorkspace.filtered_dtype(clip),
+        reuse_outputs=True,
+    )
+
+    results = {}
+    results["allocating"] = time_frames(
+        lambda frame, prev: allocating_frame(extractor, clip, frame, prev), frames
+    )
+    results["workspace"] = time_frames(
+        lambda frame, prev: workspace_frame(extractor, clip, frame, prev, workspace),
+        frames,
+    )
+
+    def track_frame(frame, prev):
+        extractor._process_frame(clip, frame)
+        clip.frame_on += 1
+
+    results["process_frame"] = time_frames(track_frame, frames)
+    return results
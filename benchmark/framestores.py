@@ -0,0 +1,133 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from load.clip import Clip
+from load.cliptrackextractor import ClipTrackExtractor
+from track.framebuffer import FrameBuffer
+from .synthetic import generate_clip, track_synthetic_clip
+
+MEMORY = "memory"
+COMPRESSED = "compressed"
+DISK = "disk"
+STORES = [MEMORY, COMPRESSED, DISK]
+
+
+def tracked_frames(tracking_config, filename=None, num_frames=300):
+    """ Tracks a CPTV file, or a synthetic clip if no filename is given, keeping all frames with optical flow """
+    if filename is None:
+        clip = track_synthetic_clip(
+            tracking_config, generate_clip(num_frames), use_opt_flow=True
+        )
+    else:
+        extractor = ClipTrackExtractor(tracking_config, True, False)
+        clip = Clip(tracking_config, filename)
+        extractor.parse_clip(clip)
+    return clip.frame_buffer.frames
+
+
+def frame_bytes(frame):
+    return sum(
+        array.nbytes
+        for array in (frame.thermal, frame.filtered, frame.mask, frame.flow)
+        if array is not None
+    )
+
+
+def time_store(store, frames, folder, flow_backend, seed=0):
+    """
+    Adds frames to a frame buffer using store, then reads them all in order and again in a random order
+    :return: dictionary of bytes_per_frame, and add_ms, sequential_ms and random_ms per frame
+    """
+    frame_buffer = FrameBuffer(
+        os.path.join(folder, "frames.cptv"),
+        False,
+        store == DISK,
+        False,
+        True,
+        flow_backend=flow_backend,
+        compress_frames=store == COMPRESSED,
+    )
+    start = time.perf_counter()
+    for frame in frames:
+        if frame_buffer.cache:
+            frame_buffer.cache.add_frame(frame)
+        else:
+            frame_buffer.frames.append(frame)
+    add_seconds = time.perf_counter() - start
+
+    if store == MEMORY:
+        total_bytes = sum(frame_bytes(frame) for frame in frames)
+    elif store == COMPRESSED:
+        total_bytes = frame_buffer.cache.nbytes
+    else:
+        frame_buffer.close_cache()
+        total_bytes = os.path.getsize(frame_buffer.cache.filename)
+
+    start = time.perf_counter()
+    for _ in frame_buffer:
+        pass
+    sequential_seconds = time.perf_counter() - start
+
+    order = np.random.RandomState(seed).permutation(len(frames))
+    start = time.perf_counter()
+    for frame_number in order.tolist():
+        frame_buffer.get_frame(frame_number)
+    random_seconds = time.perf_counter() - start
+    frame_buffer.remove_cache()
+
+    num_frames = max(1, len(frames))
+    return {
+        "bytes_per_frame": total_bytes / num_frames,
+        "add_ms": add_seconds * 1000 / num_frames,
+        "sequential_ms": sequential_seconds * 1000 / num_frames,
+        "random_ms": random_seconds * 1000 / num_frames,
+    }
+
+
+def frame_stores(tracking_config, filenames=None, num_frames=300, stores=None):
+    """
+    Measures the memory per frame and the cost of adding and reading frames for each way a FrameBuffer can store
+    frames.  Frames are tracked first, so only storing them is measured.
+    :param filenames: CPTV files to use, a synthetic clip of num_frames is used if not given
+    :return: dictionary of store to the time_store results, averaged over clips
+    """
+    if stores is None:
+        stores = STORES
+    clips_frames = [
+        tracked_frames(tracking_config, filename, num_frames)
+        for filename in (filenames or [None])
+    ]
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for store in stores:
+            clip_results = [
+                time_store(store, frames, folder, tracking_config.flow_backend)
+                for frames in clips_frames
+            ]
+            results[store] = {
+                name: float(np.mean([result[name] for result in clip_results]))
+                for name in clip_results[0]
+            }
+    return results
@@ -0,0 +1,247 @@
+import argparse
+import os
+
+import numpy as np
+
+from config.config import Config
+from ml_tools.logs import init_logging
+from track.trackmatcher import TrackMatcher
+from .framelatency import frame_latency
+from .flowregions import flow_regions
+from .flowbackends import flow_backends
+from .trackersuite import tracker_suite
+from .framestores import frame_stores, STORES
+
+
+def print_times(results):
+    print("{:<16}{:>10}{:>10}{:>10}".format("", "mean ms", "median ms", "p95 ms"))
+    for name, times in results.items():
+        print(
+            "{:<16}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                name, np.mean(times), np.median(times), np.percentile(times, 95)
+            )
+        )
+
+
+def frames(args, config):
+    results = frame_latency(
+        config.tracking, num_frames=args.frames, width=args.width, height=args.height
+    )
+    print_times(results)
+
+
+def flow(args, config):
+    fps, differences = flow_regions(
+        config.tracking, num_frames=args.frames, width=args.width, height=args.height
+    )
+    for flow_mode, frames_per_second in fps.items():
+        print("{:<16}{:>10.1f} fps".format(flow_mode, frames_per_second))
+    if len(differences) > 0:
+        print(
+            "flow difference in track regions mean {:.4f} p95 {:.4f} max {:.4f}".format(
+                np.mean(differences),
+                np.percentile(differences, 95),
+                np.max(differences),
+            )
+        )
+
+
+def backends(args, config):
+    backends = args.backends.split(",") if args.backends else None
+    kerasmodel = False
+    if args.model_file:
+        kerasmodel = os.path.splitext(args.model_file)[1] == ".pb"
+    results = flow_backends(
+        config, args.clips, backends, args.model_file, kerasmodel, args.high_quality,
+    )
+    print("{:<16}{:>10}{:>10}{:>8}".format("", "ms/frame", "accuracy", "tracks"))
+    for backend, result in results.items():
+        accuracy = result.get("accuracy")
+        print(
+            "{:<16}{:>10.2f}{:>10}{:>8}".format(
+                backend,
+                result["ms_per_frame"],
+                "-" if accuracy is None else "{:.3f}".format(accuracy),
+                result.get("tracks", "-"),
+            )
+        )
+
+
+def tracker(args, config):
+    if args.prediction:
+        config.tracking.track_prediction = args.prediction
+    results = tracker_suite(
+        config.tracking,
+        [int(length) for length in args.lengths.split(",")],
+        [int(count) for count in args.animals.split(",")],
+        args.width,
+        args.height,
+        args.flow,
+        not args.discard_frames,
+        args.stop_start,
+        args.seed,
+    )
+    columns = [
+        "frames",
+        "animals",
+        "fps",
+        "peak MB",
+        "tracks",
+        "missed",
+        "switches",
+        "false",
+    ]
+    print(("{:>9}" * len(columns)).format(*columns))
+    for result in results:
+        print(
+            "{:>9}{:>9}{:>9.1f}{:>9.1f}{:>9}{:>9}{:>9}{:>9}".format(
+                result["frames"],
+                result["animals"],
+                result["fps"],
+                result["peak_mb"],
+                "{}/{}".format(result["tracks"], result["ground_truth_tracks"]),
+                "{}/{}".format(result["missed_frames"], result["ground_truth_frames"]),
+                result["id_switches"],
+                result["false_frames"],
+            )
+        )
+
+
+def stores(args, config):
+    results = frame_stores(
+        config.tracking,
+        args.clips,
+        args.frames,
+        args.stores.split(",") if args.stores else None,
+    )
+    columns = ["KB/frame", "add ms", "seq ms", "random ms"]
+    print(("{:<12}" + "{:>11}" * len(columns)).format("", *columns))
+    for store, result in results.items():
+        print(
+            "{:<12}{:>11.1f}{:>11.3f}{:>11.3f}{:>11.3f}".format(
+                store,
+                result["bytes_per_frame"] / 1024,
+                result["add_ms"],
+                result["sequential_ms"],
+                result["random_ms"],
+            )
+        )
+
+
+def add_frame_args(parser, default_frames):
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=default_frames,
+        help="Number of frames to process",
+    )
+    parser.add_argument("--width", type=int, default=160, help="Frame width")
+    parser.add_argument("--height", type=int, default=120, help="Frame height")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config-file", help="Path to config file to use")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    frames_parser = subparsers.add_parser(
+        "frames", help="Per frame latency of the frame processing in tracking"
+    )
+    add_frame_args(frames_parser, 500)
+    frames_parser.set_defaults(func=frames)
+
+    flow_parser = subparsers.add_parser(
+        "flow",
+        help="Compare optical flow calculated for the full frame to only around regions",
+    )
+    add_frame_args(flow_parser, 200)
+    flow_parser.set_defaults(func=flow)
+
+    backends_parser = subparsers.add_parser(
+        "flow-backends",
+        help="Compare the speed of optical flow backends on CPTV files, and classification accuracy if a model is given",
+    )
+    backends_parser.add_argument("clips", nargs="+", help="CPTV files to use")
+    backends_parser.add_argument(
+        "-b",
+        "--backends",
+        help="Comma separated optical flow backends to compare, defaults to all",
+    )
+    backends_parser.add_argument(
+        "-m",
+        "--model-file",
+        help="Model to measure accuracy with, clips need metadata files of human tagged tracks",
+    )
+    backends_parser.add_argument(
+        "--high-quality",
+        action="store_true",
+        help="Use high quality settings for backends which support it",
+    )
+    backends_parser.set_defaults(func=backends)
+
+    tracker_parser = subparsers.add_parser(
+        "tracker",
+        help="Speed, peak memory and accuracy of tracking synthetic clips with known tracks",
+    )
+    tracker_parser.add_argument(
+        "--lengths",
+        default="100,300,900",
+        help="Comma separated clip lengths in frames",
+    )
+    tracker_parser.add_argument(
+        "--animals",
+        default="1,2,4",
+        help="Comma separated numbers of animals in a clip at once",
+    )
+    tracker_parser.add_argument("--width", type=int, default=160, help="Frame width")
+    tracker_parser.add_argument("--height", type=int, default=120, help="Frame height")
+    tracker_parser.add_argument(
+        "--flow", action="store_true", help="Calculate optical flow while tracking"
+    )
+    tracker_parser.add_argument(
+        "--discard-frames",
+        action="store_true",
+        help="Don't keep frames in memory while tracking",
+    )
+    tracker_parser.add_argument(
+        "--stop-start",
+        action="store_true",
+        help="Animals stop and start again at random",
+    )
+    tracker_parser.add_argument(
+        "--prediction",
+        choices=TrackMatcher.PREDICTIONS,
+        help="How tracks are expected to move when matching, defaults to the configured track_prediction",
+    )
+    tracker_parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed for the synthetic clips"
+    )
+    tracker_parser.set_defaults(func=tracker)
+
+    stores_parser = subparsers.add_parser(
+        "frame-stores",
+        help="Memory per frame and cost of adding and reading frames for each way frames can be stored",
+    )
+    stores_parser.add_argument(
+        "clips", nargs="*", help="CPTV files to use, defaults to a synthetic clip"
+    )
+    stores_parser.add_argument(
+        "--frames",
+        type=int,
+        default=300,
+        help="Number of frames of the synthetic clip",
+    )
+    stores_parser.add_argument(
+        "-s",
+        "--stores",
+        help="Comma separated frame stores to compare from {}, defaults to all".format(
+            STORES
+        ),
+    )
+    stores_parser.set_defaults(func=stores)
+
+    args = parser.parse_args()
+    config = Config.load_from_file(args.config_file)
+    init_logging()
+    args.func(args, config)
@@ -0,0 +1,337 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from datetime import timedelta
+
+from cptv import Frame
+import numpy as np
+
+from load.clip import Clip
+from load.cliptrackextractor import ClipTrackExtractor
+
+
+def synthetic_frames(num_frames, width=160, height=120, num_animals=2, seed=0):
+    """
+    Generates thermal frames of warm blobs moving over a noisy background
+    :return: uint16 array of shape [frames, height, width]
+    """
+    random = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    background = 2900 + 0.5 * x + 0.25 * y
+    positions = random.uniform((10, 10), (width - 10, height - 10), (num_animals, 2))
+    velocities = random.uniform(-2, 2, (num_animals, 2))
+    frames = np.empty((num_frames, height, width), dtype=np.uint16)
+    for i in range(num_frames):
+        frame = background + random.normal(0, 5, (height, width))
+        for (pos_x, pos_y) in positions:
+            frame += 150 * np.exp(-((x - pos_x) ** 2 + (y - pos_y) ** 2) / 20.0)
+        positions += velocities
+        velocities[positions < 0] *= -1
+        velocities[:, 0][positions[:, 0] > width] *= -1
+        velocities[:, 1][positions[:, 1] > height] *= -1
+        frames[i] = frame
+    return frames
+
+
+def create_clip(extractor, frames):
+    """
+    Creates a clip for frames, with the background and threshold calculated from all frames like the
+    "stats" background_calc. Frames can then be tracked with extractor._process_frame.
+    """
+    extractor.config.background_calc = "stats"
+    clip = Clip(extractor.config, "synthetic")
+    clip.set_res(frames.shape[2], frames.shape[1])
+    clip.set_frame_buffer(
+        extractor.config.high_quality_optical_flow,
+        extractor.cache_to_disk,
+        extractor.use_opt_flow,
+        extractor.keep_frames,
+    )
+    clip.background = np.percentile(frames, q=10, axis=0)
+    clip._set_from_background()
+    extractor._whole_clip_stats(clip, frames)
+    return clip
+
+
+def track_frames(extractor, clip, frames):
+    for frame in frames:
+        extractor._process_frame(clip, frame)
+        clip.frame_on += 1
+
+
+class GroundTruthTrack:
+    """ Centre of a synthetic animal for each frame from start_frame while it is in the clip """
+
+    def __init__(self, start_frame, radius):
+        self.start_frame = start_frame
+        self.radius = radius
+        self.positions = []
+
+    @property
+    def end_frame(self):
+        return self.start_frame + len(self.positions) - 1
+
+    def position(self, frame_number):
+        index = frame_number - self.start_frame
+        if index < 0 or index >= len(self.positions):
+            return None
+        return self.positions[index]
+
+
+class SyntheticClip:
+    """ CPTV like frames of a synthetic clip, and the ground truth tracks of the animals in it """
+
+    def __init__(self, frames, tracks, width, height, frames_per_second):
+        self.frames = frames
+        self.tracks = tracks
+        self.width = width
+        self.height = height
+        self.frames_per_second = frames_per_second
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class _Animal:
+    def __init__(self, random, track, x, y, heading):
+        self.track = track
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.speed = random.uniform(0.5, 2.0)
+        self.sigma = track.radius / 2
+        self.temperature = random.uniform(120, 250)
+        self.stopped = 0
+
+
+def _spawn_animal(random, frame_number, width, height, from_edge):
+    """ Creates an animal either just outside a random edge heading into the frame, or inside the frame """
+    radius = random.uniform(5, 8)
+    track = GroundTruthTrack(frame_number, radius)
+    if not from_edge:
+        x, y = random.uniform((radius, radius), (width - radius, height - radius))
+        return _Animal(random, track, x, y, random.uniform(0, 2 * np.pi))
+
+    side = random.randint(4)
+    spread = random.uniform(-np.pi / 4, np.pi / 4)
+    if side == 0:
+        x, y, heading = -radius, random.uniform(0, height), 0
+    elif side == 1:
+        x, y, heading = width + radius, random.uniform(0, height), np.pi
+    elif side == 2:
+        x, y, heading = random.uniform(0, width), -radius, np.pi / 2
+    else:
+        x, y, heading = random.uniform(0, width), height + radius, -np.pi / 2
+    return _Animal(random, track, x, y, heading + spread)
+
+
+def generate_clip(
+    num_frames,
+    num_animals=2,
+    width=160,
+    height=120,
+    noise=5,
+    ffc_interval=300,
+    ffc_shift=40,
+    edge_entries=True,
+    stop_start=False,
+    frames_per_second=Clip.FRAMES_PER_SECOND,
+    seed=0,
+):
+    """
+    Generates a clip of warm animals wandering over a noisy background, with known ground truth tracks.
+    :param num_animals: number of animals in the clip at once
+    :param noise: standard deviation of per pixel noise
+    :param ffc_interval: frames between flat field corrections, None for no FFC events.  Frames for
+    MotionDetector.FFC_PERIOD after an FFC are affected by it and have an uneven temperature shift
+    :param edge_entries: animals enter from the edges and leave the frame, with a new animal entering after
+    each one leaves.  Otherwise animals start inside the frame and bounce off the edges
+    :param stop_start: animals stop for up to a few seconds at random, then set off again at a new speed
+    :return: SyntheticClip
+    """
+    random = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    background = 2900 + 0.5 * x + 0.25 * y
+    # distance from the centre, used for the uneven shift after an FFC
+    ffc_pattern = np.hypot(x - width / 2, y - height / 2) / np.hypot(width, height)
+    ffc_decay = frames_per_second * 2
+
+    tracks = []
+    animals = [None] * num_animals
+    if edge_entries:
+        spawn_frames = list(random.randint(0, max(1, num_frames // 4), num_animals))
+    else:
+        spawn_frames = [0] * num_animals
+    last_ffc = None
+    frames = []
+    for frame_number in range(num_frames):
+        if ffc_interval and frame_number > 0 and frame_number % ffc_interval == 0:
+            last_ffc = frame_number
+        pix = background + random.normal(0, noise, (height, width))
+        if last_ffc is not None:
+            pix += (
+                ffc_shift * np.exp(-(frame_number - last_ffc) / ffc_decay) * ffc_pattern
+            )
+
+        for i, animal in enumerate(animals):
+            if animal is None:
+                if spawn_frames[i] != frame_number:
+                    continue
+                animal = _spawn_animal(
+                    random, frame_number, width, height, edge_entries
+                )
+                animals[i] = animal
+                tracks.append(animal.track)
+            animal.track.positions.append((animal.x, animal.y))
+            pix += animal.temperature * np.exp(
+                -((x - animal.x) ** 2 + (y - animal.y) ** 2) / (2 * animal.sigma ** 2)
+            )
+
+            if stop_start:
+                if animal.stopped > 0:
+                    animal.stopped -= 1
+                    continue
+                if random.rand() < 0.02:
+                    animal.stopped = random.randint(5, 40)
+                    animal.speed = random.uniform(0.5, 3.0)
+
+            animal.heading += random.normal(0, 0.1)
+            animal.x += animal.speed * np.cos(animal.heading)
+            animal.y += animal.speed * np.sin(animal.heading)
+            radius = animal.track.radius
+            if edge_entries:
+                if (
+                    animal.x < -radius
+                    or animal.x > width + radius
+                    or animal.y < -radius
+                    or animal.y > height + radius
+                ):
+                    animals[i] = None
+                    spawn_frames[i] = frame_number + random.randint(5, 50)
+            else:
+                if animal.x < radius or animal.x > width - radius:
+                    animal.heading = np.pi - animal.heading
+                if animal.y < radius or animal.y > height - radius:
+                    animal.heading = -animal.heading
+
+        time_on = timedelta(seconds=frame_number / frames_per_second)
+        last_ffc_time = None
+        if last_ffc is not None:
+            last_ffc_time = timedelta(seconds=last_ffc / frames_per_second)
+        frames.append(Frame(np.uint16(np.clip(pix, 0, 65535)), time_on, last_ffc_time))
+    return SyntheticClip(frames, tracks, width, height, frames_per_second)
+
+
+def track_synthetic_clip(
+    tracking_config, synthetic_clip, use_opt_flow=False, keep_frames=True
+):
+    """
+    Tracks a synthetic clip the same way as a CPTV file is tracked with the "stats" background_calc
+    :return: tracked clip
+    """
+    tracking_config.background_calc = "stats"
+    extractor = ClipTrackExtractor(tracking_config, use_opt_flow, False, keep_frames)
+    clip = Clip(tracking_config, "synthetic")
+    clip.frames_per_second = synthetic_clip.frames_per_second
+    clip.set_res(synthetic_clip.width, synthetic_clip.height)
+    clip.set_frame_buffer(
+        tracking_config.high_quality_optical_flow, False, use_opt_flow, keep_frames
+    )
+    extractor.process_frames(clip, synthetic_clip.frames)
+    extractor.apply_track_filtering(clip)
+    return clip
+
+
+def evaluate_tracks(synthetic_clip, tracks, edge=0, tolerance=2):
+    """
+    Compares tracks to the ground truth of a synthetic clip.  For each frame every ground truth animal whose centre
+    is inside the frame, excluding edge pixels, is matched to the nearest track region containing its centre.
+    An animal with no match is a missed frame, and a match to a different track than the animal was last
+    matched to is an ID switch.
+    :param tolerance: pixels to grow track regions by when checking if they contain an animal
+    :return: dictionary of ground_truth_frames, missed_frames, id_switches, false_frames (track regions with no
+    animal), tracks and ground_truth_tracks
+    """
+    regions = {}
+    for track in tracks:
+        bounds = track.bounds[track.bounds["mass"] > 0]
+        for record in bounds:
+            regions.setdefault(int(record["frame_number"]), []).append(
+                (
+                    track.get_id(),
+                    record["x"] - tolerance,
+                    record["y"] - tolerance,
+                    record["x"] + record["width"] + tolerance,
+                    record["y"] + record["height"] + tolerance,
+                )
+            )
+
+    last_matches = {}
+    ground_truth_frames = 0
+    missed_frames = 0
+    id_switches = 0
+    false_frames = 0
+    for frame_number in range(len(synthetic_clip)):
+        frame_regions = regions.get(frame_number, [])
+        visible = []
+        for index, ground_truth in enumerate(synthetic_clip.tracks):
+            position = ground_truth.position(frame_number)
+            if position is None:
+                continue
+            x, y = position
+            if (
+                edge <= x < synthetic_clip.width - edge
+                and edge <= y < synthetic_clip.height - edge
+            ):
+                visible.append((index, x, y))
+
+        candidates = []
+        for index, x, y in visible:
+            for region_index, (track_id, left, top, right, bottom) in enumerate(
+                frame_regions
+            ):
+                if left <= x <= right and top <= y <= bottom:
+                    distance = np.hypot(x - (left + right) / 2, y - (top + bottom) / 2)
+                    candidates.append((distance, index, region_index, track_id))
+        candidates.sort()
+
+        matched = set()
+        used_regions = set()
+        for _, index, region_index, track_id in candidates:
+            if index in matched or region_index in used_regions:
+                continue
+            matched.add(index)
+            used_regions.add(region_index)
+            last_match = last_matches.get(index)
+            if last_match is not None and last_match != track_id:
+                id_switches += 1
+            last_matches[index] = track_id
+
+        ground_truth_frames += len(visible)
+        missed_frames += len(visible) - len(matched)
+        false_frames += len(frame_regions) - len(used_regions)
+
+    return {
+        "ground_truth_frames": ground_truth_frames,
+        "missed_frames": missed_frames,
+        "id_switches": id_switches,
+        "false_frames": false_frames,
+        "tracks": len(tracks),
+        "ground_truth_tracks": len(synthetic_clip.tracks),
+    }
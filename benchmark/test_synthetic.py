@@ -0,0 +1,47 @@
+from track.region import Region
+from track.track import Track
+from .synthetic import generate_clip, evaluate_tracks
+
+
+def ground_truth_track(ground_truth, track_id, start=None, end=None):
+    """ A track with a region around ground_truth positions from start to end """
+    track = Track("synthetic", track_id)
+    start = ground_truth.start_frame if start is None else start
+    end = ground_truth.end_frame if end is None else end
+    for frame_number in range(start, end + 1):
+        x, y = ground_truth.position(frame_number)
+        track.add_region(
+            Region(int(x) - 3, int(y) - 3, 6, 6, mass=20, frame_number=frame_number)
+        )
+    return track
+
+
+class TestSynthetic:
+    def test_generate_clip(self):
+        clip = generate_clip(50, num_animals=2, seed=1)
+        assert len(clip) == 50
+        assert clip.frames[0].pix.shape == (120, 160)
+        assert len(clip.tracks) >= 2
+        assert (
+            clip.frames[0].pix.mean() == generate_clip(50, seed=1).frames[0].pix.mean()
+        )
+
+    def test_evaluate_perfect_tracks(self):
+        clip = generate_clip(50, num_animals=1, edge_entries=False, seed=1)
+        tracks = [ground_truth_track(clip.tracks[0], 1)]
+        results = evaluate_tracks(clip, tracks)
+        assert results["ground_truth_frames"] == 50
+        assert results["missed_frames"] == 0
+        assert results["id_switches"] == 0
+        assert results["false_frames"] == 0
+
+    def test_evaluate_switches_and_misses(self):
+        clip = generate_clip(50, num_animals=1, edge_entries=False, seed=1)
+        ground_truth = clip.tracks[0]
+        tracks = [
+            ground_truth_track(ground_truth, 1, 0, 19),
+            ground_truth_track(ground_truth, 2, 30, 49),
+        ]
+        results = evaluate_tracks(clip, tracks)
+        assert results["missed_frames"] == 10
+        assert results["id_switches"] == 1
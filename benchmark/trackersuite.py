@@ -0,0 +1,81 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import time
+import tracemalloc
+
+from .synthetic import generate_clip, track_synthetic_clip, evaluate_tracks
+
+
+def tracker_suite(
+    tracking_config,
+    lengths=(100, 300, 900),
+    animal_counts=(1, 2, 4),
+    width=160,
+    height=120,
+    use_opt_flow=False,
+    keep_frames=True,
+    stop_start=False,
+    seed=0,
+):
+    """
+    Tracks synthetic clips of each length and number of animals, measuring speed, memory and accuracy.
+    Clips are tracked twice, once timed and once while tracing memory allocations so tracing doesn't slow the
+    timed run.  max_tracks is ignored so that long clips aren't scored on which tracks were kept.
+    :return: list of dictionaries of frames, animals, fps, peak_mb and the evaluate_tracks results
+    """
+    tracking_config.max_tracks = None
+    results = []
+    for num_frames in lengths:
+        for num_animals in animal_counts:
+            synthetic_clip = generate_clip(
+                num_frames,
+                num_animals,
+                width,
+                height,
+                stop_start=stop_start,
+                seed=seed,
+            )
+            start = time.perf_counter()
+            clip = track_synthetic_clip(
+                tracking_config, synthetic_clip, use_opt_flow, keep_frames
+            )
+            seconds = time.perf_counter() - start
+
+            tracemalloc.start()
+            track_synthetic_clip(
+                tracking_config, synthetic_clip, use_opt_flow, keep_frames
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            result = {
+                "frames": num_frames,
+                "animals": num_animals,
+                "fps": num_frames / seconds,
+                "peak_mb": peak / (1024 * 1024),
+            }
+            result.update(
+                evaluate_tracks(
+                    synthetic_clip, clip.tracks, tracking_config.edge_pixels
+                )
+            )
+            results.append(result)
+    return results
@@ -1,17 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import json
 import logging
 import os.path
+import threading
 import time
 from typing import Dict
 
 from datetime import datetime
 import numpy as np
 
+from classify.inferencebroker import InferenceBroker
+from classify.resultcache import ResultCache, file_hash, model_hash
 from classify.trackprediction import Predictions
 from load.clip import Clip
 from load.cliptrackextractor import ClipTrackExtractor
 from ml_tools import tools
-from ml_tools.cptvfileprocessor import CPTVFileProcessor
+from ml_tools.cptvfileprocessor import CPTVFileProcessor, process_job
+from ml_tools.pipeline import Pipeline, Stage
+from ml_tools.profiler import Profiler
 import ml_tools.globals as globs
 from ml_tools.model import Model
 from ml_tools.kerasmodel import KerasModel
@@ -21,12 +28,32 @@ from ml_tools.previewer import Previewer
 from track.track import Track
 
 
+class ClipJob:
+    """ A file being processed by ClipClassifier, passed from each stage of processing to the next """
+
+    def __init__(self, filename, predictions):
+        self.filename = filename
+        self.predictions = predictions
+        self.start = None
+        self.clip = None
+        # frames of each track to classify, from _classify_inputs
+        self.track_inputs = None
+        # file_hash of the file, when results are cached
+        self.clip_key = None
+        # metadata saved for the file before, if it doesn't need to be processed again
+        self.cached_result = None
+
+
 class ClipClassifier(CPTVFileProcessor):
     """ Classifies tracks within CPTV files. """
 
     # skips every nth frame.  Speeds things up a little, but reduces prediction quality.
     FRAME_SKIP = 1
 
+    # a little weight decay helps the model not lock into an initial impression.
+    # 0.98 represents a half life of around 3 seconds.
+    STATE_DECAY = 0.98
+
     def __init__(self, config, tracking_config, model_file, kerasmodel=False):
         """ Create an instance of a clip classifier"""
 
@@ -44,11 +71,34 @@ class ClipClassifier(CPTVFileProcessor):
         self.cache_to_disk = self.config.classify.cache_to_disk
         # enables exports detailed information for each track.  If preview mode is enabled also enables track previews.
         self.enable_per_track_information = False
-        self.track_extractor = ClipTrackExtractor(
+        self.track_extractor = self._create_track_extractor()
+        # classifies tracks for all threads while process_all batches inference
+        self.broker = None
+        self.result_cache = None
+        if self.config.classify.result_cache:
+            self.result_cache = ResultCache(
+                os.path.join(self.config.classify.classify_folder, "cache"),
+                {
+                    "tracking": self.config.tracking.results_dict(),
+                    "classify_tracking": self.tracker_config.results_dict(),
+                    "version": Clip.VERSION,
+                },
+                {
+                    "model": model_hash(model_file, kerasmodel),
+                    "kerasmodel": kerasmodel,
+                    "use_opt_flow": self.track_extractor.use_opt_flow,
+                    "frame_skip": self.FRAME_SKIP,
+                    "state_decay": self.STATE_DECAY,
+                },
+            )
+
+    def _create_track_extractor(self):
+        return ClipTrackExtractor(
             self.config.tracking,
             self.config.use_opt_flow
-            or config.classify.preview == Previewer.PREVIEW_TRACKING,
+            or self.config.classify.preview == Previewer.PREVIEW_TRACKING,
             self.config.classify.cache_to_disk,
+            crop_frames=self.config.tracking.crop_frames and not self.previewer,
         )
 
     def preprocess(self, frame, thermal_reference):
@@ -73,86 +123,128 @@ class ClipClassifier(CPTVFileProcessor):
         :param track: the track to identify.
         :return: TrackPrediction object
         """
+        return self.identify_tracks(clip, [track])[0]
+
+    def identify_tracks(self, clip: Clip, tracks, predictions=None):
+        """
+        Identifies each of tracks as identify_track does.  The frames of all tracks are classified together, so
+        the model is run once for each frame of the longest track rather than once for every frame.
+        :param predictions: Predictions to add the track predictions to, defaults to self.predictions
+        :return: list of TrackPrediction objects, or None for tracks with a frame which could not be classified
+        """
+        track_inputs = [self._classify_inputs(clip, track) for track in tracks]
+        return self._classify_track_inputs(tracks, track_inputs, predictions)
+
+    def _classify_track_inputs(self, tracks, track_inputs, predictions=None):
+        """
+        Classifies the frames from _classify_inputs of each of tracks
+        :return: list of TrackPrediction objects, or None for tracks with a frame which could not be classified
+        """
+        if predictions is None:
+            predictions = self.predictions
+        if self.kerasmodel:
+            track_outputs = [
+                (
+                    [self.classifier.classify_frame(frame) for frame in frames],
+                    [0.0] * len(frames),
+                )
+                for frames, _ in track_inputs
+            ]
+        elif self.broker:
+            futures = [
+                self.broker.submit(np.asarray(frames)) for frames, _ in track_inputs
+            ]
+            track_outputs = [future.result() for future in futures]
+        else:
+            track_outputs = self.classifier.classify_sequences_with_novelty(
+                [np.asarray(frames) for frames, _ in track_inputs],
+                state_decay=self.STATE_DECAY,
+            )
+        return [
+            self._predict_track(predictions, track, outputs[0], outputs[1], complete)
+            for track, (_, complete), outputs in zip(
+                tracks, track_inputs, track_outputs
+            )
+        ]
+
+    def _classify_inputs(self, clip, track):
+        """
+        Crops and preprocesses the frames of track which are classified, every FRAME_SKIP frames
+        :return: list of frames to classify, False if a frame could not be classified, in which case only the
+            frames before it are returned
+        """
+        frames = []
+        for i, region in enumerate(track.bounds_history):
+            if i % self.FRAME_SKIP != 0:
+                continue
+            frame = clip.frame_buffer.get_frame(region.frame_number)
+            track_data = track.crop_by_region(frame, region)
+            if self.kerasmodel:
+                frames.append(track_data)
+                continue
 
+            # note: would be much better for the tracker to store the thermal references as it goes.
+            thermal_reference = frame.get_thermal_median()
+            # we use a tighter cropping here so we disable the default 2 pixel inset
+            preprocessed = Preprocessor.apply(
+                [track_data], [thermal_reference], default_inset=0
+            )
+            if preprocessed is None:
+                logging.info(
+                    "Frame {} of track could not be classified.".format(
+                        region.frame_number
+                    )
+                )
+                return frames, False
+            frames.append(preprocessed[0])
+        return frames, True
+
+    def _predict_track(self, clip_predictions, track, predictions, novelties, complete):
+        """
+        Adds the predictions and novelties of the classified frames of track to its TrackPrediction
+        :param clip_predictions: Predictions of the clip of track
+        :param complete: False if only some of the frames could be classified
+        """
         # uniform prior stats start with uniform distribution.  This is the safest bet, but means that
         # it takes a while to make predictions.  When off the first prediction is used instead causing
         # faster, but potentially more unstable predictions.
         UNIFORM_PRIOR = False
 
-        num_labels = len(self.classifier.labels)
-        prediction_smooth = 0.1
-
-        smooth_prediction = None
-        smooth_novelty = None
-
-        prediction = 0.0
-        novelty = 0.0
         try:
             fp_index = self.classifier.labels.index("false-positive")
         except ValueError:
             fp_index = None
 
-        # go through making classifications at each frame
-        # note: we should probably be doing this every 9 frames or so.
-        state = None
-        track_prediction = self.predictions.get_or_create_prediction(track)
+        track_prediction = clip_predictions.get_or_create_prediction(track)
         for i, region in enumerate(track.bounds_history):
-            frame = clip.frame_buffer.get_frame(region.frame_number)
-
-            track_data = track.crop_by_region(frame, region)
-
-            # note: would be much better for the tracker to store the thermal references as it goes.
-            # frame = clip.frame_buffer.get_frame(frame_number)
-            thermal_reference = np.median(frame.thermal)
-            # track_data = track.crop_by_region_at_trackframe(frame, i)
-            if i % self.FRAME_SKIP == 0:
-                if self.kerasmodel:
-                    prediction = self.classifier.classify_frame(track_data)
-                else:
-                    # we use a tighter cropping here so we disable the default 2 pixel inset
-                    frames = Preprocessor.apply(
-                        [track_data], [thermal_reference], default_inset=0
-                    )
-
-                    if frames is None:
-                        logging.info(
-                            "Frame {} of track could not be classified.".format(
-                                region.frame_number
-                            )
-                        )
-                        return
-                    frame = frames[0]
-                    (
-                        prediction,
-                        novelty,
-                        state,
-                    ) = self.classifier.classify_frame_with_novelty(frame, state)
-                    # make false-positive prediction less strong so if track has dead footage it won't dominate a strong
-                    # score
-
-                    # a little weight decay helps the model not lock into an initial impression.
-                    # 0.98 represents a half life of around 3 seconds.
-                    state *= 0.98
-                if fp_index is not None:
-                    prediction[fp_index] *= 0.8
-                # precondition on weight,  segments with small mass are weighted less as we can assume the error is
-                # higher here.
-                mass = region.mass
-
-                # we use the square-root here as the mass is in units squared.
-                # this effectively means we are giving weight based on the diameter
-                # of the object rather than the mass.
-                mass_weight = np.clip(mass / 20, 0.02, 1.0) ** 0.5
-
-                # cropped frames don't do so well so restrict their score
-                cropped_weight = 0.7 if region.was_cropped else 1.0
-
-                track_prediction.classified_frame(
-                    region.frame_number,
-                    prediction,
-                    novelty,
-                    mass_weight * cropped_weight,
-                )
+            if i % self.FRAME_SKIP != 0:
+                continue
+            classified = i // self.FRAME_SKIP
+            if classified == len(predictions):
+                break
+            prediction = predictions[classified]
+            novelty = novelties[classified]
+            # make false-positive prediction less strong so if track has dead footage it won't dominate a strong
+            # score
+            if fp_index is not None:
+                prediction[fp_index] *= 0.8
+            # precondition on weight,  segments with small mass are weighted less as we can assume the error is
+            # higher here.
+            mass = region.mass
+
+            # we use the square-root here as the mass is in units squared.
+            # this effectively means we are giving weight based on the diameter
+            # of the object rather than the mass.
+            mass_weight = np.clip(mass / 20, 0.02, 1.0) ** 0.5
+
+            # cropped frames don't do so well so restrict their score
+            cropped_weight = 0.7 if region.was_cropped else 1.0
+
+            track_prediction.classified_frame(
+                region.frame_number, prediction, novelty, mass_weight * cropped_weight,
+            )
+        if not complete:
+            return None
         return track_prediction
 
     @property
@@ -178,6 +270,19 @@ class ClipClassifier(CPTVFileProcessor):
             logging.info("classifier loaded ({})".format(datetime.now() - t0))
         return globs._classifier
 
+    def init_worker(self):
+        """ Loads the model in a new worker process and runs it once, so the first file isn't slowed down """
+        if self.kerasmodel:
+            frame_size = self.classifier.frame_size
+            self.classifier.model.predict(
+                np.zeros((1, frame_size, frame_size, 3), dtype=np.float32)
+            )
+        else:
+            frame_shape = self.classifier.X.shape.as_list()[2:]
+            self.classifier.classify_sequences_with_novelty(
+                [np.zeros([1] + frame_shape, dtype=np.float32)]
+            )
+
     def get_meta_data(self, filename):
         """ Reads meta-data for a given cptv file. """
         source_meta_filename = os.path.splitext(filename)[0] + ".txt"
@@ -206,6 +311,30 @@ class ClipClassifier(CPTVFileProcessor):
         else:
             return None
 
+    def needs_processing(self, filename):
+        """
+        As CPTVFileProcessor.needs_processing, but files reprocessed with a result cache are skipped if their
+        metadata is already the cached result for this config and model
+        """
+        if not super().needs_processing(filename):
+            return False
+        meta_filename = self.get_classify_filename(filename) + ".txt"
+        if (
+            self.result_cache is None
+            or self.previewer
+            or not os.path.exists(meta_filename)
+        ):
+            return True
+        cached_result = self.result_cache.load_result(file_hash(filename))
+        if cached_result is None:
+            return True
+        with open(meta_filename) as f:
+            saved = json.load(f)
+        return (
+            saved.get("tracks") != cached_result["tracks"]
+            or saved.get("algorithm", {}).get("model") != self.model_file
+        )
+
     def get_classify_filename(self, input_filename):
         return os.path.splitext(
             os.path.join(
@@ -213,61 +342,244 @@ class ClipClassifier(CPTVFileProcessor):
             )
         )[0]
 
+    def process_all(self, root, **kwargs):
+        """
+        Processes all CPTV files in root.  If inference_batch_size is set, files are processed on worker_threads
+        threads of this process rather than in worker processes, and the tracks of all of them are classified in
+        batches by one InferenceBroker, so the model is only loaded once.
+        """
+        batch_size = self.config.classify.inference_batch_size
+        if self.kerasmodel or batch_size <= 0:
+            super().process_all(root, **kwargs)
+            return
+        with InferenceBroker(
+            self.classifier,
+            batch_size,
+            self.config.classify.inference_latency_ms / 1000,
+            self.STATE_DECAY,
+        ) as broker:
+            self.broker = broker
+            try:
+                super().process_all(root, **kwargs)
+            finally:
+                self.broker = None
+        logging.info(
+            "Classified %s tracks in %s batches", broker.sequences, broker.batches
+        )
+
+    def _process_job_list(self, jobs):
+        if self.config.classify.pipeline:
+            profiles = self._process_pipelined(jobs)
+        elif self.broker is None:
+            profiles = super()._process_job_list(jobs)
+        else:
+            profiles = self._process_threaded(jobs)
+        if self.tracker_config.profile:
+            self._save_profile(profiles)
+
+    def _save_profile(self, profiles):
+        """ Saves the total time of each tracking stage over all clips processed """
+        profiler = Profiler(True)
+        for profile in profiles:
+            if profile is not None:
+                profiler.merge(profile)
+        filename = os.path.join(self.config.classify.classify_folder, "profile.json")
+        profiler.save(filename)
+        logging.info("Tracking profile saved to %s\n%s", filename, profiler.summary())
+
+    def worker_result(self, result):
+        # the profile of the clip
+        return result
+
+    def _process_threaded(self, jobs):
+        """
+        Processes jobs on worker_threads threads of this process, classifying with the broker
+        :return: list of the profile of each job
+        """
+        workers = threading.local()
+
+        def process_thread_job(job):
+            # the track extractor and predictions belong to one clip at a time, so each thread has its own
+            worker = getattr(workers, "classifier", None)
+            if worker is None:
+                worker = copy.copy(self)
+                worker.predictions = Predictions(self.classifier.labels)
+                worker.track_extractor = self._create_track_extractor()
+                workers.classifier = worker
+            return process_job((worker,) + tuple(job[1:]))
+
+        with ThreadPoolExecutor(max(1, self.workers_threads)) as pool:
+            return list(pool.map(process_thread_job, jobs))
+
+    def _process_pipelined(self, jobs):
+        """
+        Processes jobs with a Pipeline so consecutive files are tracked, preprocessed, classified and exported at
+        the same time, with pipeline_workers threads for each stage
+        :return: list of the profile of each job
+        """
+        workers = self.config.classify.pipeline_workers
+        # load the model before any stage needs it
+        labels = self.classifier.labels
+        extractors = threading.local()
+
+        def track(job):
+            # the track extractor belongs to one clip at a time, so each thread has its own
+            extractor = getattr(extractors, "track_extractor", None)
+            if extractor is None:
+                extractor = self._create_track_extractor()
+                extractors.track_extractor = extractor
+            return self.track_file(job, extractor)
+
+        profiles = []
+
+        def export(job):
+            self.export_clip(job)
+            profiles.append(self._job_profile(job))
+            return job
+
+        pipeline = Pipeline(
+            [
+                Stage("track", track, workers["track"]),
+                Stage("preprocess", self.preprocess_tracks, workers["preprocess"]),
+                Stage("classify", self.classify_tracks, workers["classify"]),
+                Stage("export", export, workers["export"]),
+            ],
+            self.config.classify.pipeline_queue_size,
+        )
+        pipeline.run(ClipJob(job[1], Predictions(labels)) for job in jobs)
+        logging.info("Pipeline stages:\n%s", pipeline.summary())
+        return profiles
+
     def process_file(self, filename, **kwargs):
         """
         Process a file extracting tracks and identifying them.
         :param filename: filename to process
         :param enable_preview: if true an MPEG preview file is created.
+        :return: profile of tracking stages as a dictionary, if profiling is enabled
         """
+        job = ClipJob(filename, self.predictions)
+        self.track_file(job)
+        self.preprocess_tracks(job)
+        self.classify_tracks(job)
+        self.export_clip(job)
+        self.predictions.clear_predictions()
+        return self._job_profile(job)
+
+    def _job_profile(self, job):
+        # files with cached results aren't tracked so have no profile
+        if self.tracker_config.profile and job.clip is not None:
+            return job.clip.profiler.as_dict()
+        return None
+
+    def track_file(self, job, track_extractor=None):
+        """ First stage of processing a file, reads the file of job and extracts its tracks """
+        if not os.path.exists(job.filename):
+            raise Exception("File {} not found.".format(job.filename))
+
+        logging.info("Processing file '{}'".format(job.filename))
+
+        job.start = time.time()
+        cached_tracks = None
+        if self.result_cache:
+            job.clip_key = file_hash(job.filename)
+            # previews need the clip, so results are only reused without them
+            if not self.previewer:
+                job.cached_result = self.result_cache.load_result(job.clip_key)
+                if job.cached_result is not None:
+                    logging.info("Using cached results")
+                    return job
+            cached_tracks = self.result_cache.load_tracks(job.clip_key)
+
+        job.clip = Clip(self.tracker_config, job.filename)
+        if cached_tracks is not None:
+            logging.info("Using cached tracks")
+            job.clip.load_tracks(cached_tracks)
+        (track_extractor or self.track_extractor).parse_clip(job.clip)
+        if self.result_cache and cached_tracks is None:
+            self.result_cache.save_tracks(job.clip_key, job.clip.tracks)
+        return job
+
+    def preprocess_tracks(self, job):
+        """ Crops and preprocesses the frames of each track of job to classify """
+        if job.cached_result is not None:
+            return job
+        job.clip.calculate_track_flow()
+        job.track_inputs = [
+            self._classify_inputs(job.clip, track) for track in job.clip.tracks
+        ]
+        return job
+
+    def classify_tracks(self, job):
+        """ Classifies the preprocessed tracks of job """
+        if job.cached_result is not None:
+            return job
+        logging.info(os.path.basename(job.filename) + ":")
+        track_predictions = self._classify_track_inputs(
+            job.clip.tracks, job.track_inputs, job.predictions
+        )
+        job.track_inputs = None
+        for i, prediction in enumerate(track_predictions):
+            # tracks with a frame which could not be classified have no prediction
+            if prediction is None:
+                description = "no prediction"
+            else:
+                description = prediction.description(self.classifier.labels)
+            logging.info(
+                " - [{}/{}] prediction: {}".format(
+                    i + 1, len(job.clip.tracks), description
+                )
+            )
+        return job
 
-        if not os.path.exists(filename):
-            raise Exception("File {} not found.".format(filename))
-
-        logging.info("Processing file '{}'".format(filename))
-
-        start = time.time()
-        clip = Clip(self.tracker_config, filename)
-        self.track_extractor.parse_clip(clip)
-
-        classify_name = self.get_classify_filename(filename)
+    def export_clip(self, job):
+        """ Last stage of processing a file, saves the preview and metadata of job """
+        classify_name = self.get_classify_filename(job.filename)
         destination_folder = os.path.dirname(classify_name)
 
         if not os.path.exists(destination_folder):
             logging.info("Creating folder {}".format(destination_folder))
-            os.makedirs(destination_folder)
+            os.makedirs(destination_folder, exist_ok=True)
 
         mpeg_filename = classify_name + ".mp4"
 
         meta_filename = classify_name + ".txt"
 
-        logging.info(os.path.basename(filename) + ":")
-
-        for i, track in enumerate(clip.tracks):
-            prediction = self.identify_track(clip, track)
-            description = prediction.description(self.classifier.labels)
-            logging.info(
-                " - [{}/{}] prediction: {}".format(i + 1, len(clip.tracks), description)
-            )
-
+        if job.cached_result is not None:
+            logging.info("saving cached meta data %s", meta_filename)
+            save_file = job.cached_result
+            save_file["source"] = job.filename
+            save_file["algorithm"]["model"] = self.model_file
+            # options which don't change the results may have changed since
+            save_file["algorithm"]["tracker_config"] = self.tracker_config.as_dict()
+            # the original metadata may have changed since
+            self._add_cptv_meta(save_file, job.filename)
+            self._write_metadata(save_file, meta_filename)
+            return job
+
+        clip = job.clip
         if self.previewer:
             logging.info("Exporting preview to '{}'".format(mpeg_filename))
-            self.previewer.export_clip_preview(mpeg_filename, clip, self.predictions)
+            self.previewer.export_clip_preview(mpeg_filename, clip, job.predictions)
         logging.info("saving meta data %s", meta_filename)
-        self.save_metadata(filename, meta_filename, clip)
-        self.predictions.clear_predictions()
+        save_file = self.save_metadata(
+            job.filename, meta_filename, clip, job.predictions
+        )
+        if self.result_cache:
+            self.result_cache.save_result(job.clip_key, save_file)
+        if self.tracker_config.profile:
+            clip.profiler.save(classify_name + "-profile.json")
 
         if self.tracker_config.verbose:
             ms_per_frame = (
-                (time.time() - start) * 1000 / max(1, len(clip.frame_buffer.frames))
+                (time.time() - job.start) * 1000 / max(1, len(clip.frame_buffer.frames))
             )
             logging.info("Took {:.1f}ms per frame".format(ms_per_frame))
+        return job
 
-    def save_metadata(self, filename, meta_filename, clip):
-        if self.cache_to_disk:
-            clip.frame_buffer.remove_cache()
-
-        # read in original metadata
-        meta_data = self.get_meta_data(filename)
+    def save_metadata(self, filename, meta_filename, clip, predictions=None):
+        if predictions is None:
+            predictions = self.predictions
+        clip.frame_buffer.remove_cache()
 
         # record results in text file.
         save_file = {}
@@ -279,14 +591,11 @@ class ClipClassifier(CPTVFileProcessor):
         save_file["algorithm"]["model"] = self.model_file
         save_file["algorithm"]["tracker_version"] = clip.VERSION
         save_file["algorithm"]["tracker_config"] = self.tracker_config.as_dict()
-        if meta_data:
-            save_file["camera"] = meta_data["Device"]["devicename"]
-            save_file["cptv_meta"] = meta_data
-            save_file["original_tag"] = meta_data["primary_tag"]
+        self._add_cptv_meta(save_file, filename)
         save_file["tracks"] = []
         for track in clip.tracks:
             track_info = {}
-            prediction = self.predictions.prediction_for(track.get_id())
+            prediction = predictions.prediction_for(track.get_id())
             start_s, end_s = clip.start_and_end_in_secs(track)
             save_file["tracks"].append(track_info)
             track_info["start_s"] = round(start_s, 2)
@@ -317,6 +626,21 @@ class ClipClassifier(CPTVFileProcessor):
                 positions.append([track_time, region])
             track_info["positions"] = positions
 
+        self._write_metadata(save_file, meta_filename)
+        return save_file
+
+    def _add_cptv_meta(self, save_file, filename):
+        """ Adds the original metadata of filename to the metadata to save """
+        for key in ["camera", "cptv_meta", "original_tag"]:
+            save_file.pop(key, None)
+        # read in original metadata
+        meta_data = self.get_meta_data(filename)
+        if meta_data:
+            save_file["camera"] = meta_data["Device"]["devicename"]
+            save_file["cptv_meta"] = meta_data
+            save_file["original_tag"] = meta_data["primary_tag"]
+
+    def _write_metadata(self, save_file, meta_filename):
         if self.config.classify.meta_to_stdout:
             print(json.dumps(save_file, cls=tools.CustomJSONEncoder))
         else:
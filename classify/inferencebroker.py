@@ -0,0 +1,125 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+
+
+class InferenceBroker:
+    """
+    Classifies track sequences submitted from many threads with one model.  A model thread takes waiting
+    sequences until it has max_batch of them or the first has waited max_latency seconds, then classifies them
+    together with Model.classify_sequences_with_novelty, so sequences from different tracks and clips share
+    session runs.  Results are returned through futures.
+    """
+
+    def __init__(self, model, max_batch=32, max_latency=0.05, state_decay=1.0):
+        """
+        :param model: a Model, or any object with classify_sequences_with_novelty
+        :param max_latency: seconds to wait for more sequences to batch with the first waiting one
+        :param state_decay: passed on to classify_sequences_with_novelty
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.state_decay = state_decay
+        self.requests = queue.Queue()
+        self.thread = None
+        self.batches = 0
+        self.sequences = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """ Classifies any sequences already submitted and stops the model thread """
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, sequence):
+        """
+        Queues a sequence to be classified
+        :param sequence: numpy array of preprocessed frames of dims [F, C, H, W]
+        :return: a Future of the (predictions, novelties, states) of the sequence
+        """
+        if self.thread is None:
+            raise RuntimeError("InferenceBroker has not been started")
+        future = Future()
+        self.requests.put((sequence, future, time.monotonic()))
+        return future
+
+    def _next_batch(self):
+        """
+        Waits for a batch of requests
+        :return: list of requests, True if the broker has been stopped
+        """
+        request = self.requests.get()
+        if request is None:
+            return [], True
+        batch = [request]
+        deadline = request[2] + self.max_latency
+        while len(batch) < self.max_batch:
+            try:
+                request = self.requests.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._next_batch()
+            # requests cancelled while waiting are skipped
+            batch = [
+                request
+                for request in batch
+                if request[1].set_running_or_notify_cancel()
+            ]
+            if len(batch) == 0:
+                continue
+            try:
+                results = self.model.classify_sequences_with_novelty(
+                    [sequence for sequence, _, _ in batch], self.state_decay
+                )
+            except Exception as e:
+                logging.exception("Error classifying a batch of %s tracks", len(batch))
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.sequences += len(batch)
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,145 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from ml_tools import tools
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def _update_file_hash(digest, filename):
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+
+
+def file_hash(filename):
+    """ Hash of the contents of filename """
+    digest = hashlib.sha1()
+    _update_file_hash(digest, filename)
+    return digest.hexdigest()
+
+
+def values_hash(values):
+    """ Hash of json serializable values, such as a config as_dict """
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True, cls=tools.CustomJSONEncoder).encode()
+    ).hexdigest()
+
+
+def model_hash(model_file, kerasmodel=False):
+    """
+    Hash of the files of a model, every file in the folder of a keras model, or the files starting with
+    model_file, such as .meta, .index and .data, of a tensorflow model
+    """
+    folder = os.path.dirname(model_file)
+    if kerasmodel:
+        filenames = [
+            os.path.join(path, name)
+            for path, _, names in os.walk(folder)
+            for name in names
+        ]
+    else:
+        filenames = glob.glob(glob.escape(model_file) + ".*")
+    digest = hashlib.sha1()
+    for filename in sorted(filenames):
+        digest.update(os.path.relpath(filename, folder).encode())
+        _update_file_hash(digest, filename)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Caches the tracks and classification results of CPTV files, keyed by the hash of the file contents.  Tracks
+    are also keyed by everything tracking depends on, and results by everything classifying depends on as well,
+    so changing the model reuses the tracks, and processing a file again with the same config and model reuses
+    the results.
+    """
+
+    def __init__(self, folder, tracker_values, classify_values):
+        """
+        :param tracker_values: json serializable values tracking depends on, such as the tracker config
+        :param classify_values: json serializable values classifying depends on, such as the model_hash
+        """
+        self.folder = folder
+        self.tracker_key = values_hash(tracker_values)
+        self.model_key = values_hash(classify_values)
+        os.makedirs(folder, exist_ok=True)
+
+    def _filename(self, clip_key, extension, with_model=False):
+        name = "{}-{}".format(clip_key, self.tracker_key)
+        if with_model:
+            name += "-" + self.model_key
+        return os.path.join(self.folder, name + extension)
+
+    def _replace(self, filename, write):
+        """ Writes a file with write then moves it to filename, so other processes never read part of a file """
+        fd, temp_filename = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    def load_tracks(self, clip_key):
+        """
+        :param clip_key: file_hash of the CPTV file
+        :return: list of track id and Region.DTYPE bounds of each track, or None if not cached
+        """
+        filename = self._filename(clip_key, ".npz")
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename) as cached:
+            return [
+                (int(track_id), cached["bounds_{}".format(i)])
+                for i, track_id in enumerate(cached["ids"])
+            ]
+
+    def save_tracks(self, clip_key, tracks):
+        arrays = {"bounds_{}".format(i): track.bounds for i, track in enumerate(tracks)}
+        arrays["ids"] = np.int64([track.get_id() for track in tracks])
+        self._replace(
+            self._filename(clip_key, ".npz"),
+            lambda f: np.savez_compressed(f, **arrays),
+        )
+
+    def load_result(self, clip_key):
+        """ Returns the metadata saved for the CPTV file, or None if not cached """
+        filename = self._filename(clip_key, ".json", with_model=True)
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as f:
+            return json.load(f)
+
+    def save_result(self, clip_key, metadata):
+        self._replace(
+            self._filename(clip_key, ".json", with_model=True),
+            lambda f: f.write(
+                json.dumps(metadata, cls=tools.CustomJSONEncoder).encode()
+            ),
+        )
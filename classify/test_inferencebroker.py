@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from classify.inferencebroker import InferenceBroker
+
+
+class SumModel:
+    """ Predicts the running sum of each sequence, recording the size of each batch """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def classify_sequences_with_novelty(self, sequences, state_decay=1.0):
+        self.batch_sizes.append(len(sequences))
+        if any(len(sequence) == 0 for sequence in sequences):
+            raise ValueError("empty sequence")
+        return [
+            (np.cumsum(sequence), np.zeros(len(sequence)), None)
+            for sequence in sequences
+        ]
+
+
+class TestInferenceBroker:
+    def test_batches(self):
+        model = SumModel()
+        sequences = [np.arange(length) for length in range(1, 21)]
+        with InferenceBroker(model, max_batch=8, max_latency=1) as broker:
+            with ThreadPoolExecutor(4) as pool:
+                futures = list(pool.map(broker.submit, sequences))
+            results = [future.result() for future in futures]
+
+        for sequence, (predictions, _, _) in zip(sequences, results):
+            assert np.array_equal(predictions, np.cumsum(sequence))
+        assert sum(model.batch_sizes) == len(sequences)
+        assert max(model.batch_sizes) == 8
+        assert broker.batches == len(model.batch_sizes)
+
+    def test_errors(self):
+        model = SumModel()
+        with InferenceBroker(model, max_latency=0) as broker:
+            failed = broker.submit(np.arange(0))
+            with pytest.raises(ValueError):
+                failed.result()
+            assert broker.submit(np.arange(3)).result()[0].tolist() == [0, 1, 3]
+        with pytest.raises(RuntimeError):
+            broker.submit(np.arange(3))
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+from classify.resultcache import ResultCache, file_hash, model_hash, values_hash
+from config.config import Config
+from track.region import Region
+from track.track import Track
+
+
+def make_track(track_id, start_frame, num_frames):
+    track = Track(1, track_id)
+    for frame_number in range(start_frame, start_frame + num_frames):
+        track.add_region(
+            Region(frame_number, 10, 8, 6, 20 + frame_number, 1.5, 2, frame_number)
+        )
+    return track
+
+
+class TestResultCache:
+    def test_cache(self, tmp_path):
+        clip_file = os.path.join(tmp_path, "clip.cptv")
+        with open(clip_file, "wb") as f:
+            f.write(b"frames")
+        model_file = os.path.join(tmp_path, "model")
+        with open(model_file + ".meta", "wb") as f:
+            f.write(b"graph")
+        clip_key = file_hash(clip_file)
+        folder = os.path.join(tmp_path, "cache")
+        tracking = {"tracking": {"min_dimension": 2}}
+
+        cache = ResultCache(folder, tracking, {"model": model_hash(model_file)})
+        assert cache.load_tracks(clip_key) is None
+        assert cache.load_result(clip_key) is None
+        tracks = [make_track(1, 0, 5), make_track(3, 2, 8)]
+        cache.save_tracks(clip_key, tracks)
+        cache.save_result(clip_key, {"tracks": [{"label": "hedgehog"}]})
+
+        cached_tracks = cache.load_tracks(clip_key)
+        assert [track_id for track_id, _ in cached_tracks] == [1, 3]
+        for track, (_, bounds) in zip(tracks, cached_tracks):
+            assert np.array_equal(bounds, track.bounds)
+        assert cache.load_result(clip_key) == {"tracks": [{"label": "hedgehog"}]}
+
+        # a new model reuses the tracks but not the results
+        with open(model_file + ".meta", "wb") as f:
+            f.write(b"new graph")
+        cache = ResultCache(folder, tracking, {"model": model_hash(model_file)})
+        assert len(cache.load_tracks(clip_key)) == 2
+        assert cache.load_result(clip_key) is None
+
+        cache = ResultCache(
+            folder,
+            {"tracking": {"min_dimension": 3}},
+            {"model": model_hash(model_file)},
+        )
+        assert cache.load_tracks(clip_key) is None
+        assert [name for name in os.listdir(folder) if name.endswith(".tmp")] == []
+
+    def test_tracking_key(self):
+        config = Config.get_defaults().tracking
+        key = values_hash(config.results_dict())
+        # logging and profiling don't change the results
+        config.verbose = True
+        config.profile = True
+        assert values_hash(config.results_dict()) == key
+        config.edge_pixels += 1
+        assert values_hash(config.results_dict()) != key
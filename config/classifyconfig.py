@@ -35,6 +35,12 @@ class ClassifyConfig(DefaultConfig):
     preview = attr.ib()
     classify_folder = attr.ib()
     cache_to_disk = attr.ib()
+    inference_batch_size = attr.ib()
+    inference_latency_ms = attr.ib()
+    pipeline = attr.ib()
+    pipeline_workers = attr.ib()
+    pipeline_queue_size = attr.ib()
+    result_cache = attr.ib()
 
     @classmethod
     def load(cls, classify, base_folder):
@@ -46,6 +52,12 @@ class ClassifyConfig(DefaultConfig):
             ),
             classify_folder=path.join(base_folder, classify["classify_folder"]),
             cache_to_disk=classify["cache_to_disk"],
+            inference_batch_size=classify["inference_batch_size"],
+            inference_latency_ms=classify["inference_latency_ms"],
+            pipeline=classify["pipeline"],
+            pipeline_workers=classify["pipeline_workers"],
+            pipeline_queue_size=classify["pipeline_queue_size"],
+            result_cache=classify["result_cache"],
         )
 
     @classmethod
@@ -56,6 +68,12 @@ class ClassifyConfig(DefaultConfig):
             preview="none",
             classify_folder="classify",
             cache_to_disk=True,
+            inference_batch_size=0,
+            inference_latency_ms=50,
+            pipeline=False,
+            pipeline_workers={"track": 1, "preprocess": 1, "classify": 1, "export": 1},
+            pipeline_queue_size=2,
+            result_cache=False,
         )
 
     def validate(self):
@@ -37,6 +37,8 @@ class Config(DefaultConfig):
     previews_colour_map = attr.ib()
     use_gpu = attr.ib()
     worker_threads = attr.ib()
+    worker_max_jobs = attr.ib()
+    worker_max_rss_mb = attr.ib()
     debug = attr.ib()
     use_opt_flow = attr.ib()
 
@@ -77,6 +79,8 @@ class Config(DefaultConfig):
             previews_colour_map=raw["previews_colour_map"],
             use_gpu=raw["use_gpu"],
             worker_threads=raw["worker_threads"],
+            worker_max_jobs=raw["worker_max_jobs"],
+            worker_max_rss_mb=raw["worker_max_rss_mb"],
             labels=raw["labels"],
             build=BuildConfig.load(raw["build"]),
             debug=raw["debug"],
@@ -94,6 +98,8 @@ class Config(DefaultConfig):
             previews_colour_map="custom_colormap.dat",
             use_gpu=False,
             worker_threads=0,
+            worker_max_jobs=0,
+            worker_max_rss_mb=0,
             build=BuildConfig.get_defaults(),
             tracking=TrackingConfig.get_defaults(),
             load=LoadConfig.get_defaults(),
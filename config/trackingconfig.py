@@ -22,6 +22,8 @@ import attr
 from config import config
 from .defaultconfig import DefaultConfig
 from load.cliptrackextractor import ClipTrackExtractor
+from track.trackmatcher import TrackMatcher
+from ml_tools import opticalflow
 
 
 @attr.s
@@ -33,6 +35,7 @@ class TrackingConfig(DefaultConfig):
     delta_thresh = attr.ib()
     ignore_frames = attr.ib()
     threshold_percentile = attr.ib()
+    streaming_stats = attr.ib()
     static_background_threshold = attr.ib()
     max_mean_temperature_threshold = attr.ib()
     max_temperature_range_threshold = attr.ib()
@@ -41,7 +44,19 @@ class TrackingConfig(DefaultConfig):
     frame_padding = attr.ib()
     track_smoothing = attr.ib()
     remove_track_after_frames = attr.ib()
+    matching_method = attr.ib()
+    track_prediction = attr.ib()
     high_quality_optical_flow = attr.ib()
+    flow_backend = attr.ib()
+    flow_mode = attr.ib()
+    flow_region_padding = attr.ib()
+    deferred_flow = attr.ib()
+    flow_threads = attr.ib()
+    flow_workers = attr.ib()
+    compress_frames = attr.ib()
+    frame_buffer_mb = attr.ib()
+    crop_frames = attr.ib()
+    cache_write_behind = attr.ib()
     min_threshold = attr.ib()
     max_threshold = attr.ib()
     flow_threshold = attr.ib()
@@ -55,6 +70,7 @@ class TrackingConfig(DefaultConfig):
     aoi_pixel_variance = attr.ib()
     cropped_regions_strategy = attr.ib()
     verbose = attr.ib()
+    profile = attr.ib()
     enable_track_output = attr.ib()
     min_tag_confidence = attr.ib()
     moving_vel_thresh = attr.ib()
@@ -79,6 +95,7 @@ class TrackingConfig(DefaultConfig):
             delta_thresh=tracking["preview"]["delta_thresh"],
             ignore_frames=tracking["preview"]["ignore_frames"],
             threshold_percentile=tracking["stats"]["threshold_percentile"],
+            streaming_stats=tracking["stats"]["streaming"],
             min_threshold=tracking["stats"]["min_threshold"],
             max_threshold=tracking["stats"]["max_threshold"],
             static_background_threshold=tracking["static_background_threshold"],
@@ -89,7 +106,29 @@ class TrackingConfig(DefaultConfig):
             frame_padding=tracking["frame_padding"],
             track_smoothing=tracking["track_smoothing"],
             remove_track_after_frames=tracking["remove_track_after_frames"],
+            matching_method=config.parse_options_param(
+                "matching_method", tracking["matching_method"], TrackMatcher.METHODS
+            ),
+            track_prediction=config.parse_options_param(
+                "track_prediction",
+                tracking["track_prediction"],
+                TrackMatcher.PREDICTIONS,
+            ),
             high_quality_optical_flow=tracking["high_quality_optical_flow"],
+            flow_backend=config.parse_options_param(
+                "flow_backend", tracking["flow_backend"], list(opticalflow.BACKENDS)
+            ),
+            flow_mode=config.parse_options_param(
+                "flow_mode", tracking["flow_mode"], ClipTrackExtractor.FLOW_MODES
+            ),
+            flow_region_padding=tracking["flow_region_padding"],
+            deferred_flow=tracking["deferred_flow"],
+            flow_threads=tracking["flow_threads"],
+            flow_workers=tracking["flow_workers"],
+            compress_frames=tracking["compress_frames"],
+            frame_buffer_mb=tracking["frame_buffer_mb"],
+            crop_frames=tracking["crop_frames"],
+            cache_write_behind=tracking["cache_write_behind"],
             flow_threshold=tracking["flow_threshold"],
             max_tracks=tracking["max_tracks"],
             moving_vel_thresh=tracking["filters"]["moving_vel_thresh"],
@@ -104,6 +143,7 @@ class TrackingConfig(DefaultConfig):
             aoi_min_mass=tracking["areas_of_interest"]["min_mass"],
             aoi_pixel_variance=tracking["areas_of_interest"]["pixel_variance"],
             verbose=tracking["verbose"],
+            profile=tracking["profile"],
             enable_track_output=tracking["enable_track_output"],
             min_tag_confidence=tracking["min_tag_confidence"],
             preview=None,
@@ -121,6 +161,7 @@ class TrackingConfig(DefaultConfig):
                 "threshold_percentile": 99.9,
                 "min_threshold": 30,
                 "max_threshold": 50,
+                "streaming": False,
             },
             max_mean_temperature_threshold=10000,
             max_temperature_range_threshold=10000,
@@ -129,8 +170,20 @@ class TrackingConfig(DefaultConfig):
             frame_padding=4,
             dilation_pixels=2,
             remove_track_after_frames=9,
+            matching_method=TrackMatcher.GREEDY,
+            track_prediction=TrackMatcher.VELOCITY,
             track_smoothing=False,
             high_quality_optical_flow=False,
+            flow_backend=opticalflow.TVL1,
+            flow_mode=ClipTrackExtractor.FLOW_FULL,
+            flow_region_padding=8,
+            deferred_flow=False,
+            flow_threads=2,
+            flow_workers=0,
+            compress_frames=False,
+            frame_buffer_mb=0,
+            crop_frames=False,
+            cache_write_behind=False,
             flow_threshold=40,
             max_tracks=10,
             filters={
@@ -146,6 +199,7 @@ class TrackingConfig(DefaultConfig):
                 "cropped_regions_strategy": "cautious",
             },
             verbose=False,
+            profile=False,
             # defaults provided in dictionaries, placesholders to stop init complaining
             aoi_min_mass=None,
             aoi_pixel_variance=None,
@@ -157,6 +211,7 @@ class TrackingConfig(DefaultConfig):
             temp_thresh=None,
             delta_thresh=None,
             threshold_percentile=None,
+            streaming_stats=None,
             min_threshold=None,
             max_threshold=None,
             track_overlap_ratio=None,
@@ -172,3 +227,19 @@ class TrackingConfig(DefaultConfig):
 
     def as_dict(self):
         return attr.asdict(self)
+
+    # options which only change logging, profiling or how work is spread over threads, not the tracks found
+    DIAGNOSTIC_OPTIONS = [
+        "verbose",
+        "profile",
+        "flow_threads",
+        "flow_workers",
+        "cache_write_behind",
+    ]
+
+    def results_dict(self):
+        """ as_dict without DIAGNOSTIC_OPTIONS, everything the tracks found depend on """
+        values = self.as_dict()
+        for option in TrackingConfig.DIAGNOSTIC_OPTIONS:
+            del values[option]
+        return values
@@ -0,0 +1,173 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+
+import numpy as np
+
+
+class BackgroundEstimator:
+    """
+    Estimates the background of a clip one frame at a time, so the whole clip never needs to be in memory.
+    Each pixel keeps a histogram of the values it has seen, centred on its value in the first frame, which
+    is used to approximate the per pixel percentile.
+    A sample of frames spread evenly over the clip is kept for calculating the threshold.
+    """
+
+    # histogram counts are stored as uint16 until there are more frames than this, then as uint32
+    MAX_FRAMES = np.iinfo(np.uint16).max
+
+    def __init__(self, percentile=10, bins=512, bin_width=2, max_sample_frames=300):
+        self.percentile = percentile
+        self.bins = bins
+        self.bin_width = bin_width
+        self.max_sample_frames = max_sample_frames
+        self.num_frames = 0
+        self.shape = None
+        self.histogram = None
+        self.offset = None
+        self.pixels = None
+        self.sample_frames = []
+        self.sample_stride = 1
+        self.prev_frame = None
+        self.delta_sum = 0.0
+        self.delta_count = 0
+
+    def add_frame(self, frame):
+        if (
+            self.num_frames == BackgroundEstimator.MAX_FRAMES
+            and self.histogram.dtype == np.uint16
+        ):
+            logging.warning(
+                "Background estimate has more than %s frames, using twice the memory to count them",
+                BackgroundEstimator.MAX_FRAMES,
+            )
+            self.histogram = np.uint32(self.histogram)
+        values = np.int32(frame).ravel()
+        if self.histogram is None:
+            self.shape = frame.shape
+            self.histogram = np.zeros((values.size, self.bins), dtype=np.uint16)
+            self.offset = values - self.bins * self.bin_width // 2
+            self.pixels = np.arange(values.size)
+
+        # values outside of the histogram are counted in the end bins
+        bin_index = (values - self.offset) // self.bin_width
+        np.clip(bin_index, 0, self.bins - 1, out=bin_index)
+        self.histogram[self.pixels, bin_index] += 1
+
+        if self.prev_frame is not None:
+            self.delta_sum += float(np.sum(np.abs(values - self.prev_frame)))
+            self.delta_count += values.size
+        self.prev_frame = values
+
+        if self.num_frames % self.sample_stride == 0:
+            self.sample_frames.append(frame)
+            if len(self.sample_frames) > self.max_sample_frames:
+                # halve the sample rate, so the sample still covers the whole clip
+                self.sample_frames = self.sample_frames[::2]
+                self.sample_stride *= 2
+        self.num_frames += 1
+
+    @property
+    def average_delta(self):
+        """ Mean absolute difference between consecutive frames. """
+        if self.delta_count == 0:
+            return float("nan")
+        return self.delta_sum / self.delta_count
+
+    def get_background(self):
+        """
+        Returns the per pixel percentile of all frames seen, linearly interpolated in the same way as np.percentile.
+        Accuracy is bin_width / 2 for values within the histogram range.
+        """
+        if self.num_frames == 0:
+            return None
+        cumulative = np.cumsum(self.histogram, axis=1, dtype=np.uint32)
+        rank = self.percentile / 100 * (self.num_frames - 1)
+        lower_rank = int(rank)
+        upper_rank = min(lower_rank + 1, self.num_frames - 1)
+        lower = self._value_at_rank(cumulative, lower_rank)
+        upper = self._value_at_rank(cumulative, upper_rank)
+        background = lower + (upper - lower) * (rank - lower_rank)
+        return background.reshape(self.shape)
+
+    def _value_at_rank(self, cumulative, rank):
+        bin_index = np.argmax(cumulative > rank, axis=1)
+        return self.offset + bin_index * self.bin_width + (self.bin_width - 1) / 2
+
+
+class PercentileHistogram:
+    """
+    Approximates a percentile of non negative values without keeping them.  Values are counted in fixed width
+    bins, so histograms of separate chunks can be merged.  Zeros are counted exactly as filtered frames are
+    mostly zero, and values above max_value are counted in the last bin.
+    """
+
+    def __init__(self, bin_width=0.25, max_value=np.iinfo(np.uint16).max):
+        self.bin_width = bin_width
+        self.bins = int(max_value / bin_width) + 1
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values).ravel()
+        bin_index = np.multiply(values, 1 / self.bin_width, dtype=np.float32)
+        np.clip(bin_index, 0, self.bins - 1, out=bin_index)
+        counts = np.bincount(bin_index.astype(np.intp))
+        zeros = int(np.count_nonzero(values <= 0))
+        # zeros are counted separately
+        counts[0] -= zeros
+        self._add_counts(counts, zeros)
+
+    def merge(self, other):
+        self._add_counts(other.counts, other.zeros)
+
+    def _add_counts(self, counts, zeros):
+        self.count += int(np.sum(counts)) + zeros
+        self.zeros += zeros
+        if len(counts) > len(self.counts):
+            counts = counts.copy()
+            counts[: len(self.counts)] += self.counts
+            self.counts = counts
+        else:
+            self.counts[: len(counts)] += counts
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile of values added, linearly interpolated in the same way as np.percentile.
+        Values are assumed to be evenly spread within a bin, so accuracy is at worst bin_width.
+        """
+        if self.count == 0:
+            return float("nan")
+        cumulative = self.zeros + np.cumsum(self.counts)
+        rank = q / 100 * (self.count - 1)
+        lower_rank = int(rank)
+        upper_rank = min(lower_rank + 1, self.count - 1)
+        lower = self._value_at_rank(cumulative, lower_rank)
+        upper = self._value_at_rank(cumulative, upper_rank)
+        return lower + (upper - lower) * (rank - lower_rank)
+
+    def _value_at_rank(self, cumulative, rank):
+        if rank < self.zeros:
+            return 0.0
+        bin_index = int(np.argmax(cumulative > rank))
+        before = cumulative[bin_index] - self.counts[bin_index]
+        position = (rank - before + 0.5) / self.counts[bin_index]
+        return (bin_index + position) * self.bin_width
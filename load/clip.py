@@ -25,8 +25,11 @@ import os
 import pytz
 
 
+from load.frameworkspace import order_statistics
+from ml_tools.profiler import Profiler
 from ml_tools.tools import Rectangle
 from track.framebuffer import FrameBuffer
+from track.region import Region
 from track.track import Track
 
 
@@ -52,6 +55,10 @@ class Clip:
         self.tracks = []
         self.filtered_tracks = []
         self.from_metadata = False
+        # frame number to the metadata tracks which have a region in that frame
+        self.tracks_by_frame = {}
+        # the regions of metadata tracks have the ids of the components of their frames, see load_tracks
+        self.label_metadata_masks = False
         self.video_start_time = None
         self.location = None
         self.frame_buffer = None
@@ -68,6 +75,7 @@ class Clip:
         self.calc_stats = calc_stats
         self.source_file = sourcefile
         self.stats = ClipStats()
+        self.profiler = Profiler(trackconfig.profile)
         self.threshold = trackconfig.delta_thresh
         self.stats.threshold = self.threshold
 
@@ -123,6 +131,14 @@ class Clip:
         self.background = np.percentile(frames, q=10, axis=0)
         self._set_from_background()
 
+    def background_from_estimator(self, estimator):
+        """
+        Sets the background from a BackgroundEstimator which has been fed every frame of the clip, this gives
+        an approximation of background_from_whole_clip without keeping all frames in memory.
+        """
+        self.background = estimator.get_background()
+        self._set_from_background()
+
     def _add_active_track(self, track):
         self.active_tracks.add(track)
         self.tracks.append(track)
@@ -165,6 +181,28 @@ class Clip:
         )
         self.from_metadata = True
         self.tracks = set(tracks)
+        self.tracks_by_frame = {}
+        for track in tracks:
+            # a track gets one region per frame, even if positions round to the same frame
+            for frame_number in sorted(set(track.frame_list)):
+                self.tracks_by_frame.setdefault(frame_number, []).append(track)
+
+    def load_tracks(self, tracks_bounds):
+        """
+        Loads tracks already tracked in this clip, so the clip is processed as one with tracks from metadata.
+        Masks are labelled as they were when tracking, so crops of the tracks are the same.
+        :param tracks_bounds: list of track id and the Region.DTYPE bounds of the track
+        """
+        self.from_metadata = True
+        self.label_metadata_masks = True
+        self.tracks = [
+            Track.from_bounds(self, track_id, bounds)
+            for track_id, bounds in tracks_bounds
+        ]
+        self.tracks_by_frame = {}
+        for track in self.tracks:
+            for frame_number in track.frame_list:
+                self.tracks_by_frame.setdefault(frame_number, []).append(track)
 
     def load_tracks_meta(self, metadata, include_filtered_channel, tag_precedence):
         tracks_meta = metadata["Tracks"]
@@ -191,11 +229,41 @@ class Clip:
 
         return (track.start_s, track.end_s)
 
-    def set_frame_buffer(self, high_quality_flow, cache_to_disk, use_flow, keep_frames):
+    def set_frame_buffer(
+        self,
+        high_quality_flow,
+        cache_to_disk,
+        use_flow,
+        keep_frames,
+        flow_backend=None,
+        crop_frames=False,
+    ):
+        if flow_backend is None:
+            flow_backend = self.config.flow_backend
         self.frame_buffer = FrameBuffer(
-            self.source_file, high_quality_flow, cache_to_disk, use_flow, keep_frames
+            self.source_file,
+            high_quality_flow,
+            cache_to_disk,
+            use_flow,
+            keep_frames,
+            deferred_flow=self.config.deferred_flow,
+            flow_threads=self.config.flow_threads,
+            flow_workers=self.config.flow_workers,
+            flow_backend=flow_backend,
+            profiler=self.profiler,
+            compress_frames=self.config.compress_frames,
+            memory_budget=self.config.frame_buffer_mb * 1024 * 1024,
+            crop_frames=crop_frames,
+            write_behind=self.config.cache_write_behind,
         )
 
+    def calculate_track_flow(self):
+        """ Calculates any deferred optical flow needed for the frames of tracks """
+        frame_numbers = set()
+        for track in self.tracks:
+            frame_numbers.update(track.bounds["frame_number"].tolist())
+        self.frame_buffer.calculate_flow(frame_numbers)
+
     def set_res(self, res_x, res_y):
         self.res_x = res_x
         self.res_y = res_y
@@ -220,53 +288,154 @@ class Clip:
         if self.config.verbose:
             logging.info(info_string)
 
-    def add_frame(self, thermal, filtered, mask, ffc_affected=False):
+    def track_bounds(self, frame_number):
+        """
+        :return: int array of left, top, right, bottom of the regions of tracks in frame_number
+        """
+        tracks = self.tracks if self.from_metadata else self.active_tracks
+        records = np.concatenate(
+            [
+                track.bounds[track.bounds["frame_number"] == frame_number]
+                for track in tracks
+            ]
+            + [np.empty(0, dtype=Region.DTYPE)]
+        )
+        left = records["x"]
+        top = records["y"]
+        return np.stack(
+            (left, top, left + records["width"], top + records["height"]), axis=1
+        )
+
+    def add_frame(
+        self,
+        thermal,
+        filtered,
+        mask,
+        ffc_affected=False,
+        flow_regions=None,
+        thermal_statistics=None,
+    ):
+        """
+        Adds a tracked frame to the frame buffer and clip statistics
+        :param thermal_statistics: (optional) min, max and median of thermal if already calculated
+        """
+        if self.frame_buffer.crop_frames and self.frame_on > 0:
+            # the tracks in the previous frame are known once it has been matched
+            self.frame_buffer.crop_frame(
+                self.frame_on - 1, self.track_bounds(self.frame_on - 1)
+            )
         self.frame_buffer.add_frame(
-            thermal, filtered, mask, self.frame_on, ffc_affected
+            thermal, filtered, mask, self.frame_on, ffc_affected, flow_regions
         )
         if self.calc_stats:
-            self.stats.add_frame(thermal, filtered)
+            with self.profiler.timer("stats"):
+                self.stats.add_frame(thermal, filtered, thermal_statistics)
 
 
 class ClipStats:
     """ Stores background analysis statistics. """
 
+    INITIAL_FRAMES = 256
+
     def __init__(self):
         self.mean_background_value = 0
         self.max_temp = None
         self.min_temp = None
         self.mean_temp = None
-        self.frame_stats_min = []
-        self.frame_stats_max = []
-        self.frame_stats_median = []
-        self.frame_stats_mean = []
+        # per frame statistics, preallocated when the first frame is added and grown as needed
+        self.num_frames = 0
+        self._frame_min = None
+        self._frame_max = None
+        self._frame_median = None
+        self._frame_mean = None
+        self._filtered_sums = None
         self.filtered_deviation = None
-        self.filtered_sum = 0
         self.temp_thresh = 0
         self.threshold = None
         self.average_delta = None
         self.is_static_background = None
 
-    def add_frame(self, thermal, filtered):
-        f_median = np.median(thermal)
-        f_max = np.max(thermal)
-        f_min = np.min(thermal)
+    def add_frame(self, thermal, filtered, thermal_statistics=None):
+        """
+        Adds the statistics of a frame
+        :param thermal_statistics: (optional) min, max and median of thermal if already calculated
+        """
+        if thermal_statistics is None:
+            thermal_statistics = order_statistics(np.asarray(thermal))
+        f_min, f_max, f_median = thermal_statistics
         f_mean = np.nanmean(thermal)
         self.max_temp = null_safe_compare(self.max_temp, f_max, max)
         self.min_temp = null_safe_compare(self.min_temp, f_min, min)
 
-        self.frame_stats_min.append(f_min)
-        self.frame_stats_max.append(f_max)
-        self.frame_stats_median.append(f_median)
-        self.frame_stats_mean.append(f_mean)
-        self.filtered_sum += np.sum(np.abs(filtered))
+        if self._frame_min is None:
+            self._allocate(thermal.dtype, filtered.dtype)
+        elif self.num_frames == len(self._frame_min):
+            self._grow()
+        self._frame_min[self.num_frames] = f_min
+        self._frame_max[self.num_frames] = f_max
+        self._frame_median[self.num_frames] = f_median
+        self._frame_mean[self.num_frames] = f_mean
+        # filtered frames have no negative values, so this is the sum of their absolute values
+        self._filtered_sums[self.num_frames] = np.sum(filtered)
+        self.num_frames += 1
+
+    def _allocate(self, thermal_dtype, filtered_dtype):
+        size = ClipStats.INITIAL_FRAMES
+        self._frame_min = np.empty(size, dtype=thermal_dtype)
+        self._frame_max = np.empty(size, dtype=thermal_dtype)
+        self._frame_median = np.empty(size, dtype=np.float64)
+        self._frame_mean = np.empty(size, dtype=np.float64)
+        self._filtered_sums = np.empty(size, dtype=filtered_dtype)
+
+    def _grow(self):
+        for name in [
+            "_frame_min",
+            "_frame_max",
+            "_frame_median",
+            "_frame_mean",
+            "_filtered_sums",
+        ]:
+            values = getattr(self, name)
+            grown = np.empty(2 * len(values), dtype=values.dtype)
+            grown[: len(values)] = values
+            setattr(self, name, grown)
+
+    def _frame_values(self, values):
+        if values is None:
+            return np.empty(0)
+        return values[: self.num_frames]
+
+    @property
+    def frame_stats_min(self):
+        return self._frame_values(self._frame_min)
+
+    @property
+    def frame_stats_max(self):
+        return self._frame_values(self._frame_max)
+
+    @property
+    def frame_stats_median(self):
+        return self._frame_values(self._frame_median)
+
+    @property
+    def frame_stats_mean(self):
+        return self._frame_values(self._frame_mean)
+
+    @property
+    def filtered_sum(self):
+        """ Sum of all filtered frames, accumulated a frame at a time at the precision of the filtered frames """
+        if self.num_frames == 0:
+            return 0
+        return np.cumsum(self._frame_values(self._filtered_sums))[-1]
 
     def completed(self, num_frames, height, width):
         if num_frames == 0:
             return
         total = num_frames * height * width
         self.filtered_deviation = self.filtered_sum / float(total)
-        self.mean_temp = (height * width * sum(self.frame_stats_mean)) / float(total)
+        self.mean_temp = (
+            height * width * np.cumsum(self.frame_stats_mean)[-1]
+        ) / float(total)
 
 
 def null_safe_compare(a, b, cmp_fn):
@@ -29,13 +29,14 @@ from ml_tools import trackdatabase
 from ml_tools.trackdatabase import TrackDatabase
 
 from ml_tools.previewer import Previewer
+from ml_tools.profiler import Profiler
 from .clip import Clip
 from .cliptrackextractor import ClipTrackExtractor
 from track.track import Track
 
 
 def process_job(job):
-    job[0].process_file(job[1])
+    return job[0].process_file(job[1])
 
 
 class ClipLoader:
@@ -59,6 +60,7 @@ class ClipLoader:
             self.config.use_opt_flow
             or config.load.preview == Previewer.PREVIEW_TRACKING,
             self.config.load.cache_to_disk,
+            crop_frames=self.config.tracking.crop_frames and not self.previewer,
         )
 
     def process_all(self, root=None, checkpoint=None):
@@ -77,13 +79,14 @@ class ClipLoader:
         self._process_jobs(jobs)
 
     def _process_jobs(self, jobs):
+        profiles = []
         if self.workers_threads == 0:
             for job in jobs:
-                process_job(job)
+                profiles.append(process_job(job))
         else:
             pool = multiprocessing.Pool(self.workers_threads)
             try:
-                pool.map(process_job, jobs, chunksize=1)
+                profiles = pool.map(process_job, jobs, chunksize=1)
                 pool.close()
                 pool.join()
             except KeyboardInterrupt:
@@ -94,6 +97,18 @@ class ClipLoader:
                 logging.exception("Error processing files")
             else:
                 pool.close()
+        if self.track_config.profile:
+            self._save_profile(profiles)
+
+    def _save_profile(self, profiles):
+        """ Saves the total time of each tracking stage over all clips processed """
+        profiler = Profiler(True)
+        for profile in profiles:
+            if profile is not None:
+                profiler.merge(profile)
+        filename = os.path.join(self.config.tracks_folder, "profile.json")
+        profiler.save(filename)
+        logging.info("Tracking profile saved to %s\n%s", filename, profiler.summary())
 
     def _get_dest_folder(self, filename):
         return os.path.join(self.config.tracks_folder, get_distributed_folder(filename))
@@ -108,13 +123,16 @@ class ClipLoader:
         # that we have processed it.
         self.database.create_clip(clip)
 
+        clip.calculate_track_flow()
         for track in clip.tracks:
             start_time, end_time = clip.start_and_end_time_absolute(
                 track.start_s, track.end_s
             )
             track_data = []
-            for region in track.bounds_history:
-                frame = clip.frame_buffer.get_frame(region.frame_number)
+            frames = clip.frame_buffer.iter_frames(
+                track.bounds["frame_number"].tolist()
+            )
+            for region, frame in zip(track.bounds_history, frames):
                 frame = track.crop_by_region(frame, region, filter_mask_by_region=False)
                 # zero out the filtered channel
                 if not self.config.load.include_filtered_channel:
@@ -165,6 +183,10 @@ class ClipLoader:
         return tag and tag not in excluded_tags and confidence >= min_confidence
 
     def process_file(self, filename):
+        """
+        Extracts and exports tracks from filename
+        :return: profile of tracking stages as a dictionary, if profiling is enabled
+        """
         start = time.time()
         base_filename = os.path.splitext(os.path.basename(filename))[0]
 
@@ -227,6 +249,24 @@ class ClipLoader:
                     len(clip.tracks), num_frames, ms_per_frame
                 )
             )
+            spill_stats = clip.frame_buffer.spill_stats()
+            if spill_stats["spilled_frames"] > 0:
+                self._log_message(
+                    "Spilled {} frames to disk in {:.1f}s, {:.1f}MB kept in memory".format(
+                        spill_stats["spilled_frames"],
+                        spill_stats["spill_seconds"],
+                        spill_stats["resident_bytes"] / (1024 * 1024),
+                    )
+                )
+        # the disk cache is kept with load.cache_to_disk
+        clip.frame_buffer.remove_spill_cache()
+
+        if self.track_config.profile:
+            os.makedirs(destination_folder, mode=0o775, exist_ok=True)
+            clip.profiler.save(
+                os.path.join(destination_folder, base_filename + "-profile.json")
+            )
+            return clip.profiler.as_dict()
 
     def _log_message(self, message):
         """ Record message in stdout.  Will be printed if verbose is enabled. """
@@ -24,19 +24,37 @@ import numpy as np
 from cptv import CPTVReader
 import cv2
 
+from .backgroundestimator import BackgroundEstimator, PercentileHistogram
+from .frameworkspace import FrameWorkspace
 from .clip import Clip
 import ml_tools.tools as tools
 from ml_tools.tools import Rectangle
 from track.region import Region
 from track.track import Track
+from track.trackindex import TrackIndex
+from track.trackmatcher import TrackMatcher
 from piclassifier.motiondetector import is_affected_by_ffc
 
 
 class ClipTrackExtractor:
     PREVIEW = "preview"
 
+    # optical flow is calculated for the whole frame, or only around regions and active tracks
+    FLOW_FULL = "full"
+    FLOW_REGIONS = "regions"
+    FLOW_MODES = [FLOW_FULL, FLOW_REGIONS]
+
+    # frames filtered at once when calculating whole clip statistics
+    STATS_CHUNK_FRAMES = 50
+
     def __init__(
-        self, config, use_opt_flow, cache_to_disk, keep_frames=True, calc_stats=True
+        self,
+        config,
+        use_opt_flow,
+        cache_to_disk,
+        keep_frames=True,
+        calc_stats=True,
+        crop_frames=False,
     ):
         self.config = config
         self.use_opt_flow = use_opt_flow
@@ -48,11 +66,24 @@ class ClipTrackExtractor:
         # the dilation effectively also pads the frame so take it into consideration.
         self.frame_padding = max(0, self.frame_padding - self.config.dilation_pixels)
         self.keep_frames = keep_frames
+        # keep only the area around tracks of frames, see FrameBuffer.  Frames are cropped before the tracks are
+        # smoothed, which can grow their bounds past the area kept
+        if crop_frames and self.config.track_smoothing:
+            logging.warning("crop_frames is disabled as track_smoothing is enabled")
+            crop_frames = False
+        self.crop_frames = crop_frames
         self.calc_stats = calc_stats
+        self.matcher = TrackMatcher(
+            self.config.moving_vel_thresh,
+            self.config.matching_method,
+            self.config.verbose,
+            self.config.track_prediction,
+        )
 
         if self.config.dilation_pixels > 0:
             size = self.config.dilation_pixels * 2 + 1
             self.dilate_kernel = np.ones((size, size), np.uint8)
+        self.workspace = None
 
     def parse_clip(self, clip):
         """
@@ -64,6 +95,7 @@ class ClipTrackExtractor:
             self.cache_to_disk,
             self.use_opt_flow,
             self.keep_frames,
+            crop_frames=self.crop_frames,
         )
 
         with open(clip.source_file, "rb") as f:
@@ -90,7 +122,10 @@ class ClipTrackExtractor:
                     self._process_preview_frames(clip)
             else:
                 clip.background_is_preview = False
-                self.process_frames(clip, [frame for frame in reader])
+                if self.config.streaming_stats:
+                    self.process_frames_streaming(clip, f)
+                else:
+                    self.process_frames(clip, [frame for frame in reader])
 
         if not clip.from_metadata:
             self.apply_track_filtering(clip)
@@ -105,7 +140,8 @@ class ClipTrackExtractor:
             self.print_if_verbose("{} ffc_affected".format(clip.frame_on))
         clip.ffc_affected = ffc_affected
         if clip.on_preview():
-            clip.calculate_preview_from_frame(frame, ffc_affected)
+            with clip.profiler.timer("background"):
+                clip.calculate_preview_from_frame(frame, ffc_affected)
             if clip.background_calculated:
                 clip.frame_on += 1
                 self._process_preview_frames(clip)
@@ -122,22 +158,50 @@ class ClipTrackExtractor:
 
         clip.preview_frames = None
 
-    def _whole_clip_stats(self, clip, frames):
-        filtered = np.float32(
-            [self._get_filtered_frame(clip, frame) for frame in frames]
+    def _whole_clip_stats(self, clip, frames, average_delta=None):
+        """
+        Calculates the threshold and background statistics from frames.  Frames are filtered in chunks of
+        STATS_CHUNK_FRAMES, keeping running sums and a histogram for the threshold percentile, so only a chunk of
+        the clip is copied at once.
+        :param average_delta: (optional) if not specified calculated from frames, which are assumed to be consecutive
+        """
+        workspace = FrameWorkspace(
+            frames[0].shape,
+            self.config.edge_pixels,
+            FrameWorkspace.filtered_dtype(clip),
         )
-
-        delta = np.asarray(frames[1:], dtype=np.float32) - np.asarray(
-            frames[:-1], dtype=np.float32
+        chunk_size = ClipTrackExtractor.STATS_CHUNK_FRAMES
+        filtered_chunk = np.empty(
+            (min(chunk_size, len(frames)),) + frames[0].shape, dtype=workspace.dtype
         )
-        average_delta = float(np.nanmean(np.abs(delta)))
+        histogram = PercentileHistogram()
+        filtered_sum = 0.0
+        delta_sum = 0.0
+        delta_count = 0
+        prev_frame = None
+        for start in range(0, len(frames), chunk_size):
+            chunk = frames[start : start + chunk_size]
+            filtered = filtered_chunk[: len(chunk)]
+            for i, frame in enumerate(chunk):
+                self._get_filtered_frame(clip, frame, workspace, out=filtered[i])
+            filtered = filtered.astype(np.float32, copy=False)
+            histogram.add(filtered)
+            filtered_sum += float(np.sum(np.abs(filtered), dtype=np.float64))
+
+            if average_delta is None:
+                chunk = np.asarray(chunk, dtype=np.float32)
+                if prev_frame is not None:
+                    chunk = np.concatenate((prev_frame[np.newaxis], chunk))
+                delta = np.abs(chunk[1:] - chunk[:-1])
+                delta_sum += float(np.nansum(delta, dtype=np.float64))
+                delta_count += delta.size - int(np.count_nonzero(np.isnan(delta)))
+                prev_frame = chunk[-1]
+
+        if average_delta is None:
+            average_delta = delta_sum / delta_count if delta_count else float("nan")
 
         # take half the max filtered value as a threshold
-        threshold = float(
-            np.percentile(
-                np.reshape(filtered, [-1]), q=self.config.threshold_percentile
-            )
-        )
+        threshold = float(histogram.percentile(self.config.threshold_percentile))
 
         # cap the threshold to something reasonable
         threshold = max(self.config.min_threshold, threshold)
@@ -148,7 +212,7 @@ class ClipTrackExtractor:
             clip.stats.threshold = threshold
             clip.stats.temp_thresh = self.config.temp_thresh
             clip.stats.average_delta = float(average_delta)
-            clip.stats.filtered_deviation = float(np.mean(np.abs(filtered)))
+            clip.stats.filtered_deviation = filtered_sum / histogram.count
             clip.stats.is_static_background = (
                 clip.stats.filtered_deviation < clip.config.static_background_threshold
             )
@@ -168,9 +232,10 @@ class ClipTrackExtractor:
         if len(non_ffc_frames) == 0:
             logging.warn("Clip only has ffc affected frames")
             return False
-        clip.background_from_whole_clip(non_ffc_frames)
-        # not sure if we want to include ffc frames here or not
-        self._whole_clip_stats(clip, non_ffc_frames)
+        with clip.profiler.timer("background"):
+            clip.background_from_whole_clip(non_ffc_frames)
+            # not sure if we want to include ffc frames here or not
+            self._whole_clip_stats(clip, non_ffc_frames)
         if clip.background_is_preview:
 
             if clip.preview_frames > 0:
@@ -186,38 +251,87 @@ class ClipTrackExtractor:
             self._process_frame(clip, frame.pix, ffc_affected)
             clip.frame_on += 1
 
+    def process_frames_streaming(self, clip, cptv_file):
+        """
+        Processes the clip in two passes of the cptv file, so that memory use doesn't grow with clip length.
+        The first pass estimates the background and threshold, the second does the tracking.
+        """
+        estimator = BackgroundEstimator()
+        cptv_file.seek(0)
+        with clip.profiler.timer("background"):
+            for frame in CPTVReader(cptv_file):
+                if not is_affected_by_ffc(frame):
+                    estimator.add_frame(frame.pix)
+            if estimator.num_frames == 0:
+                logging.warn("Clip only has ffc affected frames")
+                return False
+            clip.background_from_estimator(estimator)
+            self._whole_clip_stats(
+                clip, estimator.sample_frames, estimator.average_delta
+            )
+
+        cptv_file.seek(0)
+        for frame in CPTVReader(cptv_file):
+            self._process_frame(clip, frame.pix, is_affected_by_ffc(frame))
+            clip.frame_on += 1
+        return True
+
     def apply_track_filtering(self, clip):
-        self.filter_tracks(clip)
-        # apply smoothing if required
-        if self.config.track_smoothing and clip.frame_on > 0:
-            for track in clip.active_tracks:
-                track.smooth(Rectangle(0, 0, clip.res_x, clip.res_y))
+        with clip.profiler.timer("track_filtering"):
+            self.filter_tracks(clip)
+            # apply smoothing if required
+            if self.config.track_smoothing and clip.frame_on > 0:
+                for track in clip.active_tracks:
+                    track.smooth(Rectangle(0, 0, clip.res_x, clip.res_y))
+
+    def _get_workspace(self, clip, shape):
+        """ Returns a workspace for the current frame, this is only recreated if the clip has changed """
+        dtype = FrameWorkspace.filtered_dtype(clip)
+        reuse_outputs = not clip.frame_buffer.keeps_frame_arrays
+        if self.workspace is None or not self.workspace.matches(
+            shape, self.config.edge_pixels, dtype, reuse_outputs
+        ):
+            self.workspace = FrameWorkspace(
+                shape, self.config.edge_pixels, dtype, reuse_outputs
+            )
+        return self.workspace
 
-    def _get_filtered_frame(self, clip, thermal):
+    def _get_filtered_frame(
+        self, clip, thermal, workspace, out=None, thermal_median=None
+    ):
         """
         Calculates filtered frame from thermal
         :param thermal: the thermal frame
-        :param background: (optional) used for background subtraction
+        :param workspace: buffers to use for temporary values
+        :param out: (optional) array to put the filtered frame in
+        :param thermal_median: (optional) median of thermal if already calculated
         :return: the filtered frame
         """
+        if out is None:
+            out = np.empty(thermal.shape, dtype=workspace.dtype)
 
-        # has to be a signed int so we dont get overflow
-        filtered = np.float32(thermal.copy())
         if clip.background is None:
-            filtered = filtered - np.median(filtered) - 40
-            filtered[filtered < 0] = 0
+            np.copyto(out, thermal)
+            if thermal_median is None:
+                thermal_median = workspace.median(out)
+            np.subtract(out, thermal_median, out=out)
+            np.subtract(out, 40, out=out)
+            workspace.zero_negatives(out)
         elif clip.background_is_preview:
             avg_change = int(
                 round(np.average(thermal) - clip.stats.mean_background_value)
             )
-            filtered[filtered < clip.temp_thresh] = 0
-            np.clip(filtered - clip.background - avg_change, 0, None, out=filtered)
-
+            np.copyto(out, thermal)
+            np.less(out, clip.temp_thresh, out=workspace.below)
+            np.copyto(out, 0, where=workspace.below)
+            np.subtract(out, clip.background, out=out)
+            np.subtract(out, avg_change, out=out)
+            np.clip(out, 0, None, out=out)
         else:
-            filtered = filtered - clip.background
-            filtered = filtered - np.median(filtered)
-            filtered[filtered < 0] = 0
-        return filtered
+            np.subtract(thermal, clip.background, out=out)
+            np.subtract(out, workspace.median(out), out=out)
+            workspace.zero_negatives(out)
+        return out
 
     def _process_frame(self, clip, thermal, ffc_affected=False):
         """
@@ -225,47 +339,160 @@ class ClipTrackExtractor:
         :param thermal: A numpy array of shape (height, width) and type uint16
             If specified background subtraction algorithm will be used.
         """
-        filtered = self._get_filtered_frame(clip, thermal)
-        frame_height, frame_width = filtered.shape
-        mask = np.zeros(filtered.shape)
-        edge = self.config.edge_pixels
+        profiler = clip.profiler
+        workspace = self._get_workspace(clip, thermal.shape)
+        filtered, mask = workspace.next_outputs()
+        thermal_statistics = None
+        thermal_median = None
+        if clip.calc_stats:
+            # the thermal median is needed for both the clip stats and filtering without a background
+            with profiler.timer("stats"):
+                thermal_statistics = workspace.thermal_statistics(thermal)
+            thermal_median = thermal_statistics[2]
+        with profiler.timer("filter"):
+            self._get_filtered_frame(
+                clip, thermal, workspace, out=filtered, thermal_median=thermal_median
+            )
+
+        if clip.from_metadata:
+            self._process_metadata_frame(
+                clip,
+                thermal,
+                filtered,
+                mask,
+                workspace,
+                ffc_affected,
+                thermal_statistics,
+            )
+            return
 
         # remove the edges of the frame as we know these pixels can be spurious value
         edgeless_filtered = clip.crop_rectangle.subimage(filtered)
-        thresh, mass = tools.blur_and_return_as_mask(
-            edgeless_filtered, threshold=clip.threshold
-        )
-        thresh = np.uint8(thresh)
+        with profiler.timer("threshold"):
+            thresh, _ = workspace.blur_and_threshold(edgeless_filtered, clip.threshold)
         dilated = thresh
 
         # Dilation groups interested pixels that are near to each other into one component(animal/track)
         if self.config.dilation_pixels > 0:
-            dilated = cv2.dilate(dilated, self.dilate_kernel, iterations=1)
+            with profiler.timer("dilate"):
+                dilated = workspace.dilate(dilated, self.dilate_kernel)
 
-        labels, small_mask, stats, _ = cv2.connectedComponentsWithStats(dilated)
-        mask[edge : frame_height - edge, edge : frame_width - edge] = small_mask
+        with profiler.timer("components"):
+            labels, stats = workspace.connected_components(dilated, mask)
 
-        prev_filtered = clip.frame_buffer.get_last_filtered()
-        clip.add_frame(thermal, filtered, mask, ffc_affected)
+        flow_regions = None
+        if self.config.flow_mode == ClipTrackExtractor.FLOW_REGIONS:
+            flow_regions = self._get_flow_regions(clip, labels, stats)
 
-        if clip.from_metadata:
-            for track in clip.tracks:
-                if clip.frame_on in track.frame_list:
+        prev_filtered = clip.frame_buffer.get_last_filtered()
+        clip.add_frame(
+            thermal, filtered, mask, ffc_affected, flow_regions, thermal_statistics
+        )
 
-                    track.add_frame_for_existing_region(
-                        clip.frame_buffer.get_last_frame(),
-                        clip.threshold,
-                        prev_filtered,
-                    )
-        else:
+        with profiler.timer("regions"):
             regions = self._get_regions_of_interest(
-                clip, labels, stats, thresh, filtered, prev_filtered, mass
+                clip, labels, stats, filtered, prev_filtered, workspace
             )
-            clip.region_history.append(regions)
+        clip.region_history.append(regions)
+        with profiler.timer("matching"):
             self._apply_region_matchings(
                 clip, regions, create_new_tracks=not ffc_affected
             )
 
+    def _process_metadata_frame(
+        self, clip, thermal, filtered, mask, workspace, ffc_affected, thermal_statistics
+    ):
+        """
+        Adds a frame of a clip whose tracks are loaded from metadata.  Regions are already known, so only the
+        frames tracks are in are thresholded for their mask, and only the mass and variance of their regions is
+        calculated
+        :param filtered: the filtered frame
+        :param mask: the mask to fill in, only inside the edges of frames with tracks
+        :param workspace: the workspace the frame was filtered with
+        """
+        profiler = clip.profiler
+        tracks = clip.tracks_by_frame.get(clip.frame_on, [])
+        if len(tracks) > 0:
+            with profiler.timer("threshold"):
+                thresh, _ = workspace.blur_and_threshold(
+                    clip.crop_rectangle.subimage(filtered), clip.threshold
+                )
+            dilated = thresh
+            if self.config.dilation_pixels > 0:
+                with profiler.timer("dilate"):
+                    dilated = workspace.dilate(dilated, self.dilate_kernel)
+            if clip.label_metadata_masks:
+                workspace.connected_components(dilated, mask)
+            else:
+                # track crops only use the mask to mark pixels of interest, so components aren't labelled
+                np.minimum(dilated, 1, out=clip.crop_rectangle.subimage(mask))
+        elif workspace.reuse_outputs:
+            mask.fill(0)
+
+        flow_regions = None
+        if self.config.flow_mode == ClipTrackExtractor.FLOW_REGIONS:
+            flow_regions = self._get_metadata_flow_regions(clip, tracks)
+
+        prev_filtered = clip.frame_buffer.get_last_filtered()
+        clip.add_frame(
+            thermal, filtered, mask, ffc_affected, flow_regions, thermal_statistics
+        )
+        with profiler.timer("regions"):
+            for track in tracks:
+                track.add_frame_for_existing_region(
+                    clip.frame_buffer.get_last_frame(), clip.threshold, prev_filtered
+                )
+
+    def _get_flow_regions(self, clip, labels, stats):
+        """
+        Calculates the bounds optical flow is needed in for the current frame.  These cover all components
+        which could become regions and the last bounds of active tracks, which are used for blank frames,
+        padded by flow_region_padding.  Overlapping bounds are merged.
+        :return: list of left, top, right, bottom bounds
+        """
+        edge = self.config.edge_pixels
+        padding = self.frame_padding
+        components = np.int32(stats[1:labels, :4])
+        bounds = [
+            np.stack(
+                (
+                    components[:, 0] + edge - padding,
+                    components[:, 1] + edge - padding,
+                    components[:, 0] + components[:, 2] + edge + padding,
+                    components[:, 1] + components[:, 3] + edge + padding,
+                ),
+                axis=1,
+            )
+        ]
+        for track in clip.active_tracks:
+            bounds.append(track.get_bounds_array(-1))
+        return self._merge_flow_bounds(clip, bounds)
+
+    def _get_metadata_flow_regions(self, clip, tracks):
+        """
+        Calculates the bounds optical flow is needed in for the current frame of a clip loaded from metadata,
+        which are the regions of tracks in the frame padded by flow_region_padding
+        :param tracks: tracks which have a region in the current frame
+        :return: list of left, top, right, bottom bounds
+        """
+        bounds = [
+            track.get_bounds_array(track.current_frame_num, track.current_frame_num + 1)
+            for track in tracks
+        ]
+        if len(bounds) == 0:
+            return []
+        return self._merge_flow_bounds(clip, bounds)
+
+    def _merge_flow_bounds(self, clip, bounds):
+        """ Pads and clips a list of bounds arrays to the frame, and merges those that overlap """
+        bounds = np.concatenate(bounds)
+        padding = self.config.flow_region_padding
+        bounds[:, :2] -= padding
+        bounds[:, 2:] += padding
+        np.clip(bounds[:, 0::2], 0, clip.res_x, out=bounds[:, 0::2])
+        np.clip(bounds[:, 1::2], 0, clip.res_y, out=bounds[:, 1::2])
+        return tools.merge_overlapping_bounds(bounds.tolist())
+
     def _apply_region_matchings(self, clip, regions, create_new_tracks=True):
         """
         Work out the best matchings between tracks and regions of interest for the current frame.
@@ -278,62 +505,12 @@ class ClipTrackExtractor:
             new_tracks = set()
         self._filter_inactive_tracks(clip, new_tracks, matched_tracks)
 
-    def get_max_size_change(self, track, region):
-        exiting = region.is_along_border and not track.last_bound.is_along_border
-        entering = not exiting and track.last_bound.is_along_border
-
-        min_change = 50
-        if entering or exiting:
-            min_change = 100
-        max_size_change = np.clip(track.last_mass, min_change, 500)
-        return max_size_change
-
     def _match_existing_tracks(self, clip, regions):
-
-        scores = []
-        used_regions = set()
         unmatched_regions = set(regions)
-        for track in clip.active_tracks:
-            for region in regions:
-                score, size_change = track.get_track_region_score(
-                    region, self.config.moving_vel_thresh
-                )
-                # we give larger tracks more freedom to find a match as they might move quite a bit.
-                max_distance = np.clip(7 * track.last_mass, 900, 9025)
-                max_size_change = self.get_max_size_change(track, region)
-
-                if score > max_distance:
-                    self.print_if_verbose(
-                        "track {} distance score {} bigger than max score {}".format(
-                            track.get_id(), score, max_distance
-                        )
-                    )
-
-                    continue
-                if size_change > max_size_change:
-                    self.print_if_verbose(
-                        "track {} size_change {} bigger than max size_change {}".format(
-                            track.get_id(), size_change, max_size_change
-                        )
-                    )
-                    continue
-                scores.append((score, track, region))
-
-        # makes tracking consistent by ordering by score then by frame since target then track id
-        scores.sort(
-            key=lambda record: record[1].frames_since_target_seen
-            + float(".{}".format(record[1]._id))
-        )
-        scores.sort(key=lambda record: record[0])
-
         matched_tracks = set()
-        for (score, track, region) in scores:
-            if track in matched_tracks or region in used_regions:
-                continue
-
+        for track, region in self.matcher.match(list(clip.active_tracks), regions):
             track.add_region(region)
             matched_tracks.add(track)
-            used_regions.add(region)
             unmatched_regions.remove(region)
 
         return unmatched_regions, matched_tracks
@@ -341,12 +518,31 @@ class ClipTrackExtractor:
     def _create_new_tracks(self, clip, unmatched_regions):
         """ Create new tracks for any unmatched regions """
         new_tracks = set()
-        for region in unmatched_regions:
-            # make sure we don't overlap with existing tracks.  This can happen if a tail gets tracked as a new object
-            overlaps = [
-                track.last_bound.overlap_area(region) for track in clip.active_tracks
+        if len(unmatched_regions) == 0:
+            return new_tracks
+
+        # make sure we don't overlap with existing tracks.  This can happen if a tail gets tracked as a new object
+        regions = list(unmatched_regions)
+        region_bounds = np.int32(
+            [
+                [region.left, region.top, region.right, region.bottom]
+                for region in regions
             ]
-            if len(overlaps) > 0 and max(overlaps) > (region.area * 0.25):
+        )
+        track_bounds = np.int32(
+            [
+                [bound.left, bound.top, bound.right, bound.bottom]
+                for bound in (track.last_bound for track in clip.active_tracks)
+            ]
+        ).reshape(-1, 4)
+        overlaps = tools.overlap_areas(region_bounds[:, np.newaxis], track_bounds)
+        max_overlaps = np.max(overlaps, axis=1, initial=0)
+
+        for region, max_overlap in zip(regions, max_overlaps):
+            # tracks created on this frame count as existing tracks too
+            for track in new_tracks:
+                max_overlap = max(max_overlap, track.last_bound.overlap_area(region))
+            if max_overlap > (region.area * 0.25):
                 continue
 
             track = Track.from_region(clip, region)
@@ -378,79 +574,83 @@ class ClipTrackExtractor:
                 )
 
     def _get_regions_of_interest(
-        self, clip, labels, stats, thresh, filtered, prev_filtered, mass
+        self, clip, labels, stats, filtered, prev_filtered, workspace
     ):
         """
-        Calculates pixels of interest mask from filtered image, and returns both the labeled mask and their bounding
-        rectangles.
-        :param filtered: The filtered frame
-=        :return: regions of interest, mask frame
+        Creates regions of interest from the connected components of the thresholded frame.  Components are
+        padded, cropped and filtered as arrays, and regions are only created for those that are kept.
+        :param stats: component stats from connectedComponentsWithStats, in edgeless coordinates
+        :param workspace: the workspace the frame was thresholded and labelled with
+        :return: regions of interest
         """
-
-        if prev_filtered is not None:
-            delta_frame = np.abs(filtered - prev_filtered)
-        else:
-            delta_frame = None
+        strategy = self.config.cropped_regions_strategy
+        if strategy not in ["all", "cautious", "none"]:
+            raise ValueError(
+                "Invalid mode for CROPPED_REGIONS_STRATEGY, expected ['all','cautious','none'] but found {}".format(
+                    strategy
+                )
+            )
+        if labels <= 1:
+            return []
 
         # we enlarge the rects a bit, partly because we eroded them previously, and partly because we want some context.
         padding = self.frame_padding
         edge = self.config.edge_pixels
-        # find regions of interest
-        regions = []
-        for i in range(1, labels):
+        crop = clip.crop_rectangle
+        # left, top, right, bottom in full frame coordinates
+        padded = stats[1:labels, :4] + (
+            edge - padding,
+            edge - padding,
+            padding * 2,
+            padding * 2,
+        )
+        padded[:, 2:] += padded[:, :2]
+        bounds = np.minimum(
+            np.maximum(padded, (crop.left, crop.top) * 2),
+            (crop.right, crop.bottom) * 2,
+        )
+        was_cropped = (bounds != padded).any(axis=1)
+
+        if strategy == "cautious":
+            size = padded[:, 2:] - padded[:, :2]
+            cropped_size = bounds[:, 2:] - bounds[:, :2]
+            keep = ((size - cropped_size) / size <= 0.25).all(axis=1)
+        elif strategy == "none":
+            keep = ~was_cropped
+        else:
+            keep = np.ones(len(bounds), dtype=np.bool_)
+
+        # the real mass is calculated from before the dilation
+        mass = workspace.component_mass(labels)[1:]
+        variance = np.zeros(len(bounds))
+        if prev_filtered is not None and keep.any():
+            variance[keep] = workspace.region_variances(
+                filtered, prev_filtered, bounds[keep]
+            )
 
+        # filter out regions that are probably just noise
+        keep &= (variance >= self.config.aoi_pixel_variance) | (
+            mass >= self.config.aoi_min_mass
+        )
+        is_along_border = was_cropped | (
+            bounds == (crop.x, crop.y, crop.width, crop.height)
+        ).any(axis=1)
+
+        regions = []
+        for i in np.flatnonzero(keep).tolist():
+            left, top, right, bottom = bounds[i].tolist()
             region = Region(
-                stats[i, 0],
-                stats[i, 1],
-                stats[i, 2],
-                stats[i, 3],
-                stats[i, 4],
-                0,
-                i,
+                left,
+                top,
+                right - left,
+                bottom - top,
+                int(mass[i]),
+                float(variance[i]),
+                i + 1,
                 clip.frame_on,
+                bool(was_cropped[i]),
             )
-            # want the real mass calculated from before the dilation
-            # region.mass = np.sum(region.subimage(thresh))
-            region.mass = mass
-            # Add padding to region and change coordinates from edgeless image -> full image
-            region.x += edge - padding
-            region.y += edge - padding
-            region.width += padding * 2
-            region.height += padding * 2
-
-            old_region = region.copy()
-            region.crop(clip.crop_rectangle)
-            region.was_cropped = str(old_region) != str(region)
-            region.set_is_along_border(clip.crop_rectangle)
-            if self.config.cropped_regions_strategy == "cautious":
-                crop_width_fraction = (
-                    old_region.width - region.width
-                ) / old_region.width
-                crop_height_fraction = (
-                    old_region.height - region.height
-                ) / old_region.height
-                if crop_width_fraction > 0.25 or crop_height_fraction > 0.25:
-                    continue
-            elif self.config.cropped_regions_strategy == "none":
-                if region.was_cropped:
-                    continue
-            elif self.config.cropped_regions_strategy != "all":
-                raise ValueError(
-                    "Invalid mode for CROPPED_REGIONS_STRATEGY, expected ['all','cautious','none'] but found {}".format(
-                        self.config.cropped_regions_strategy
-                    )
-                )
-
-            if delta_frame is not None:
-                region_difference = region.subimage(delta_frame)
-                region.pixel_variance = np.var(region_difference)
-
-            # filter out regions that are probably just noise
-            if (
-                region.pixel_variance < self.config.aoi_pixel_variance
-                and region.mass < self.config.aoi_min_mass
-            ):
-                continue
+            region.is_along_border = bool(is_along_border[i])
             regions.append(region)
         return regions
 
@@ -479,10 +679,11 @@ class ClipTrackExtractor:
             "{} {}".format("Number of tracks before filtering", len(clip.tracks))
         )
 
+        track_index = TrackIndex(clip.tracks)
         for stats, track in track_stats:
             # discard any tracks that overlap too often with other tracks.  This normally means we are tracking the
             # tail of an animal.
-            if not self.filter_track(clip, track, stats):
+            if not self.filter_track(clip, track, stats, track_index):
                 good_tracks.append(track)
 
         clip.tracks = good_tracks
@@ -502,7 +703,7 @@ class ClipTrackExtractor:
             )
             clip.tracks = clip.tracks[: self.max_tracks]
 
-    def filter_track(self, clip, track, stats):
+    def filter_track(self, clip, track, stats, track_index=None):
         # discard any tracks that are less min_duration
         # these are probably glitches anyway, or don't contain enough information.
         if len(track) < self.config.min_duration_secs * 9:
@@ -532,10 +733,10 @@ class ClipTrackExtractor:
 
             return True
 
+        if track_index is None:
+            track_index = TrackIndex(clip.tracks)
         highest_ratio = 0
-        for other in clip.tracks:
-            if track == other:
-                continue
+        for other in track_index.get_overlapping(track):
             highest_ratio = max(track.get_overlap_ratio(other), highest_ratio)
 
         if highest_ratio > self.config.track_overlap_ratio:
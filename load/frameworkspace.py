@@ -0,0 +1,235 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import cv2
+import numpy as np
+
+
+def order_statistics(values, scratch=None):
+    """
+    Finds the min, max and median of values, the median is calculated in the same way as np.median.
+    Integer values that span a range no larger than their count are counted with bincount, otherwise the median
+    is found by partitioning a copy of values.
+    :param scratch: (optional) 1d array of the same size and dtype as values to partition in
+    :return: min, max, median
+    """
+    values = values.ravel()
+    f_min = values.min()
+    f_max = values.max()
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        ranks = [middle]
+    else:
+        ranks = [middle - 1, middle]
+
+    is_integer = np.issubdtype(values.dtype, np.integer)
+    if is_integer and int(f_max) - int(f_min) < len(values):
+        cumulative = np.cumsum(np.bincount(values - f_min))
+        middle_values = [
+            np.float64(f_min) + np.searchsorted(cumulative, rank, side="right")
+            for rank in ranks
+        ]
+    else:
+        if scratch is None:
+            scratch = values.copy()
+        else:
+            np.copyto(scratch, values)
+        scratch.partition(ranks)
+        middle_values = [scratch[rank] for rank in ranks]
+        if is_integer:
+            # np.median averages integers as float64
+            middle_values = [np.float64(value) for value in middle_values]
+
+    if len(middle_values) == 1:
+        return f_min, f_max, middle_values[0]
+    return f_min, f_max, (middle_values[0] + middle_values[1]) / 2
+
+
+class FrameWorkspace:
+    """
+    Preallocated buffers used while tracking a frame, so that the per frame work doesn't allocate full frame
+    temporaries.  Filtered frames and masks are handed on to the frame buffer, so they are only reused when
+    reuse_outputs is set, in which case two sets are alternated so the previous frame stays valid.
+    """
+
+    # number of regions from which region_variances uses integral images
+    INTEGRAL_MIN_REGIONS = 8
+
+    def __init__(self, shape, edge, dtype=np.float32, reuse_outputs=False):
+        self.shape = shape
+        self.edge = edge
+        self.dtype = np.dtype(dtype)
+        self.reuse_outputs = reuse_outputs
+        height, width = shape
+        edgeless_shape = (height - 2 * edge, width - 2 * edge)
+        # labels can't outnumber pixels
+        if height * width <= np.iinfo(np.uint16).max:
+            self.mask_dtype = np.uint16
+        else:
+            self.mask_dtype = np.int32
+
+        self.median_scratch = np.empty(height * width, dtype=self.dtype)
+        self.delta = np.empty(shape, dtype=self.dtype)
+        self.thermal_scratch = None
+        self.below = np.empty(shape, dtype=np.bool_)
+        self.blurred = np.empty(edgeless_shape, dtype=self.dtype)
+        self.edgeless_below = np.empty(edgeless_shape, dtype=np.bool_)
+        self.thresh = np.empty(edgeless_shape, dtype=np.uint8)
+        self.dilated = np.empty(edgeless_shape, dtype=np.uint8)
+        self.labels = np.empty(edgeless_shape, dtype=np.int32)
+
+        self.output_index = 0
+        if reuse_outputs:
+            self.filtered_outputs = [
+                np.empty(shape, dtype=self.dtype) for _ in range(2)
+            ]
+            self.mask_outputs = [
+                np.zeros(shape, dtype=self.mask_dtype) for _ in range(2)
+            ]
+
+    def matches(self, shape, edge, dtype, reuse_outputs):
+        return (
+            self.shape == shape
+            and self.edge == edge
+            and self.dtype == dtype
+            and self.reuse_outputs == reuse_outputs
+        )
+
+    @staticmethod
+    def filtered_dtype(clip):
+        """ Whole clip backgrounds are floats, so filtering is done at their precision """
+        if clip.background is None or clip.background_is_preview:
+            return np.dtype(np.float32)
+        return np.result_type(np.float32, clip.background)
+
+    def next_outputs(self):
+        """
+        Returns the filtered frame and mask arrays to use for the next frame
+        :return: filtered, mask
+        """
+        if not self.reuse_outputs:
+            return (
+                np.empty(self.shape, dtype=self.dtype),
+                np.zeros(self.shape, dtype=self.mask_dtype),
+            )
+        self.output_index = 1 - self.output_index
+        return (
+            self.filtered_outputs[self.output_index],
+            self.mask_outputs[self.output_index],
+        )
+
+    def median(self, frame):
+        """ Same as np.median, but partitions a preallocated copy of the frame """
+        scratch = self.median_scratch
+        np.copyto(scratch, frame.ravel())
+        middle = len(scratch) // 2
+        if len(scratch) % 2 == 1:
+            scratch.partition(middle)
+            return scratch[middle]
+        scratch.partition([middle - 1, middle])
+        return (scratch[middle - 1] + scratch[middle]) / 2
+
+    def thermal_statistics(self, thermal):
+        """ Returns the min, max and median of thermal, see order_statistics """
+        if self.thermal_scratch is None or self.thermal_scratch.dtype != thermal.dtype:
+            self.thermal_scratch = np.empty(thermal.size, dtype=thermal.dtype)
+        return order_statistics(thermal, self.thermal_scratch)
+
+    def zero_negatives(self, frame):
+        np.less(frame, 0, out=self.below)
+        np.copyto(frame, 0, where=self.below)
+
+    def blur_and_threshold(self, frame, threshold):
+        """
+        Same as tools.blur_and_return_as_mask, but the mask is returned as uint8.  The pixels counted in mass are
+        kept for component_mass.
+        :return: thresholded frame, mass
+        """
+        blurred = cv2.GaussianBlur(frame, (5, 5), 0, dst=self.blurred)
+        np.less(blurred, blurred.dtype.type(threshold), out=self.edgeless_below)
+        np.copyto(blurred, 0, where=self.edgeless_below)
+        np.greater(blurred, 0, out=self.edgeless_below)
+        mass = np.count_nonzero(self.edgeless_below)
+        np.copyto(self.thresh, blurred, casting="unsafe")
+        return self.thresh, mass
+
+    def dilate(self, thresh, kernel):
+        return cv2.dilate(thresh, kernel, dst=self.dilated, iterations=1)
+
+    def connected_components(self, image, mask):
+        """
+        Labels connected components of image, labels are copied into the centre of mask
+        :return: number of labels, component stats
+        """
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+            image, labels=self.labels
+        )
+        height, width = self.shape
+        mask[self.edge : height - self.edge, self.edge : width - self.edge] = labels
+        return num_labels, stats
+
+    def component_mass(self, num_labels):
+        """
+        Counts the pixels above the threshold, before dilation, in each component.  Must be called after
+        blur_and_threshold and connected_components for the same frame
+        :return: array of mass indexed by label
+        """
+        return np.bincount(self.labels[self.edgeless_below], minlength=num_labels)
+
+    def region_variances(self, filtered, prev_filtered, bounds):
+        """
+        Calculates the variance of the absolute difference between filtered and prev_filtered inside each of
+        bounds.  A few regions are calculated directly, INTEGRAL_MIN_REGIONS or more from integral images of the
+        difference and its square, which costs about the same as a full frame difference
+        :param bounds: int array of shape [regions, 4] of left, top, right, bottom
+        :return: float64 array of variances
+        """
+        if len(bounds) < self.INTEGRAL_MIN_REGIONS:
+            variances = np.empty(len(bounds))
+            for i, (left, top, right, bottom) in enumerate(bounds.tolist()):
+                window = np.s_[top:bottom, left:right]
+                delta = np.subtract(filtered[window], prev_filtered[window])
+                np.abs(delta, out=delta)
+                # the same steps as np.var, without its overhead
+                delta -= delta.sum() / delta.size
+                np.multiply(delta, delta, out=delta)
+                variances[i] = delta.sum() / delta.size
+            return variances
+
+        delta = self.delta
+        np.subtract(filtered, prev_filtered, out=delta)
+        np.abs(delta, out=delta)
+        delta_sum, delta_square_sum = cv2.integral2(
+            delta, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F
+        )
+        left, top, right, bottom = bounds.T
+
+        def area_sums(integral):
+            return (
+                integral[bottom, right]
+                - integral[top, right]
+                - integral[bottom, left]
+                + integral[top, left]
+            )
+
+        count = (right - left) * (bottom - top)
+        mean = area_sums(delta_sum) / count
+        variance = area_sums(delta_square_sum) / count - mean ** 2
+        # rounding can leave tiny negative variances for constant areas
+        return np.maximum(variance, 0)
@@ -0,0 +1,91 @@
+import numpy as np
+
+from .backgroundestimator import BackgroundEstimator, PercentileHistogram
+
+
+class TestBackgroundEstimator:
+    def get_frames(self, num_frames=50):
+        np.random.seed(7)
+        background = np.random.randint(2900, 3100, size=(12, 16))
+        noise = np.random.randint(-60, 60, size=(num_frames, 12, 16))
+        return np.uint16(background + noise)
+
+    def test_matches_percentile(self):
+        frames = self.get_frames()
+        estimator = BackgroundEstimator(bin_width=1)
+        for frame in frames:
+            estimator.add_frame(frame)
+
+        expected = np.percentile(frames, q=10, axis=0)
+        assert np.allclose(estimator.get_background(), expected)
+
+    def test_max_frames(self, monkeypatch, caplog):
+        frames = self.get_frames()
+        monkeypatch.setattr(BackgroundEstimator, "MAX_FRAMES", 20)
+        estimator = BackgroundEstimator(bin_width=1)
+        for frame in frames:
+            estimator.add_frame(frame)
+
+        # frames past MAX_FRAMES are still counted, with a warning
+        assert estimator.num_frames == len(frames)
+        assert len(caplog.records) == 1
+        expected = np.percentile(frames, q=10, axis=0)
+        assert np.allclose(estimator.get_background(), expected)
+
+    def test_approximate_percentile(self):
+        frames = self.get_frames()
+        estimator = BackgroundEstimator(bin_width=4)
+        for frame in frames:
+            estimator.add_frame(frame)
+
+        expected = np.percentile(frames, q=10, axis=0)
+        assert np.max(np.abs(estimator.get_background() - expected)) <= 2
+
+    def test_average_delta(self):
+        frames = self.get_frames()
+        estimator = BackgroundEstimator()
+        for frame in frames:
+            estimator.add_frame(frame)
+
+        delta = np.float32(frames[1:]) - np.float32(frames[:-1])
+        assert np.isclose(estimator.average_delta, np.mean(np.abs(delta)))
+
+    def test_sample_is_bounded(self):
+        frames = self.get_frames(num_frames=100)
+        estimator = BackgroundEstimator(max_sample_frames=20)
+        for frame in frames:
+            estimator.add_frame(frame)
+
+        assert len(estimator.sample_frames) <= 20
+        assert estimator.sample_stride == 8
+        assert np.array_equal(estimator.sample_frames[-1], frames[96])
+
+
+class TestPercentileHistogram:
+    def get_values(self):
+        np.random.seed(7)
+        values = np.random.exponential(20, size=10000)
+        values[:3000] = 0
+        return values
+
+    def test_approximate_percentile(self):
+        values = self.get_values()
+        histogram = PercentileHistogram(bin_width=0.25)
+        histogram.add(values)
+
+        assert histogram.count == len(values)
+        for q in [10, 50, 99, 99.9]:
+            assert abs(histogram.percentile(q) - np.percentile(values, q)) <= 0.25
+
+    def test_merge(self):
+        values = self.get_values()
+        histogram = PercentileHistogram()
+        histogram.add(values)
+        merged = PercentileHistogram()
+        for chunk in np.array_split(values, 7):
+            chunk_histogram = PercentileHistogram()
+            chunk_histogram.add(chunk)
+            merged.merge(chunk_histogram)
+
+        assert merged.count == histogram.count
+        assert merged.percentile(99.9) == histogram.percentile(99.9)
@@ -0,0 +1,257 @@
+import itertools
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark.synthetic import synthetic_frames, create_clip
+from config.config import Config
+from ml_tools import tools
+from track.region import Region
+from .clip import Clip
+from .cliptrackextractor import ClipTrackExtractor
+from .frameworkspace import FrameWorkspace
+
+CONFIG_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "smoketest", "test-config.yaml"
+)
+CLIP_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "smoketest", "clips", "hedgehog.cptv"
+)
+
+
+def reference_whole_clip_stats(extractor, clip, frames):
+    """ The original ClipTrackExtractor._whole_clip_stats, which filtered all frames at once """
+    workspace = FrameWorkspace(
+        frames[0].shape,
+        extractor.config.edge_pixels,
+        FrameWorkspace.filtered_dtype(clip),
+    )
+    filtered = np.float32(
+        [extractor._get_filtered_frame(clip, frame, workspace) for frame in frames]
+    )
+    delta = np.asarray(frames[1:], dtype=np.float32) - np.asarray(
+        frames[:-1], dtype=np.float32
+    )
+    average_delta = float(np.nanmean(np.abs(delta)))
+    threshold = float(
+        np.percentile(
+            np.reshape(filtered, [-1]), q=extractor.config.threshold_percentile
+        )
+    )
+    return threshold, average_delta, float(np.mean(np.abs(filtered)))
+
+
+def reference_regions(extractor, clip, labels, stats, filtered, prev_filtered, mass):
+    """ The original ClipTrackExtractor._get_regions_of_interest, with the mass of each component """
+    padding = extractor.frame_padding
+    edge = extractor.config.edge_pixels
+    regions = []
+    for i in range(1, labels):
+        region = Region(
+            stats[i, 0], stats[i, 1], stats[i, 2], stats[i, 3], mass[i], 0, i, 0
+        )
+        region.x += edge - padding
+        region.y += edge - padding
+        region.width += padding * 2
+        region.height += padding * 2
+        old_region = region.copy()
+        region.crop(clip.crop_rectangle)
+        region.was_cropped = str(old_region) != str(region)
+        region.set_is_along_border(clip.crop_rectangle)
+        strategy = extractor.config.cropped_regions_strategy
+        if strategy == "cautious":
+            crop_width_fraction = (old_region.width - region.width) / old_region.width
+            crop_height_fraction = (
+                old_region.height - region.height
+            ) / old_region.height
+            if crop_width_fraction > 0.25 or crop_height_fraction > 0.25:
+                continue
+        elif strategy == "none" and region.was_cropped:
+            continue
+        region_difference = np.abs(
+            region.subimage(filtered) - region.subimage(prev_filtered)
+        )
+        region.pixel_variance = np.var(region_difference)
+        if (
+            region.pixel_variance < extractor.config.aoi_pixel_variance
+            and region.mass < extractor.config.aoi_min_mass
+        ):
+            continue
+        regions.append(region)
+    return regions
+
+
+class TestClipTrackExtractor:
+    def test_regions_of_interest(self):
+        config = Config.load_from_file(CONFIG_FILE).tracking
+        extractor = ClipTrackExtractor(config, False, False, keep_frames=False)
+        frames = synthetic_frames(20, num_animals=6, seed=2)
+        clip = create_clip(extractor, frames)
+        workspace = extractor._get_workspace(clip, frames[0].shape)
+        # variances are calculated directly for the first and from integral images for the second
+        for strategy, integral_min_regions in itertools.product(
+            ["all", "cautious", "none"], [1000, 1]
+        ):
+            config.cropped_regions_strategy = strategy
+            workspace.INTEGRAL_MIN_REGIONS = integral_min_regions
+            prev_filtered = None
+            for frame in frames:
+                filtered, mask = workspace.next_outputs()
+                extractor._get_filtered_frame(clip, frame, workspace, out=filtered)
+                thresh, _ = workspace.blur_and_threshold(
+                    clip.crop_rectangle.subimage(filtered), clip.threshold
+                )
+                dilated = workspace.dilate(thresh, extractor.dilate_kernel)
+                labels, stats = workspace.connected_components(dilated, mask)
+                if prev_filtered is not None:
+                    mass = np.bincount(
+                        workspace.labels[workspace.edgeless_below], minlength=labels
+                    )
+                    expected = reference_regions(
+                        extractor, clip, labels, stats, filtered, prev_filtered, mass
+                    )
+                    regions = extractor._get_regions_of_interest(
+                        clip, labels, stats, filtered, prev_filtered, workspace
+                    )
+                    assert [str(region) for region in regions] == [
+                        str(region) for region in expected
+                    ]
+                    for region, expected_region in zip(regions, expected):
+                        assert region.mass == expected_region.mass
+                        assert region.was_cropped == expected_region.was_cropped
+                        assert region.is_along_border == expected_region.is_along_border
+                        assert np.isclose(
+                            region.pixel_variance,
+                            expected_region.pixel_variance,
+                            rtol=1e-4,
+                        )
+                prev_filtered = filtered.copy()
+
+    def test_whole_clip_stats(self):
+        config = Config.load_from_file(CONFIG_FILE).tracking
+        config.background_calc = "stats"
+        # don't cap the threshold, so the percentile is compared
+        config.min_threshold = 0
+        config.max_threshold = 1000
+        extractor = ClipTrackExtractor(config, False, False, keep_frames=False)
+        frames = synthetic_frames(ClipTrackExtractor.STATS_CHUNK_FRAMES * 2 + 7)
+        clip = Clip(config, "synthetic")
+        clip.set_res(frames.shape[2], frames.shape[1])
+        clip.background = np.percentile(frames, q=10, axis=0)
+
+        threshold, average_delta, deviation = reference_whole_clip_stats(
+            extractor, clip, frames
+        )
+        extractor._whole_clip_stats(clip, frames)
+        assert abs(clip.threshold - threshold) <= 0.25
+        assert np.isclose(clip.stats.average_delta, average_delta, rtol=1e-5)
+        assert np.isclose(clip.stats.filtered_deviation, deviation, rtol=1e-5)
+
+    def test_metadata_clip(self):
+        config = Config.load_from_file(CONFIG_FILE)
+        extractor = ClipTrackExtractor(config.tracking, False, False)
+        clip = Clip(config.tracking, CLIP_FILE)
+        metadata = tools.load_clip_metadata(os.path.splitext(CLIP_FILE)[0] + ".txt")
+        clip.load_metadata(metadata, True, config.load.tag_precedence)
+        assert extractor.parse_clip(clip)
+        for frame_number, tracks in clip.tracks_by_frame.items():
+            for track in tracks:
+                assert frame_number in track.frame_list
+
+        for track in clip.tracks:
+            assert track.current_frame_num == len(set(track.frame_list))
+            for region in track.bounds_history:
+                frame = clip.frame_buffer.get_frame(region.frame_number)
+                filtered = region.subimage(frame.filtered)
+                assert region.mass == tools.calculate_mass(filtered, clip.threshold)
+                # the mask marks the same pixels as labelling components of the whole frame would
+                thresh, _ = tools.blur_and_return_as_mask(
+                    clip.crop_rectangle.subimage(frame.filtered), clip.threshold
+                )
+                dilated = cv2.dilate(np.uint8(thresh), extractor.dilate_kernel)
+                expected = np.zeros(frame.mask.shape, dtype=np.bool_)
+                clip.crop_rectangle.subimage(expected)[:] = dilated > 0
+                assert np.array_equal(
+                    region.subimage(frame.mask) > 0, region.subimage(expected)
+                )
+
+    def test_crop_frames(self):
+        config = Config.load_from_file(CONFIG_FILE)
+        clips = []
+        for crop_frames in [False, True]:
+            extractor = ClipTrackExtractor(
+                config.tracking, False, False, crop_frames=crop_frames
+            )
+            clip = Clip(config.tracking, CLIP_FILE)
+            assert extractor.parse_clip(clip)
+            clips.append(clip)
+        full_clip, clip = clips
+
+        assert len(clip.tracks) == len(full_clip.tracks) > 0
+        num_kept = sum(frame is not None for frame in clip.frame_buffer.frames)
+        assert num_kept < len(full_clip.frame_buffer.frames)
+        # dropped frames are skipped when iterating, rather than ending it
+        kept = [frame for frame in clip.frame_buffer]
+        assert len(kept) == num_kept
+        assert kept[-1].frame_number == len(clip.frame_buffer) - 1
+        for track, full_track in zip(clip.tracks, full_clip.tracks):
+            for region in track.bounds_history:
+                frame = clip.frame_buffer.get_frame(region.frame_number)
+                full_frame = full_clip.frame_buffer.get_frame(region.frame_number)
+                # the last frame is never cropped
+                if frame.crop is None:
+                    assert frame.frame_number == len(clip.frame_buffer) - 1
+                assert frame.get_thermal_median() == np.median(full_frame.thermal)
+                assert np.array_equal(
+                    track.crop_by_region(frame, region),
+                    full_track.crop_by_region(full_frame, region),
+                )
+
+    def test_crop_frames_smoothing(self):
+        config = Config.load_from_file(CONFIG_FILE)
+        config.tracking.track_smoothing = True
+        extractor = ClipTrackExtractor(config.tracking, False, False, crop_frames=True)
+        # smoothing can grow tracks past the crops, so frames are kept whole
+        assert not extractor.crop_frames
+        clip = Clip(config.tracking, CLIP_FILE)
+        assert extractor.parse_clip(clip)
+        assert all(frame.crop is None for frame in clip.frame_buffer.frames)
+
+        # a smoothed region which grew past the crop of a frame can't be taken from it
+        track = clip.tracks[0]
+        region = track.bounds_history[0]
+        frame = clip.frame_buffer.get_frame(region.frame_number)
+        cropped = frame.cropped(region.copy())
+        grown = Region(region.x - 2, region.y - 2, region.width + 4, region.height + 4)
+        with pytest.raises(ValueError):
+            track.crop_by_region(cropped, grown)
+        assert np.array_equal(
+            track.crop_by_region(cropped, region), track.crop_by_region(frame, region)
+        )
+
+    def test_load_tracks(self):
+        config = Config.load_from_file(CONFIG_FILE)
+        extractor = ClipTrackExtractor(config.tracking, False, False)
+        tracked_clip = Clip(config.tracking, CLIP_FILE)
+        assert extractor.parse_clip(tracked_clip)
+        clip = Clip(config.tracking, CLIP_FILE)
+        clip.load_tracks(
+            [(track.get_id(), track.bounds.copy()) for track in tracked_clip.tracks]
+        )
+        assert extractor.parse_clip(clip)
+
+        assert len(clip.tracks) == len(tracked_clip.tracks) > 0
+        for track, tracked in zip(clip.tracks, tracked_clip.tracks):
+            assert track.get_id() == tracked.get_id()
+            assert np.array_equal(track.bounds, tracked.bounds)
+            for region in track.bounds_history:
+                assert np.array_equal(
+                    track.crop_by_region(
+                        clip.frame_buffer.get_frame(region.frame_number), region
+                    ),
+                    tracked.crop_by_region(
+                        tracked_clip.frame_buffer.get_frame(region.frame_number), region
+                    ),
+                )
@@ -0,0 +1,44 @@
+import numpy as np
+
+from ml_tools import tools
+from .frameworkspace import FrameWorkspace, order_statistics
+
+
+class TestFrameWorkspace:
+    def test_median(self):
+        np.random.seed(3)
+        for shape in [(120, 160), (5, 7)]:
+            workspace = FrameWorkspace(shape, 1)
+            frame = np.float32(np.random.normal(0, 100, shape))
+            assert workspace.median(frame) == np.median(frame)
+
+    def test_order_statistics(self):
+        np.random.seed(5)
+        for shape in [(120, 160), (5, 7), (4, 4)]:
+            thermal = np.uint16(np.random.normal(3000, 50, shape))
+            # a hot pixel makes the range too large to count
+            hot = thermal.copy()
+            hot[0, 0] = 60000
+            for frame in [thermal, hot, np.float32(thermal)]:
+                f_min, f_max, f_median = order_statistics(frame)
+                assert f_min == np.min(frame)
+                assert f_max == np.max(frame)
+                assert f_median == np.median(frame)
+                assert f_median.dtype == np.median(frame).dtype
+
+    def test_blur_and_threshold(self):
+        np.random.seed(4)
+        workspace = FrameWorkspace((120, 160), 1)
+        frame = np.float32(np.random.randint(0, 400, (118, 158)))
+        thresh, mass = workspace.blur_and_threshold(frame, 200.5)
+        expected, expected_mass = tools.blur_and_return_as_mask(frame, 200.5)
+        assert mass == expected_mass
+        assert np.array_equal(thresh, np.uint8(expected))
+
+    def test_reused_outputs(self):
+        workspace = FrameWorkspace((120, 160), 1, reuse_outputs=True)
+        filtered, mask = workspace.next_outputs()
+        prev_filtered, _ = workspace.next_outputs()
+        assert filtered is not prev_filtered
+        assert workspace.next_outputs()[0] is filtered
+        assert mask.dtype == np.uint16
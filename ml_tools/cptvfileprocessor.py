@@ -4,19 +4,44 @@ import os
 import time
 from datetime import datetime
 
+from ml_tools.workerpool import WorkerPool
+
+# the processor of a worker process, see init_worker
+_processor = None
+
 
 def process_job(job):
-    """ Just a wrapper to pass tupple containing (extractor, *params) to the process_file method. """
+    """
+    Just a wrapper to pass tupple containing (extractor, *params) to the process_file method.
+    :return: the result of process_file, or None if it raised an exception
+    """
     processor = job[0]
     path = job[1]
     params = job[2]
 
+    result = None
     try:
-        processor.process_file(path, **params)
+        result = processor.process_file(path, **params)
     except Exception:
         logging.exception("Warning - error processing job")
 
     time.sleep(0.001)  # apparently gives me a chance to catch the control-c
+    return result
+
+
+def init_worker(processor):
+    """ Initializer of worker processes, the processor is only sent to each worker once rather than with every job """
+    global _processor
+    _processor = processor
+    processor.init_worker()
+
+
+def process_worker_job(job):
+    """
+    Processes a job of (path, params) with the processor of this worker process
+    :return: the path and the worker_result of the job
+    """
+    return job[0], _processor.worker_result(process_job((_processor,) + tuple(job)))
 
 
 class CPTVFileProcessor:
@@ -51,6 +76,17 @@ class CPTVFileProcessor:
         """ The function to process an individual file. """
         raise Exception("Process file method must be overwritten in sub class.")
 
+    def init_worker(self):
+        """ Called once in each worker process before it processes any files. """
+        pass
+
+    def worker_result(self, result):
+        """
+        Returns what a worker process sends back for the result of process_file, which must be picklable.  By
+        default nothing is sent, as results such as a whole tracker are expensive to send.
+        """
+        return None
+
     def process_all(self, root, **kwargs):
         if root is None:
             root = self.config.source_folder
@@ -95,28 +131,42 @@ class CPTVFileProcessor:
         """
         Processes a list of jobs. Supports worker threads.
         :param jobs: List of jobs to process
+        :return: list of the results of process_file, or of worker_result when processed by worker processes, in
+            the order jobs completed
         """
 
+        results = []
         if self.workers_threads == 0:
             # just process the jobs in the main thread
             for job in jobs:
-                process_job(job)
+                results.append(process_job(job))
         else:
-            # send the jobs to a worker pool
-            pool = multiprocessing.Pool(self.workers_threads)
+            # send the jobs to a worker pool, workers are kept for many jobs and only sent the path and params of
+            # each job
+            pool = WorkerPool(
+                self.workers_threads,
+                init_worker,
+                (self,),
+                max_jobs=self.config.worker_max_jobs,
+                max_rss_mb=self.config.worker_max_rss_mb,
+            )
             try:
-                # see https://stackoverflow.com/questions/11312525/catch-ctrlc-sigint-and-exit-multiprocesses-gracefully-in-python
-                pool.map(process_job, jobs, chunksize=1)
-                pool.close()
-                pool.join()
+                for i, completed in enumerate(
+                    pool.imap_unordered(process_worker_job, [job[1:] for job in jobs])
+                ):
+                    # None if the job raised an exception, which the worker has logged
+                    if completed is None:
+                        continue
+                    path, result = completed
+                    logging.debug("Processed %s/%s %s", i + 1, len(jobs), path)
+                    results.append(result)
             except KeyboardInterrupt:
                 logging.info("KeyboardInterrupt, terminating.")
-                pool.terminate()
                 exit()
             except Exception:
                 logging.exception("Error processing files")
-            else:
-                pool.close()
+            logging.info("Processed files with %s workers", pool.started)
+        return results
 
     def log_message(self, message):
         """ Record message in stdout.  Will be printed if verbose is enabled. """
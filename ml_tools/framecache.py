@@ -1,5 +1,9 @@
+from collections import OrderedDict
 import h5py
 import os
+import queue
+import threading
+import zlib
 import numpy as np
 from multiprocessing import Lock
 
@@ -7,70 +11,402 @@ from multiprocessing import Lock
 from ml_tools.tools import get_clipped_flow
 
 
+def cache_array(frame):
+    """
+    Returns frame as a float16 array of thermal, filtered, clipped flow_h and flow_v, and mask channels.  Flow is
+    0 if the frame has none
+    """
+    height, width = frame.thermal.shape
+    if frame.flow is None:
+        scaled_flow = np.zeros((height, width, 2), dtype=np.float32)
+    else:
+        scaled_flow = get_clipped_flow(frame.flow)
+        # values too small for a normal float16 are very slow to convert, and are 0 once cropped to int16
+        scaled_flow[np.abs(scaled_flow) < np.finfo(np.float16).tiny] = 0
+    frame_val = np.empty((5, height, width), dtype=np.float16)
+    frame_val[0] = frame.thermal
+    frame_val[1] = frame.filtered
+    frame_val[2] = scaled_flow[:, :, 0]
+    frame_val[3] = scaled_flow[:, :, 1]
+    frame_val[4] = frame.mask
+    return frame_val
+
+
 class FrameCache:
+    """
+    Caches frames to disk as a single (frames, 5, height, width) float16 dataset of thermal, filtered, flow_h,
+    flow_v and mask channels, with a parallel ffc_affected dataset.  Frames are stored at the row of their frame
+    number and the datasets are grown in blocks of GROW_FRAMES, so consecutive frames are read and written with
+    sequential I/O.
+    """
+
+    # frames added to the datasets when they are full
+    GROW_FRAMES = 64
+    # frames per HDF5 chunk
+    CHUNK_FRAMES = 4
+
     def __init__(self, cptv_name, keep_open=True, delete_if_exists=True):
         basename = os.path.splitext(cptv_name)[0]
         self.filename = basename + ".cache"
         self.db = None
         self.keep_open = keep_open
-        self.num_farmes = 0
+        self.num_frames = 0
+        self.saved_num_frames = 0
+        self.frames = None
+        self.ffc_affected = None
         if delete_if_exists:
             self.delete()
 
         f = h5py.File(self.filename, "w")
-        f.create_group("frames")
+        f.attrs["num_frames"] = 0
         f.close()
 
-    def add_frame(self, frame):
-        self.open()
-        frames = self.db["frames"]
-        frame_group = frames.create_group(str(frame.frame_number))
-        frame_group.attrs["ffc_affected"] = frame.ffc_affected
+    def _create_datasets(self, height, width):
+        self.frames = self.db.create_dataset(
+            "frames",
+            (0, 5, height, width),
+            maxshape=(None, 5, height, width),
+            chunks=(FrameCache.CHUNK_FRAMES, 5, height, width),
+            dtype=np.float16,
+        )
+        self.ffc_affected = self.db.create_dataset(
+            "ffc_affected",
+            (0,),
+            maxshape=(None,),
+            chunks=(FrameCache.GROW_FRAMES,),
+            dtype=np.bool_,
+        )
 
-        height, width = frame.thermal.shape
+    def _grow(self, size):
+        """ Grows the datasets in blocks of GROW_FRAMES until they hold size frames """
+        if size <= len(self.frames):
+            return
+        size = -(-size // FrameCache.GROW_FRAMES) * FrameCache.GROW_FRAMES
+        self.frames.resize(size, axis=0)
+        self.ffc_affected.resize(size, axis=0)
 
-        chunks = (1, height, width)
+    def add_frame(self, frame):
+        self.open()
+        if self.frames is None:
+            self._create_datasets(*frame.thermal.shape)
+        self._grow(frame.frame_number + 1)
 
-        dims = (5, height, width)
-        frame_node = frame_group.create_dataset(
-            "frame", dims, chunks=chunks, dtype=np.float16
-        )
-        scaled_flow = get_clipped_flow(frame.flow)
-        frame_val = (
-            np.float16(frame.thermal),
-            np.float16(frame.filtered),
-            np.float16(scaled_flow[:, :, 0]),
-            np.float16(scaled_flow[:, :, 1]),
-            np.float16(frame.mask),
-        )
-        frame_node[:, :, :] = frame_val
+        self.frames[frame.frame_number] = cache_array(frame)
+        self.ffc_affected[frame.frame_number] = frame.ffc_affected
+        self.num_frames = max(self.num_frames, frame.frame_number + 1)
         if not self.keep_open:
             self.close()
 
     def get_frame(self, frame_number):
+        """
+        :return: (5, height, width) array of the frame or None if it isn't cached, ffc_affected
+        """
+        frames, ffc_affected = self.get_frames(frame_number, frame_number + 1)
+        if len(frames) == 0:
+            return None, False
+        return frames[0], bool(ffc_affected[0])
+
+    def get_frames(self, start, end):
+        """
+        Reads the cached frames from start up to end with one read
+        :return: (frames, 5, height, width) array of frames, ffc_affected array of frames.  These are shorter
+            than requested if frames past the end of the cache are asked for
+        """
         self.open()
-        ffc_affected = False
-        if str(frame_number) in self.db["frames"]:
-            frame_group = self.db["frames"][str(frame_number)]
-            frame = frame_group["frame"]
-            ffc_affected = frame_group.attrs["ffc_affected"]
+        end = min(end, self.num_frames)
+        if start >= end:
+            frames = np.empty((0, 5, 0, 0), dtype=np.float16)
+            ffc_affected = np.empty(0, dtype=np.bool_)
         else:
-            frame = None
+            frames = self.frames[start:end]
+            ffc_affected = self.ffc_affected[start:end]
         if not self.keep_open:
             self.close()
-        return frame, ffc_affected
+        return frames, ffc_affected
 
     def close(self):
         if self.db:
+            # frames are only added while the cache is open for writing
+            if self.num_frames != self.saved_num_frames:
+                self.db.attrs["num_frames"] = self.num_frames
+                self.saved_num_frames = self.num_frames
             self.db.close()
             self.db = None
+            self.frames = None
+            self.ffc_affected = None
 
     def open(self, mode="a"):
         if not self.db:
             self.db = h5py.File(self.filename, mode)
+            self.num_frames = int(self.db.attrs["num_frames"])
+            self.saved_num_frames = self.num_frames
+            if "frames" in self.db:
+                self.frames = self.db["frames"]
+                self.ffc_affected = self.db["ffc_affected"]
 
     def delete(self):
         if self.db:
             self.close()
         if os.path.exists(self.filename):
             os.remove(self.filename)
+
+
+class WriteBehindFrameCache(FrameCache):
+    """
+    A FrameCache which converts and writes frames on a background thread, so tracking doesn't wait for them.
+    Up to QUEUE_FRAMES frames wait to be written, after which add_frame blocks, and the writer writes up to
+    WRITE_FRAMES waiting consecutive frames with one block write.  Frames waiting to be written are read from
+    memory, so they must not be changed after they are added.
+    """
+
+    QUEUE_FRAMES = 64
+    WRITE_FRAMES = 16
+
+    def __init__(self, cptv_name, delete_if_exists=True):
+        # guards the file and pending, h5py objects aren't safe to share between threads
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.queue = queue.Queue(WriteBehindFrameCache.QUEUE_FRAMES)
+        self.writer = None
+        self.error = None
+        super().__init__(cptv_name, True, delete_if_exists)
+
+    def add_frame(self, frame):
+        self._raise_error()
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write_frames, daemon=True)
+            self.writer.start()
+        with self.lock:
+            self.pending[frame.frame_number] = frame
+            self.num_frames = max(self.num_frames, frame.frame_number + 1)
+        self.queue.put(frame)
+
+    def _write_frames(self):
+        while True:
+            frames = [self.queue.get()]
+            while frames[-1] is not None and len(frames) < self.WRITE_FRAMES:
+                try:
+                    frames.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = frames[-1] is None
+            frames = [frame for frame in frames if frame is not None]
+            try:
+                if len(frames) > 0:
+                    self._write_block(frames)
+            except Exception as e:
+                self.error = e
+            finally:
+                for _ in range(len(frames) + stop):
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def _write_block(self, frames):
+        """ Writes frames, each run of consecutive frame numbers is written at once """
+        values = [cache_array(frame) for frame in frames]
+        with self.lock:
+            self.open()
+            if self.frames is None:
+                self._create_datasets(*frames[0].thermal.shape)
+            self._grow(max(frame.frame_number for frame in frames) + 1)
+            start = 0
+            for end in range(1, len(frames) + 1):
+                if (
+                    end < len(frames)
+                    and frames[end].frame_number == frames[end - 1].frame_number + 1
+                ):
+                    continue
+                first = frames[start].frame_number
+                self.frames[first : first + end - start] = values[start:end]
+                self.ffc_affected[first : first + end - start] = [
+                    frame.ffc_affected for frame in frames[start:end]
+                ]
+                start = end
+            # the frames are only removed once they can be read from the file
+            for frame in frames:
+                if self.pending.get(frame.frame_number) is frame:
+                    del self.pending[frame.frame_number]
+
+    def _raise_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def flush(self):
+        """ Waits for all added frames to be written """
+        if self.writer is not None:
+            self.queue.join()
+        self._raise_error()
+
+    def _stop_writer(self):
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def get_frames(self, start, end):
+        """
+        Reads the cached frames from start up to end, frames which are waiting to be written are converted from
+        memory
+        :return: (frames, 5, height, width) array of frames, ffc_affected array of frames.  These are shorter
+            than requested if frames past the end of the cache are asked for
+        """
+        with self.lock:
+            end = min(end, self.num_frames)
+            if start >= end:
+                return super().get_frames(start, end)
+            pending = [
+                frame
+                for frame in self.pending.values()
+                if start <= frame.frame_number < end
+            ]
+            self.open()
+            # rows the datasets have room for, those not written yet are 0
+            num_rows = 0
+            if self.frames is not None:
+                num_rows = max(0, min(end, len(self.frames)) - start)
+            if len(pending) == 0 and num_rows == end - start:
+                return self.frames[start:end], self.ffc_affected[start:end]
+            if self.frames is None:
+                height, width = next(iter(self.pending.values())).thermal.shape
+            else:
+                height, width = self.frames.shape[2:]
+            frames = np.zeros((end - start, 5, height, width), dtype=np.float16)
+            ffc_affected = np.zeros(end - start, dtype=np.bool_)
+            if num_rows > 0:
+                frames[:num_rows] = self.frames[start : start + num_rows]
+                ffc_affected[:num_rows] = self.ffc_affected[start : start + num_rows]
+        for frame in pending:
+            frames[frame.frame_number - start] = cache_array(frame)
+            ffc_affected[frame.frame_number - start] = frame.ffc_affected
+        return frames, ffc_affected
+
+    def close(self):
+        """ Writes any waiting frames, then closes the file and makes sure it's on disk """
+        try:
+            self.flush()
+        finally:
+            # the writer is stopped and the file closed even if writing failed, then the error is raised
+            self._stop_writer()
+            with self.lock:
+                was_open = self.db is not None
+                super().close()
+        if was_open:
+            fd = os.open(self.filename, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def open(self, mode="a"):
+        # the writer needs the file open for writing
+        super().open("a")
+
+    def delete(self):
+        self._stop_writer()
+        with self.lock:
+            self.pending.clear()
+            super().delete()
+        self.error = None
+
+
+class CompressedFrameCache:
+    """
+    Keeps frames in memory in the same layout as FrameCache, with each frame compressed on its own.  The bytes of
+    the float16 values are shuffled so the high and low bytes are compressed separately, which compresses
+    much better.  The last WINDOW_FRAMES decompressed frames are kept, so neighbouring frames which are read
+    more than once are only decompressed once.
+    """
+
+    # decompressed frames kept
+    WINDOW_FRAMES = 32
+    COMPRESSION_LEVEL = 1
+
+    def __init__(self):
+        self.compressed = []
+        self.ffc_affected = []
+        self.shape = None
+        self.window = OrderedDict()
+
+    @property
+    def num_frames(self):
+        return len(self.compressed)
+
+    @property
+    def nbytes(self):
+        """ Bytes used by the compressed frames """
+        return sum(len(data) for data in self.compressed if data is not None)
+
+    def add_frame(self, frame):
+        frame_val = cache_array(frame)
+        self.shape = frame_val.shape
+        if frame.frame_number >= len(self.compressed):
+            missing = frame.frame_number + 1 - len(self.compressed)
+            self.compressed.extend([None] * missing)
+            self.ffc_affected.extend([False] * missing)
+        shuffled = frame_val.view(np.uint8).reshape(-1, 2).T
+        self.compressed[frame.frame_number] = zlib.compress(
+            shuffled.tobytes(), CompressedFrameCache.COMPRESSION_LEVEL
+        )
+        self.ffc_affected[frame.frame_number] = frame.ffc_affected
+        self.window.pop(frame.frame_number, None)
+
+    def _decompress(self, frame_number):
+        frame_val = self.window.get(frame_number)
+        if frame_val is not None:
+            self.window.move_to_end(frame_number)
+            return frame_val
+        shuffled = np.frombuffer(
+            zlib.decompress(self.compressed[frame_number]), dtype=np.uint8
+        )
+        low_bytes, high_bytes = shuffled.reshape(2, -1)
+        frame_val = high_bytes.astype(np.uint16)
+        frame_val <<= 8
+        frame_val |= low_bytes
+        frame_val = frame_val.view(np.float16).reshape(self.shape)
+        # the same array is returned while it's in the window
+        frame_val.flags.writeable = False
+        self.window[frame_number] = frame_val
+        if len(self.window) > CompressedFrameCache.WINDOW_FRAMES:
+            self.window.popitem(last=False)
+        return frame_val
+
+    def get_frame(self, frame_number):
+        """
+        :return: (5, height, width) array of the frame or None if it isn't cached, ffc_affected
+        """
+        if frame_number >= self.num_frames or self.compressed[frame_number] is None:
+            return None, False
+        return self._decompress(frame_number), self.ffc_affected[frame_number]
+
+    def get_frames(self, start, end):
+        """
+        :return: (frames, 5, height, width) array of frames, ffc_affected array of frames.  These are shorter
+            than requested if frames past the end of the cache are asked for
+        """
+        end = min(end, self.num_frames)
+        if start >= end:
+            return (
+                np.empty((0, 5, 0, 0), dtype=np.float16),
+                np.empty(0, dtype=np.bool_),
+            )
+        frames = np.empty((end - start,) + self.shape, dtype=np.float16)
+        for i, frame_number in enumerate(range(start, end)):
+            if self.compressed[frame_number] is None:
+                frames[i] = 0
+            else:
+                frames[i] = self._decompress(frame_number)
+        return frames, np.array(self.ffc_affected[start:end], dtype=np.bool_)
+
+    def close(self):
+        pass
+
+    def open(self, mode="a"):
+        pass
+
+    def delete(self):
+        self.compressed = []
+        self.ffc_affected = []
+        self.window.clear()
@@ -995,6 +995,36 @@ class Model:
         )
         return pred[0], novelty[0], state
 
+    def classify_sequences_with_novelty(self, sequences, state_decay=1.0):
+        """
+        Classify every frame of several sequences with novelty output.  The sequences are run together as a batch
+        one frame at a time, so there is one session run for each frame of the longest sequence rather than for
+        every frame.  Results are the same as calling classify_frame_with_novelty on the frames of each sequence
+        in turn, multiplying the state by state_decay after each frame.
+        :param sequences: list of numpy arrays of dims [F, C, H, W], sequences may be different lengths
+        :param state_decay: (optional) the state is multiplied by this after each frame
+        :return: list of tuples (predictions, novelties, states) for each sequence.  These have a row for each frame
+            of prediction scores for each class, novelty and the state after the frame
+        """
+        lengths = np.int32([len(sequence) for sequence in sequences])
+        outputs = [([], [], []) for _ in sequences]
+        state_shape = self.state_in.shape.as_list()[1:]
+        states = np.zeros([len(sequences)] + state_shape, dtype=np.float32)
+        for step in range(lengths.max(initial=0)):
+            active = np.flatnonzero(lengths > step)
+            batch_X = np.stack([sequences[i][step] for i in active])[:, np.newaxis]
+            feed_dict = self.get_feed_dict(batch_X, state_in=states[active])
+            pred, novelty, state = self.session.run(
+                [self.prediction, self.novelty, self.state_out], feed_dict=feed_dict
+            )
+            state *= state_decay
+            states[active] = state
+            for row, i in enumerate(active):
+                outputs[i][0].append(pred[row])
+                outputs[i][1].append(novelty[row])
+                outputs[i][2].append(state[row])
+        return [tuple(np.asarray(values) for values in output) for output in outputs]
+
     def create_summaries(self, name, var):
         """
         Creates TensorFlow summaries for given tensor
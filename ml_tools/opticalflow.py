@@ -0,0 +1,71 @@
+"""
+Optical flow backends.  Each backend creates an openCV dense optical flow object, whose
+calc(prev, next, flow) method takes two uint8 frames and returns a float32 [H, W, 2] array of pixel displacements.
+"""
+
+import cv2
+
+TVL1 = "tvl1"
+FARNEBACK = "farneback"
+DIS_ULTRAFAST = "dis-ultrafast"
+DIS_FAST = "dis-fast"
+DIS_MEDIUM = "dis-medium"
+
+
+def create_tvl1(high_quality=False):
+    if hasattr(cv2, "createOptFlow_DualTVL1"):
+        opt_flow = cv2.createOptFlow_DualTVL1()
+    else:
+        # newer versions of opencv-contrib moved TV-L1 into the optflow module
+        opt_flow = cv2.optflow.DualTVL1OpticalFlow_create()
+    opt_flow.setUseInitialFlow(True)
+    if not high_quality:
+        # see https://stackoverflow.com/questions/19309567/speeding-up-optical-flow-createoptflow-dualtvl1
+        opt_flow.setTau(1 / 4)
+        opt_flow.setScalesNumber(3)
+        opt_flow.setWarpingsNumber(3)
+        opt_flow.setScaleStep(0.5)
+    return opt_flow
+
+
+def create_farneback(high_quality=False):
+    if high_quality:
+        return cv2.FarnebackOpticalFlow_create(
+            numLevels=5, pyrScale=0.5, winSize=15, numIters=5, polyN=7, polySigma=1.5
+        )
+    return cv2.FarnebackOpticalFlow_create(
+        numLevels=3, pyrScale=0.5, winSize=15, numIters=3, polyN=5, polySigma=1.2
+    )
+
+
+def dis_backend(preset):
+    def create_dis(high_quality=False):
+        # quality is set by the preset
+        return cv2.DISOpticalFlow_create(preset)
+
+    return create_dis
+
+
+BACKENDS = {
+    TVL1: create_tvl1,
+    FARNEBACK: create_farneback,
+    DIS_ULTRAFAST: dis_backend(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST),
+    DIS_FAST: dis_backend(cv2.DISOPTICAL_FLOW_PRESET_FAST),
+    DIS_MEDIUM: dis_backend(cv2.DISOPTICAL_FLOW_PRESET_MEDIUM),
+}
+
+
+def create_optical_flow(backend=TVL1, high_quality=False):
+    """
+    Creates an optical flow algorithm
+    :param backend: name of backend in BACKENDS
+    :param high_quality: use slower but more accurate settings where the backend supports it
+    """
+    create = BACKENDS.get(backend)
+    if create is None:
+        raise ValueError(
+            "Unknown optical flow backend {}, expected one of {}".format(
+                backend, list(BACKENDS.keys())
+            )
+        )
+    return create(high_quality)
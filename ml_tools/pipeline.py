@@ -0,0 +1,125 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from ml_tools.profiler import Profiler
+
+
+class Stage:
+    """ A step of a Pipeline, function is called with each item and returns the item for the next stage """
+
+    def __init__(self, name, function, workers=1):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """
+    Runs items through stages in order.  Every stage has its own worker threads and a bounded queue in front of
+    it, so while one item is in a later stage the next can be in an earlier one, and a slow stage holds back the
+    stages before it rather than letting items pile up in memory.  Numpy, OpenCV and TensorFlow release the GIL
+    for most of their work so stages overlap on multiple cores.
+
+    If a stage raises an exception or returns None the item is dropped.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        """
+        :param stages: list of Stage
+        :param queue_size: items which can wait for each stage
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        # time each stage spent working
+        self.profiler = Profiler(True)
+        self.seconds = 0
+
+    def run(self, items):
+        """ Runs items through the pipeline, returning once every item has been through every stage """
+        start = time.perf_counter()
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        queues.append(None)
+        stage_threads = []
+        for i, stage in enumerate(self.stages):
+            threads = [
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], queues[i + 1]),
+                    name="{}-{}".format(stage.name, worker),
+                    daemon=True,
+                )
+                for worker in range(stage.workers)
+            ]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        for item in items:
+            queues[0].put(item)
+        # each worker stops on a None, once all workers of a stage have stopped the next stage can be stopped
+        for stage_queue, threads in zip(queues, stage_threads):
+            for _ in threads:
+                stage_queue.put(None)
+            for thread in threads:
+                thread.join()
+        self.seconds += time.perf_counter() - start
+
+    def _work(self, stage, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is None:
+                return
+            start = time.perf_counter()
+            try:
+                item = stage.function(item)
+            except Exception:
+                logging.exception("Error in pipeline stage %s", stage.name)
+                item = None
+            self.profiler.add(stage.name, time.perf_counter() - start)
+            if item is not None and out_queue is not None:
+                out_queue.put(item)
+
+    def utilisation(self):
+        """ Returns a dictionary of stage name to the fraction of the time its workers were busy """
+        return {
+            stage.name: self.profiler.seconds.get(stage.name, 0)
+            / max(self.seconds * stage.workers, 1e-9)
+            for stage in self.stages
+        }
+
+    def summary(self):
+        """ Returns a line for each stage """
+        utilisation = self.utilisation()
+        lines = []
+        for stage in self.stages:
+            lines.append(
+                "{:<12} {:3} workers {:6} items {:10.3f}s busy {:6.1f}% utilisation".format(
+                    stage.name,
+                    stage.workers,
+                    self.profiler.calls.get(stage.name, 0),
+                    self.profiler.seconds.get(stage.name, 0),
+                    utilisation[stage.name] * 100,
+                )
+            )
+        return "\n".join(lines)
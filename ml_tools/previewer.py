@@ -119,11 +119,12 @@ class Previewer:
             self.create_track_descriptions(clip, predictions)
 
         if clip.stats.min_temp is None or clip.stats.max_temp is None:
-            thermals = [frame.thermal for frame in clip.frame_buffer.frames]
+            thermals = [frame.thermal for frame in clip.frame_buffer]
             clip.stats.min_temp = np.amin(thermals)
             clip.stats.max_temp = np.amax(thermals)
         mpeg = MPEGCreator(filename)
-        for frame_number, frame in enumerate(clip.frame_buffer):
+        for frame in clip.frame_buffer:
+            frame_number = frame.frame_number
             if self.preview_type == self.PREVIEW_RAW:
                 image = self.convert_and_resize(
                     frame.thermal, clip.stats.min_temp, clip.stats.max_temp
@@ -182,8 +183,10 @@ class Previewer:
 
         for id, track in enumerate(clip.tracks):
             video_frames = []
-            for region in track.bounds_history:
-                frame = clip.frame_buffer.get_frame(region.frame_number)
+            frames = clip.frame_buffer.iter_frames(
+                track.bounds["frame_number"].tolist()
+            )
+            for region, frame in zip(track.bounds_history, frames):
                 frame = track.crop_by_region(frame, region)
                 img = tools.convert_heat_to_img(
                     frame[TrackChannels.thermal], self.colourmap, 0, 350
@@ -381,7 +384,7 @@ class Previewer:
 
         # look for any tracks that occur on this frame
         for index, track in enumerate(tracks):
-            region = track.bounds_history[-1]
+            region = track.last_bound
             draw.rectangle(
                 self.rect_points(region, v_offset),
                 outline=colours[index % len(colours)],
@@ -410,7 +413,7 @@ class Previewer:
 
         thermal = frame.thermal
         filtered = frame.filtered + min_temp
-        mask = frame.mask * 10000
+        mask = np.float32(frame.mask) * 10000
         flow_h, flow_v = frame.get_flow_split(clip_flow=True)
         if flow_h is None and flow_v is None:
             flow_magnitude = filtered
@@ -0,0 +1,109 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import threading
+import time
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    """
+    Cumulative time and call count of named stages.  When disabled timer returns a shared no-op context manager
+    so it is cheap enough to leave in place.
+
+    with profiler.timer("filter"):
+        ...
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.seconds = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name)
+
+    def add(self, name, seconds, calls=1):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + calls
+
+    def merge(self, other):
+        """
+        Adds the times of other to this profiler
+        :param other: a Profiler or a dictionary from Profiler.as_dict
+        """
+        if isinstance(other, Profiler):
+            other = other.as_dict()
+        for name, stage in other.items():
+            self.add(name, stage["seconds"], stage["calls"])
+
+    def as_dict(self):
+        return {
+            name: {"seconds": seconds, "calls": self.calls[name]}
+            for name, seconds in self.seconds.items()
+        }
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.as_dict(), f, indent=4)
+
+    def summary(self):
+        """ Returns a line for each stage, slowest first """
+        lines = []
+        for name, seconds in sorted(
+            self.seconds.items(), key=lambda item: item[1], reverse=True
+        ):
+            calls = self.calls[name]
+            lines.append(
+                "{:<20} {:10.3f}s {:8} calls {:10.3f}ms per call".format(
+                    name, seconds, calls, seconds * 1000 / calls
+                )
+            )
+        return "\n".join(lines)
@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+import pytest
+
+from ml_tools import opticalflow
+from ml_tools.framecache import (
+    FrameCache,
+    CompressedFrameCache,
+    WriteBehindFrameCache,
+    cache_array,
+)
+from ml_tools.tools import get_clipped_flow
+from track.framebuffer import Frame, FrameBuffer
+
+
+def random_frame(frame_number, height=12, width=16):
+    rng = np.random.RandomState(frame_number)
+    return Frame(
+        rng.randint(2000, 4000, (height, width)).astype(np.float32),
+        rng.randint(0, 100, (height, width)).astype(np.float32),
+        rng.randint(0, 3, (height, width)).astype(np.uint16),
+        frame_number,
+        flow=rng.uniform(-1, 1, (height, width, 2)).astype(np.float32),
+        ffc_affected=frame_number % 3 == 0,
+    )
+
+
+class TestFrameCache:
+    def test_frames(self, tmp_path):
+        num_frames = FrameCache.GROW_FRAMES + 5
+        cache = FrameCache(os.path.join(tmp_path, "clip.cptv"))
+        frames = [random_frame(frame_number) for frame_number in range(num_frames)]
+        for frame in frames:
+            cache.add_frame(frame)
+        cache.close()
+
+        cached, ffc_affected = cache.get_frames(3, num_frames + 10)
+        assert cache.num_frames == num_frames
+        assert cached.shape == (num_frames - 3, 5, 12, 16)
+        for frame, cached_frame, cached_ffc in zip(frames[3:], cached, ffc_affected):
+            assert np.array_equal(cached_frame[0], np.float16(frame.thermal))
+            assert np.array_equal(cached_frame[4], np.float16(frame.mask))
+            assert cached_ffc == frame.ffc_affected
+        assert cache.get_frame(num_frames) == (None, False)
+        cache.delete()
+
+    def test_write_behind(self, tmp_path):
+        num_frames = FrameCache.GROW_FRAMES + 5
+        cache = WriteBehindFrameCache(os.path.join(tmp_path, "clip.cptv"))
+        frames = [random_frame(frame_number) for frame_number in range(num_frames)]
+        for frame in frames:
+            cache.add_frame(frame)
+            # frames can be read whether or not they have been written yet
+            cached_frame, cached_ffc = cache.get_frame(frame.frame_number)
+            assert np.array_equal(cached_frame, cache_array(frame))
+            assert cached_ffc == frame.ffc_affected
+
+        cached, _ = cache.get_frames(0, num_frames)
+        cache.close()
+        assert len(cache.pending) == 0
+        written, ffc_affected = cache.get_frames(0, num_frames)
+        assert np.array_equal(cached, written)
+        for frame, cached_frame, cached_ffc in zip(frames, written, ffc_affected):
+            assert np.array_equal(cached_frame, cache_array(frame))
+            assert cached_ffc == frame.ffc_affected
+        cache.delete()
+
+    def test_write_error(self, tmp_path):
+        cache = WriteBehindFrameCache(os.path.join(tmp_path, "clip.cptv"))
+        cache.add_frame(random_frame(0))
+        cache.flush()
+        # a frame of another size can't be written to the datasets
+        cache.add_frame(random_frame(1, height=10))
+        with pytest.raises(Exception):
+            cache.close()
+        assert cache.writer is None
+        assert cache.db is None
+        cache.delete()
+
+    def test_compressed(self):
+        cache = CompressedFrameCache()
+        frames = [random_frame(frame_number) for frame_number in range(40)]
+        for frame in frames:
+            cache.add_frame(frame)
+        assert cache.nbytes < sum(cache_array(frame).nbytes for frame in frames)
+
+        cached, ffc_affected = cache.get_frames(0, 50)
+        assert len(cached) == len(frames)
+        for frame, cached_frame, cached_ffc in zip(frames, cached, ffc_affected):
+            assert np.array_equal(cached_frame, cache_array(frame))
+            assert cached_ffc == frame.ffc_affected
+        assert len(cache.window) == CompressedFrameCache.WINDOW_FRAMES
+        assert cache.get_frame(len(frames)) == (None, False)
+
+    def test_frame_buffer(self, tmp_path):
+        frame_buffer = FrameBuffer(
+            os.path.join(tmp_path, "clip.cptv"),
+            False,
+            True,
+            False,
+            True,
+            flow_backend=opticalflow.FARNEBACK,
+        )
+        frames = [random_frame(frame_number) for frame_number in range(40)]
+        for frame in frames:
+            frame_buffer.cache.add_frame(frame)
+
+        assert [frame.frame_number for frame in frame_buffer] == list(range(40))
+        frame_numbers = [2, 2, 5, 38, 39, 40]
+        read = list(frame_buffer.iter_frames(frame_numbers))
+        assert read[-1] is None
+        for frame_number, frame in zip(frame_numbers, read[:-1]):
+            expected = frame_buffer.get_frame(frame_number)
+            assert frame.frame_number == frame_number
+            assert frame.ffc_affected == frames[frame_number].ffc_affected
+            assert np.array_equal(frame.filtered, expected.filtered)
+            assert np.array_equal(frame.flow, expected.flow)
+        frame_buffer.remove_cache()
+
+    def test_spill(self, tmp_path):
+        frames = [random_frame(frame_number) for frame_number in range(40)]
+        disk_cache = FrameCache(os.path.join(tmp_path, "clip.cptv"))
+        disk_cache.add_frame(frames[0])
+        disk_cache.close()
+        frame_buffers = []
+        for memory_budget in [None, 10 * 4000]:
+            frame_buffer = FrameBuffer(
+                os.path.join(tmp_path, "clip.cptv"),
+                False,
+                False,
+                True,
+                True,
+                deferred_flow=True,
+                flow_workers=1,
+                flow_backend=opticalflow.FARNEBACK,
+                memory_budget=memory_budget,
+            )
+            for frame in frames:
+                frame_buffer.add_frame(
+                    frame.thermal,
+                    frame.filtered,
+                    frame.mask,
+                    frame.frame_number,
+                    ffc_affected=frame.ffc_affected,
+                )
+            frame_buffers.append(frame_buffer)
+        expected_buffer, frame_buffer = frame_buffers
+
+        stats = frame_buffer.spill_stats()
+        assert stats["resident_bytes"] <= 10 * 4000
+        assert stats["spilled_frames"] == frame_buffer.oldest_resident > 0
+        assert len(frame_buffer) == len(frames)
+        assert frame_buffer.get_last_filtered() is frame_buffer.frames[-1].filtered
+
+        frame_buffer.calculate_flow(range(len(frames)))
+        for frame, expected in zip(frame_buffer, expected_buffer):
+            assert frame.frame_number == expected.frame_number
+            assert frame.ffc_affected == expected.ffc_affected
+            if frame.frame_number < stats["spilled_frames"]:
+                # spilled frames are stored like the disk cache
+                assert np.array_equal(frame.thermal, np.float16(expected.thermal))
+                assert np.array_equal(
+                    frame.flow, np.float16(get_clipped_flow(expected.flow))
+                )
+            else:
+                assert frame is frame_buffer.frames[frame.frame_number]
+                assert np.array_equal(frame.flow, expected.flow)
+        # spilled frames don't use the disk cache file of the clip, which is kept
+        spill_filename = frame_buffer.spill_cache.filename
+        assert spill_filename != disk_cache.filename
+        frame_buffer.remove_spill_cache()
+        assert not os.path.exists(spill_filename)
+        assert np.array_equal(disk_cache.get_frame(0)[0], cache_array(frames[0]))
+        disk_cache.delete()
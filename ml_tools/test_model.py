@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from ml_tools.model import Model
+
+STATE_SHAPE = [3, 2]
+
+
+class Shape:
+    def __init__(self, shape):
+        self.shape = shape
+
+    def as_list(self):
+        return list(self.shape)
+
+
+class Tensor:
+    def __init__(self, name, shape=None):
+        self.name = name
+        self.shape = Shape(shape)
+
+
+class StubSession:
+    """ A small recurrent model, the new state depends on the old state and the frame """
+
+    def __init__(self, model):
+        self.model = model
+        self.batch_sizes = []
+
+    def run(self, fetches, feed_dict):
+        model = self.model
+        X = feed_dict[model.X]
+        state = feed_dict.get(model.state_in)
+        if state is None:
+            state = np.zeros([len(X)] + STATE_SHAPE, dtype=np.float32)
+        self.batch_sizes.append(len(X))
+        frame_means = X.reshape(len(X), -1).mean(axis=1)
+        new_state = np.tanh(0.5 * state + frame_means[:, np.newaxis, np.newaxis])
+        new_state[:, 0] += 0.1
+        pred = np.stack([new_state.sum(axis=(1, 2)), frame_means], axis=1)
+        novelty = np.abs(state).mean(axis=(1, 2))
+        outputs = {
+            model.prediction: pred,
+            model.novelty: novelty,
+            model.state_out: np.float32(new_state),
+        }
+        return [outputs[fetch] for fetch in fetches]
+
+
+def stub_model():
+    model = Model.__new__(Model)
+    model.X = Tensor("X")
+    model.state_in = Tensor("state_in", [None] + STATE_SHAPE)
+    model.keep_prob = Tensor("keep_prob")
+    model.is_training = Tensor("is_training")
+    model.global_step = Tensor("global_step")
+    model.prediction = Tensor("prediction")
+    model.novelty = Tensor("novelty")
+    model.state_out = Tensor("state_out")
+    model.step = 0
+    model.training_segment_frames = 27
+    model.params = {"keep_prob": 0.5}
+    model.session = StubSession(model)
+    return model
+
+
+def reference_classify(model, sequence, state_decay):
+    """ Classifies the frames of sequence one at a time with classify_frame_with_novelty """
+    state = np.zeros([1] + STATE_SHAPE, dtype=np.float32)
+    outputs = ([], [], [])
+    for frame in sequence:
+        pred, novelty, state = model.classify_frame_with_novelty(frame, state)
+        state = state * state_decay
+        outputs[0].append(pred)
+        outputs[1].append(novelty)
+        outputs[2].append(state[0])
+    return outputs
+
+
+class TestModel:
+    @pytest.mark.parametrize("state_decay", [1.0, 0.98])
+    def test_classify_sequences_with_novelty(self, state_decay):
+        model = stub_model()
+        rng = np.random.RandomState(0)
+        lengths = [4, 0, 1, 7, 3]
+        sequences = [
+            rng.uniform(-1, 1, (length, 5, 4, 4)).astype(np.float32)
+            for length in lengths
+        ]
+        results = model.classify_sequences_with_novelty(sequences, state_decay)
+
+        # finished sequences are dropped from the batch
+        assert model.session.batch_sizes == [4, 3, 3, 2, 1, 1, 1]
+        assert len(results) == len(sequences)
+        for sequence, result in zip(sequences, results):
+            assert [len(values) for values in result] == [len(sequence)] * 3
+            expected = reference_classify(model, sequence, state_decay)
+            for values, expected_values in zip(result, expected):
+                if len(sequence) > 0:
+                    assert np.allclose(values, np.asarray(expected_values), atol=1e-6)
+
+        assert model.classify_sequences_with_novelty([]) == []
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from ml_tools import opticalflow
+
+
+class TestOpticalFlow:
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            opticalflow.create_optical_flow("unknown")
+
+    @pytest.mark.parametrize(
+        "backend", [opticalflow.FARNEBACK, opticalflow.DIS_FAST, opticalflow.DIS_MEDIUM]
+    )
+    def test_detects_movement(self, backend):
+        y, x = np.mgrid[0:120, 0:160]
+        prev = np.uint8(200 * np.exp(-((x - 80) ** 2 + (y - 60) ** 2) / 100.0))
+        current = np.roll(prev, 2, axis=1)
+        flow = np.zeros((120, 160, 2), dtype=np.float32)
+        flow = opticalflow.create_optical_flow(backend).calc(prev, current, flow)
+        assert flow.shape == (120, 160, 2)
+        # horizontal movement of 2 pixels near the centre of the blob
+        assert abs(np.median(flow[55:65, 75:85, 0]) - 2) < 0.5
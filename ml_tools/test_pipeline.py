@@ -0,0 +1,39 @@
+import threading
+
+from ml_tools.pipeline import Pipeline, Stage
+
+
+class TestPipeline:
+    def test_run(self):
+        outputs = []
+        lock = threading.Lock()
+
+        def fail_on_three(item):
+            if item == 3:
+                raise ValueError("three")
+            return item
+
+        def output(item):
+            with lock:
+                outputs.append(item)
+            return item
+
+        pipeline = Pipeline(
+            [
+                Stage("double", lambda item: item * 2, 2),
+                Stage("fail", fail_on_three),
+                Stage("drop_odd", lambda item: item if item % 4 else None, 3),
+                Stage("output", output),
+            ],
+            queue_size=1,
+        )
+        pipeline.run(range(10))
+        assert sorted(outputs) == [2, 6, 10, 14, 18]
+
+        utilisation = pipeline.utilisation()
+        assert list(utilisation) == ["double", "fail", "drop_odd", "output"]
+        assert all(0 <= value <= 1 for value in utilisation.values())
+        assert pipeline.profiler.calls["double"] == 10
+        assert pipeline.profiler.calls["drop_odd"] == 10
+        assert pipeline.profiler.calls["output"] == 5
+        assert len(pipeline.summary().splitlines()) == 4
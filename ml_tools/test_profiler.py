@@ -0,0 +1,23 @@
+from ml_tools.profiler import Profiler
+
+
+class TestProfiler:
+    def test_disabled(self):
+        profiler = Profiler()
+        with profiler.timer("stage"):
+            pass
+        assert profiler.as_dict() == {}
+
+    def test_merge(self):
+        profiler = Profiler(True)
+        for _ in range(3):
+            with profiler.timer("stage"):
+                pass
+        profiler.add("other", 2.0)
+
+        total = Profiler(True)
+        total.merge(profiler)
+        total.merge(profiler.as_dict())
+        stages = total.as_dict()
+        assert stages["stage"]["calls"] == 6
+        assert stages["other"] == {"seconds": 4.0, "calls": 2}
@@ -1,6 +1,6 @@
 import numpy as np
 
-from ml_tools.tools import Rectangle
+from ml_tools.tools import Rectangle, merge_overlapping_bounds
 
 
 class TestRectangle:
@@ -21,6 +21,13 @@ class TestRectangle:
         subimage = rectangle.subimage(image)
         assert np.array_equal(subimage, [[32, 33], [42, 43], [52, 53]])
 
+    def test_merge_overlapping_bounds(self):
+        bounds = [[0, 0, 10, 10], [20, 0, 30, 10], [9, 9, 21, 12], [50, 50, 60, 60]]
+        merged = merge_overlapping_bounds(bounds)
+        assert merged == [[0, 0, 30, 12], [50, 50, 60, 60]]
+        # touching rectangles don't overlap
+        assert len(merge_overlapping_bounds([[0, 0, 10, 10], [10, 0, 20, 10]])) == 2
+
 
 def assert_rectangle_values(rect):
     assert rect.left == 2
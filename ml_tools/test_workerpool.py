@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from ml_tools.workerpool import WorkerPool
+
+_offset = 0
+
+
+def set_offset(offset):
+    global _offset
+    _offset = offset
+
+
+def add_offset(value):
+    if value == 3:
+        raise ValueError("three")
+    if value == 5:
+        # a worker dying only loses its job
+        os._exit(1)
+    return value + _offset
+
+
+def double(value):
+    return value * 2
+
+
+def fail_once(marker, crash):
+    # only the first worker fails to start
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        if crash:
+            os._exit(1)
+        raise ValueError("first worker")
+
+
+def fail_start(crash):
+    if crash:
+        os._exit(1)
+    raise ValueError("broken initializer")
+
+
+class TestWorkerPool:
+    def test_imap_unordered(self):
+        pool = WorkerPool(2, set_offset, (100,), max_jobs=2)
+        pool.POLL_SECONDS = 0.1
+        results = list(pool.imap_unordered(add_offset, range(10)))
+        completed = sorted(result for result in results if result is not None)
+        assert completed == [100, 101, 102, 104, 106, 107, 108, 109]
+        assert results.count(None) == 1
+        # workers are replaced after two jobs, or when they die
+        assert pool.started >= 5
+
+    def test_retire_while_polling(self):
+        # workers retiring between polls must not be taken for dead workers
+        for _ in range(5):
+            pool = WorkerPool(4, max_jobs=1)
+            pool.POLL_SECONDS = 0.0005
+            results = list(pool.imap_unordered(double, range(40)))
+            assert sorted(results) == [value * 2 for value in range(40)]
+            assert pool.started == 40
+
+    @pytest.mark.parametrize("crash", [False, True])
+    def test_failed_start(self, tmp_path, crash):
+        # the job of a worker which failed to start is given to the next one
+        pool = WorkerPool(1, fail_once, (os.path.join(tmp_path, "marker"), crash))
+        pool.POLL_SECONDS = 0.1
+        results = list(pool.imap_unordered(double, range(4)))
+        assert sorted(results) == [0, 2, 4, 6]
+        assert pool.started == 2
+
+        # workers which never start stop the pool rather than using up the jobs
+        pool = WorkerPool(2, fail_start, (crash,))
+        pool.POLL_SECONDS = 0.1
+        with pytest.raises(Exception, match="failed to start"):
+            list(pool.imap_unordered(double, range(20)))
+        assert pool.started <= WorkerPool.MAX_START_FAILURES + 1
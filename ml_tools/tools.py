@@ -19,6 +19,7 @@ import glob
 import cv2
 import timezonefinder
 from matplotlib.colors import LinearSegmentedColormap
+from ml_tools import opticalflow
 import subprocess
 from PIL import ImageFont
 from PIL import ImageDraw
@@ -727,16 +728,8 @@ def blur_and_return_as_mask(frame, threshold):
     return thresh, mass
 
 
-def get_optical_flow_function(high_quality=False):
-    opt_flow = cv2.createOptFlow_DualTVL1()
-    opt_flow.setUseInitialFlow(True)
-    if not high_quality:
-        # see https://stackoverflow.com/questions/19309567/speeding-up-optical-flow-createoptflow-dualtvl1
-        opt_flow.setTau(1 / 4)
-        opt_flow.setScalesNumber(3)
-        opt_flow.setWarpingsNumber(3)
-        opt_flow.setScaleStep(0.5)
-    return opt_flow
+def get_optical_flow_function(high_quality=False, backend=opticalflow.TVL1):
+    return opticalflow.create_optical_flow(backend, high_quality)
 
 
 def frame_to_jpg(
@@ -786,6 +779,49 @@ def eucl_distance(first, second):
     # return ((first[0] - second[0]) ** 2 + (first[1] - second[1]) ** 2) ** 0.5
 
 
+def overlap_areas(bounds, other_bounds):
+    """
+    Computes the area of overlap between rectangles, vectorised version of Rectangle.overlap_area.
+    :param bounds: array of shape [..., 4] of left, top, right, bottom values
+    :param other_bounds: array of shape [..., 4] broadcastable with bounds
+    :return: array of overlap areas
+    """
+    x_overlap = np.minimum(bounds[..., 2], other_bounds[..., 2]) - np.maximum(
+        bounds[..., 0], other_bounds[..., 0]
+    )
+    y_overlap = np.minimum(bounds[..., 3], other_bounds[..., 3]) - np.maximum(
+        bounds[..., 1], other_bounds[..., 1]
+    )
+    return np.clip(x_overlap, 0, None) * np.clip(y_overlap, 0, None)
+
+
+def merge_overlapping_bounds(bounds):
+    """
+    Merges rectangles which overlap into the rectangle covering both, until no rectangles overlap
+    :param bounds: list of left, top, right, bottom values
+    :return: list of merged left, top, right, bottom values
+    """
+    merged = [list(bound) for bound in bounds]
+    i = 0
+    while i < len(merged):
+        bound = merged[i]
+        for j in range(i + 1, len(merged)):
+            other = merged[j]
+            if overlap_areas(np.array(bound), np.array(other)) > 0:
+                merged[i] = [
+                    min(bound[0], other[0]),
+                    min(bound[1], other[1]),
+                    max(bound[2], other[2]),
+                    max(bound[3], other[3]),
+                ]
+                del merged[j]
+                # the larger rectangle may now overlap earlier ones
+                i = -1
+                break
+        i += 1
+    return merged
+
+
 def get_clipped_flow(flow):
     return np.clip(flow * 256, -16000, 16000)
 
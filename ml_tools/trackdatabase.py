@@ -284,15 +284,8 @@ class TrackDatabase:
                 for name, value in track_stats._asdict().items():
                     node_attrs[name] = value
                 # frame history
-                node_attrs["mass_history"] = np.int32(
-                    [bounds.mass for bounds in track.bounds_history]
-                )
-                node_attrs["bounds_history"] = np.int16(
-                    [
-                        [bounds.left, bounds.top, bounds.right, bounds.bottom]
-                        for bounds in track.bounds_history
-                    ]
-                )
+                node_attrs["mass_history"] = np.int32(track.bounds["mass"])
+                node_attrs["bounds_history"] = np.int16(track.get_bounds_array())
 
             f.flush()
 
@@ -0,0 +1,213 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+import logging
+import multiprocessing
+import os
+import queue
+
+import psutil
+
+
+def rss_mb():
+    """ Resident memory of this process in MB """
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def _worker(function, initializer, initargs, jobs, results, max_jobs, max_rss_mb):
+    pid = os.getpid()
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except Exception:
+            logging.exception("Error starting worker %s", pid)
+            results.put((pid, None, False, True))
+            return
+    # a job index of None reports whether the worker started
+    results.put((pid, None, True, False))
+    completed = 0
+    while True:
+        job = jobs.recv()
+        if job is None:
+            return
+        index, args = job
+        try:
+            result = function(args)
+        except Exception:
+            logging.exception("Error processing job %s", index)
+            result = None
+        completed += 1
+        retire = (max_jobs and completed >= max_jobs) or (
+            max_rss_mb and rss_mb() > max_rss_mb
+        )
+        results.put((pid, index, result, bool(retire)))
+        if retire:
+            return
+
+
+class WorkerPool:
+    """
+    A pool of worker processes which each run initializer once when they start, so expensive state such as a
+    loaded model is kept for every job the worker processes.  Workers are replaced with new ones after max_jobs
+    jobs or once they use more than max_rss_mb of memory, to contain memory leaks, and if they die.
+
+    Unlike multiprocessing.Pool, workers can be recycled on memory use and a worker dying doesn't hang the pool.
+    Each worker is sent one job at a time, so the pool always knows which job a worker is processing.  Jobs of
+    workers which fail in initializer are processed by the next worker, but the pool stops once
+    MAX_START_FAILURES workers in a row fail to start, as initializer is probably broken.
+    """
+
+    # seconds between checking for workers which have died
+    POLL_SECONDS = 1
+    # workers in a row which can fail to start before the pool stops
+    MAX_START_FAILURES = 3
+
+    def __init__(
+        self, workers, initializer=None, initargs=(), max_jobs=None, max_rss_mb=None
+    ):
+        self.workers = max(1, workers)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.context = multiprocessing.get_context()
+        # number of workers started, including replacements
+        self.started = 0
+
+    def imap_unordered(self, function, jobs):
+        """
+        Runs function on each of jobs in the workers, yielding the results as they complete.
+        :param function: a picklable function of one argument
+        :param jobs: picklable arguments to function
+        :return: generator of the results of jobs, None for jobs which raised an exception.  Jobs whose worker
+            died have no result.
+        """
+        pending = deque(enumerate(jobs))
+        results = self.context.Queue()
+        # pid to process and connection to send it jobs
+        workers = {}
+        # pid to the job the worker is processing
+        assigned = {}
+        # pids of workers which have finished initializer
+        ready = set()
+        start_failures = 0
+
+        def remove_worker(pid):
+            workers.pop(pid)[0].join()
+            ready.discard(pid)
+
+        def assign(pid):
+            connection = workers[pid][1]
+            if pending:
+                job = pending.popleft()
+                connection.send(job)
+                assigned[pid] = job
+            else:
+                connection.send(None)
+                remove_worker(pid)
+
+        def failed_start(pid):
+            nonlocal start_failures
+            remove_worker(pid)
+            # the job was never started, so is given to the next worker
+            pending.appendleft(assigned.pop(pid))
+            start_failures += 1
+            if start_failures >= self.MAX_START_FAILURES:
+                raise Exception(
+                    "{} workers in a row failed to start".format(start_failures)
+                )
+            start_worker()
+
+        def start_worker():
+            receive, send = self.context.Pipe(duplex=False)
+            process = self.context.Process(
+                target=_worker,
+                args=(
+                    function,
+                    self.initializer,
+                    self.initargs,
+                    receive,
+                    results,
+                    self.max_jobs,
+                    self.max_rss_mb,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.started += 1
+            workers[process.pid] = (process, send)
+            assign(process.pid)
+
+        try:
+            while pending and len(workers) < self.workers:
+                start_worker()
+            while assigned:
+                dead = []
+                try:
+                    messages = [results.get(timeout=self.POLL_SECONDS)]
+                except queue.Empty:
+                    # a worker which has exited may have put its result just after the timeout, so its results
+                    # are read before deciding it died processing a job
+                    dead = [
+                        pid
+                        for pid, (process, _) in workers.items()
+                        if not process.is_alive()
+                    ]
+                    messages = []
+                    while True:
+                        try:
+                            messages.append(results.get_nowait())
+                        except queue.Empty:
+                            break
+                for pid, index, result, retired in messages:
+                    if index is None:
+                        if result:
+                            ready.add(pid)
+                            start_failures = 0
+                        else:
+                            failed_start(pid)
+                        continue
+                    del assigned[pid]
+                    if retired:
+                        remove_worker(pid)
+                        if pending:
+                            start_worker()
+                    else:
+                        assign(pid)
+                    yield result
+                for pid in dead:
+                    if pid not in workers:
+                        continue
+                    if pid not in ready:
+                        failed_start(pid)
+                        continue
+                    remove_worker(pid)
+                    if pid in assigned:
+                        logging.error(
+                            "Worker %s died processing job %s",
+                            pid,
+                            assigned.pop(pid)[0],
+                        )
+                    if pending:
+                        start_worker()
+        except BaseException:
+            for process, _ in workers.values():
+                process.terminate()
+            raise
@@ -87,6 +87,7 @@ class PiClassifier(Processor):
             self.config.classify.cache_to_disk,
             self.config.use_opt_flow,
             True,
+            flow_backend=self.config.classify_tracking.flow_backend,
         )
 
         # process preview_frames
@@ -153,7 +154,7 @@ class PiClassifier(Processor):
             track_prediction = self.predictions.get_or_create_prediction(
                 track, keep_all=False
             )
-            region = track.bounds_history[-1]
+            region = track.last_bound
             if region.frame_number != frame.frame_number:
                 logging.warning(
                     "frame doesn't match last frame {} and {}".format(
@@ -17,12 +17,24 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import threading
+import time
+
 import attr
 import cv2
 import numpy as np
-from ml_tools.framecache import FrameCache
+from ml_tools import opticalflow
+from ml_tools.framecache import (
+    FrameCache,
+    CompressedFrameCache,
+    WriteBehindFrameCache,
+)
+from ml_tools.profiler import Profiler
 from ml_tools.dataset import TrackChannels
-from ml_tools.tools import get_optical_flow_function, get_clipped_flow
+from ml_tools.tools import get_optical_flow_function, get_clipped_flow, Rectangle
 
 
 @attr.s(slots=True)
@@ -36,6 +48,10 @@ class Frame:
     flow_clipped = attr.ib(default=False)
     scaled_thermal = attr.ib(default=None)
     ffc_affected = attr.ib(default=False)
+    flow_regions = attr.ib(default=None)
+    # area of the full frame this frame was cropped to, if it has been
+    crop = attr.ib(default=None)
+    thermal_median = attr.ib(default=None)
 
     @classmethod
     def from_array(
@@ -66,24 +82,71 @@ class Frame:
 
         return [self.thermal, self.filtered, self.flow, self.mask]
 
-    def generate_optical_flow(self, opt_flow, prev_frame, flow_threshold=40):
+    def generate_optical_flow(
+        self, opt_flow, prev_frame, flow_threshold=40, flow_regions=None, threads=2
+    ):
         """
         Generate optical flow from thermal frames
         :param opt_flow: An optical flow algorithm
+        :param flow_regions: (optional) list of left, top, right, bottom bounds to calculate flow in, flow
+            outside of these is left as 0.  If not specified flow is calculated for the whole frame
+        :param threads: number of threads openCV may use
+        """
+        self.scale_thermal(flow_threshold)
+        self.flow_regions = flow_regions
+        self.calculate_flow(opt_flow, prev_frame, threads)
+        if prev_frame:
+            prev_frame.scaled_thermal = None
+
+    def get_thermal_median(self):
+        """ Median of the full thermal frame, which is kept when the frame is cropped """
+        if self.thermal_median is None:
+            return np.median(self.thermal)
+        return self.thermal_median
+
+    def cropped(self, crop):
+        """ Returns a copy of this frame cropped to the rectangle crop """
+        return Frame(
+            crop.subimage(self.thermal).copy(),
+            crop.subimage(self.filtered).copy(),
+            crop.subimage(self.mask).copy(),
+            self.frame_number,
+            flow=None if self.flow is None else crop.subimage(self.flow).copy(),
+            flow_clipped=self.flow_clipped,
+            ffc_affected=self.ffc_affected,
+            crop=crop,
+            thermal_median=self.get_thermal_median(),
+        )
+
+    def scale_thermal(self, flow_threshold=40):
+        """ Calculates the thresholded thermal frame optical flow is calculated from """
+        threshold = np.median(self.thermal) + flow_threshold
+        self.scaled_thermal = np.uint8(np.clip(self.thermal - threshold, 0, 255))
+
+    def calculate_flow(self, opt_flow, prev_frame, threads=2):
+        """
+        Calculates optical flow between the scaled thermal of prev_frame and this frame, within
+        flow_regions if set
         """
         height, width = self.thermal.shape
         flow = np.zeros([height, width, 2], dtype=np.float32)
-        threshold = np.median(self.thermal) + flow_threshold
-        scaled_thermal = np.uint8(np.clip(self.thermal - threshold, 0, 255))
         if prev_frame is not None:
             # for some reason openCV spins up lots of threads for this which really slows things down, so we
-            # cap the threads to 2
-            cv2.setNumThreads(2)
-            flow = opt_flow.calc(prev_frame.scaled_thermal, scaled_thermal, flow)
-        self.scaled_thermal = scaled_thermal
+            # cap the threads
+            cv2.setNumThreads(threads)
+            if self.flow_regions is None:
+                flow = opt_flow.calc(
+                    prev_frame.scaled_thermal, self.scaled_thermal, flow
+                )
+            else:
+                for left, top, right, bottom in self.flow_regions:
+                    window = np.s_[top:bottom, left:right]
+                    flow[window] = opt_flow.calc(
+                        np.ascontiguousarray(prev_frame.scaled_thermal[window]),
+                        np.ascontiguousarray(self.scaled_thermal[window]),
+                        np.zeros((bottom - top, right - left, 2), dtype=np.float32),
+                    )
         self.flow = flow
-        if prev_frame:
-            prev_frame.scaled_thermal = None
 
     def clip_flow(self):
         self.flow = get_clipped_flow(self.flow)
@@ -109,48 +172,281 @@ class Frame:
 
 
 class FrameBuffer:
-    """ Stores entire clip in memory, required for some operations such as track exporting. """
+    """
+    Stores entire clip in memory, required for some operations such as track exporting.
+    Frames are kept as Frame objects, or in a cache which is either on disk with cache_to_disk or compressed in
+    memory with compress_frames.  With write_behind, frames are written to the disk cache on a background thread.
+    If memory_budget is set, Frame objects are kept until they take more than memory_budget bytes, after which
+    the oldest frames are spilled to a disk cache.  Spilled frames are read back by get_frame and iteration.
+    If crop_frames is set, frames kept as Frame objects are cropped to the area around the tracks in them with
+    crop_frame, once the tracks in them are known.  Frames without tracks are dropped.
+    If deferred_flow is set and frames are kept in memory, optical flow is only calculated when it is needed,
+    either when a frame is requested or for many frames at once in parallel with calculate_flow.
+    """
+
+    # frames read from the cache at once when iterating
+    READ_FRAMES = 32
+    # pixels kept around the regions of tracks when frames are cropped
+    CROP_PADDING = 4
 
     def __init__(
-        self, cptv_name, high_quality_flow, cache_to_disk, calc_flow, keep_frames
+        self,
+        cptv_name,
+        high_quality_flow,
+        cache_to_disk,
+        calc_flow,
+        keep_frames,
+        deferred_flow=False,
+        flow_threads=2,
+        flow_workers=0,
+        flow_backend=opticalflow.TVL1,
+        profiler=None,
+        compress_frames=False,
+        memory_budget=None,
+        crop_frames=False,
+        write_behind=False,
     ):
-        self.cache = FrameCache(cptv_name) if cache_to_disk else None
+        if cache_to_disk and write_behind:
+            self.cache = WriteBehindFrameCache(cptv_name)
+        elif cache_to_disk:
+            self.cache = FrameCache(cptv_name)
+        elif compress_frames and keep_frames:
+            self.cache = CompressedFrameCache()
+        else:
+            self.cache = None
         self.opt_flow = None
         self.high_quality_flow = high_quality_flow
+        self.flow_backend = flow_backend
         self.frames = None
         self.prev_frame = None
         self.calc_flow = calc_flow
         self.keep_frames = keep_frames
-        self.current_frame = 0
-        if cache_to_disk or calc_flow:
+        # the cache stores flow as frames are added so can't be deferred
+        self.deferred_flow = deferred_flow and calc_flow and self.retains_frames
+        self.flow_threads = flow_threads
+        self.flow_workers = flow_workers
+        self.thread_flow = threading.local()
+        self.profiler = profiler or Profiler()
+        self.cptv_name = cptv_name
+        self.crop_frames = crop_frames and self.retains_frames
+        # cropped frames are much smaller, and can't be spilled
+        self.memory_budget = (
+            memory_budget if self.retains_frames and not self.crop_frames else None
+        )
+        self.spill_cache = None
+        if self.cache or calc_flow:
             self.set_optical_flow()
         self.reset()
 
     def set_optical_flow(self):
         if self.opt_flow is None:
-            self.opt_flow = get_optical_flow_function(self.high_quality_flow)
-
-    def add_frame(self, thermal, filtered, mask, frame_number, ffc_affected=False):
+            self.opt_flow = get_optical_flow_function(
+                self.high_quality_flow, self.flow_backend
+            )
+
+    def add_frame(
+        self,
+        thermal,
+        filtered,
+        mask,
+        frame_number,
+        ffc_affected=False,
+        flow_regions=None,
+    ):
         frame = Frame(thermal, filtered, mask, frame_number, ffc_affected=ffc_affected)
-        if self.opt_flow:
-            frame.generate_optical_flow(self.opt_flow, self.prev_frame)
+        if self.deferred_flow:
+            frame.scale_thermal()
+            frame.flow_regions = flow_regions
+        elif self.opt_flow:
+            with self.profiler.timer("flow"):
+                frame.generate_optical_flow(
+                    self.opt_flow,
+                    self.prev_frame,
+                    flow_regions=flow_regions,
+                    threads=self.flow_threads,
+                )
         self.prev_frame = frame
         if self.keep_frames:
             if self.cache:
-                self.cache.add_frame(frame)
+                with self.profiler.timer("cache"):
+                    self.cache.add_frame(frame)
             else:
                 self.frames.append(frame)
+                self.resident_bytes += self.frame_bytes(frame)
+                if self.memory_budget:
+                    self._spill()
+
+    def frame_bytes(self, frame):
+        """ Bytes a Frame kept in memory takes, including its optical flow once calculated """
+        size = frame.thermal.nbytes + frame.filtered.nbytes + frame.mask.nbytes
+        if self.calc_flow:
+            size += frame.thermal.size * 2 * np.dtype(np.float32).itemsize
+        return size
+
+    def _spill(self):
+        """ Moves the oldest frames to the spill cache until the kept frames fit in memory_budget """
+        if self.resident_bytes <= self.memory_budget:
+            return
+        start = time.perf_counter()
+        if self.spill_cache is None:
+            # a file of its own, the disk cache of a clip is kept at the cache filename of cptv_name
+            folder, name = os.path.split(self.cptv_name)
+            fd, filename = tempfile.mkstemp(
+                suffix=".cache",
+                prefix=os.path.splitext(name)[0] + "-spill-",
+                dir=folder or None,
+            )
+            os.close(fd)
+            self.spill_cache = FrameCache(filename)
+        # the last frame is always kept, the next frame is compared to it
+        while (
+            self.resident_bytes > self.memory_budget
+            and self.oldest_resident < len(self.frames) - 1
+        ):
+            frame = self.frames[self.oldest_resident]
+            if self.deferred_flow and frame.flow is None:
+                self._calculate_frame_flow(frame)
+            self.spill_cache.add_frame(frame)
+            self.frames[self.oldest_resident] = None
+            # the next frame's flow may still need this frame
+            self.last_evicted = frame
+            self.resident_bytes -= self.frame_bytes(frame)
+            self.spilled_frames += 1
+            self.oldest_resident += 1
+        seconds = time.perf_counter() - start
+        self.spill_seconds += seconds
+        if self.profiler.enabled:
+            self.profiler.add("spill", seconds)
+
+    def crop_frame(self, frame_number, bounds):
+        """
+        Replaces a kept frame with the area around bounds padded by CROP_PADDING, or drops it if there are no
+        bounds.  Deferred flow is calculated first, so the frame shouldn't be cropped until its tracks are known.
+        :param bounds: list of left, top, right, bottom of the regions of tracks in the frame
+        """
+        if not self.crop_frames or frame_number >= len(self.frames):
+            return
+        frame = self.frames[frame_number]
+        if frame is None or frame.crop is not None:
+            return
+        cropped = None
+        if len(bounds) > 0:
+            if self.deferred_flow and frame.flow is None:
+                self._calculate_frame_flow(frame)
+            bounds = np.int32(bounds)
+            height, width = frame.thermal.shape
+            padding = FrameBuffer.CROP_PADDING
+            left, top = np.maximum(bounds[:, :2].min(axis=0) - padding, 0).tolist()
+            right, bottom = np.minimum(
+                bounds[:, 2:].max(axis=0) + padding, (width, height)
+            ).tolist()
+            cropped = frame.cropped(Rectangle.from_ltrb(left, top, right, bottom))
+            self.resident_bytes += self.frame_bytes(cropped)
+        self.frames[frame_number] = cropped
+        self.resident_bytes -= self.frame_bytes(frame)
+        # the next frame's flow may still need this frame
+        self.last_evicted = frame
+
+    def _is_spilled(self, frame_number):
+        return frame_number < self.oldest_resident
+
+    @property
+    def retains_frames(self):
+        """ True if added frames are kept in memory after the next frame is added """
+        return self.keep_frames and self.cache is None
+
+    @property
+    def keeps_frame_arrays(self):
+        """ True if the arrays of added frames may still be used after the next frame is added """
+        return self.retains_frames or isinstance(self.cache, WriteBehindFrameCache)
 
     @property
     def has_flow(self):
         return self.cache or self.opt_flow
 
+    def calculate_flow(self, frame_numbers):
+        """
+        Calculates deferred optical flow for frame_numbers, frame pairs are calculated in parallel as openCV
+        releases the GIL
+        """
+        if not self.deferred_flow:
+            return
+        frames = [
+            self.frames[frame_number]
+            for frame_number in sorted(set(frame_numbers))
+            if frame_number < len(self.frames)
+            and self.frames[frame_number] is not None
+            and self.frames[frame_number].flow is None
+        ]
+        if len(frames) == 0:
+            return
+        with ThreadPoolExecutor(self.flow_workers or os.cpu_count()) as pool:
+            for _ in pool.map(self._calculate_frame_flow, frames):
+                pass
+
+    def _calculate_frame_flow(self, frame):
+        # optical flow algorithms keep state between calls so each thread needs its own
+        opt_flow = getattr(self.thread_flow, "opt_flow", None)
+        if opt_flow is None:
+            opt_flow = get_optical_flow_function(
+                self.high_quality_flow, self.flow_backend
+            )
+            self.thread_flow.opt_flow = opt_flow
+        prev_frame = None
+        if frame.frame_number > 0:
+            prev_frame = self.frames[frame.frame_number - 1]
+            if prev_frame is None or prev_frame.crop is not None:
+                prev_frame = self.last_evicted
+        with self.profiler.timer("flow"):
+            frame.calculate_flow(opt_flow, prev_frame, self.flow_threads)
+
     def get_frame(self, frame_number):
+        frame = self._get_frame(frame_number)
+        if self.deferred_flow and frame is not None and frame.flow is None:
+            self._calculate_frame_flow(frame)
+        return frame
+
+    def iter_frames(self, frame_numbers):
+        """
+        Yields the frame of each of frame_numbers, or None if there isn't one.  Cached and spilled frames are read
+        in blocks of READ_FRAMES, so frame_numbers should be increasing to read each block once.
+        """
+        cache = self.cache or self.spill_cache
+        if not cache:
+            for frame_number in frame_numbers:
+                yield self.get_frame(frame_number)
+            return
+
+        block_start = None
+        for frame_number in frame_numbers:
+            if not self.cache and not self._is_spilled(frame_number):
+                yield self.get_frame(frame_number)
+                continue
+            if block_start is not None:
+                index = frame_number - block_start
+            if block_start is None or index < 0 or index >= FrameBuffer.READ_FRAMES:
+                block_start = frame_number
+                index = 0
+                block, ffc_affected = cache.get_frames(
+                    frame_number, frame_number + FrameBuffer.READ_FRAMES
+                )
+            if index >= len(block):
+                yield None
+            else:
+                yield Frame.from_array(
+                    block[index],
+                    frame_number,
+                    flow_clipped=True,
+                    ffc_affected=bool(ffc_affected[index]),
+                )
+
+    def _get_frame(self, frame_number):
         if self.prev_frame and self.prev_frame.frame_number == frame_number:
             return self.prev_frame
-        elif self.cache:
-            cache_frame, ffc_affected = self.cache.get_frame(frame_number)
-            if cache_frame:
+        elif self.cache or self._is_spilled(frame_number):
+            cache = self.cache or self.spill_cache
+            cache_frame, ffc_affected = cache.get_frame(frame_number)
+            if cache_frame is not None:
                 return Frame.from_array(
                     cache_frame,
                     frame_number,
@@ -165,10 +461,30 @@ class FrameBuffer:
     def close_cache(self):
         if self.cache:
             self.cache.close()
+        if self.spill_cache:
+            self.spill_cache.close()
 
     def remove_cache(self):
+        """ Deletes the disk cache and any spilled frames """
         if self.cache:
             self.cache.delete()
+        self.remove_spill_cache()
+
+    def remove_spill_cache(self):
+        """ Deletes any spilled frames, keeping the disk cache """
+        if self.spill_cache:
+            self.spill_cache.delete()
+
+    def spill_stats(self):
+        """
+        :return: dictionary of resident_bytes of frames kept in memory, spilled_frames and spill_seconds spent
+            spilling them
+        """
+        return {
+            "resident_bytes": self.resident_bytes,
+            "spilled_frames": self.spilled_frames,
+            "spill_seconds": self.spill_seconds,
+        }
 
     def get_last_frame(self):
         return self.prev_frame
@@ -195,19 +511,24 @@ class FrameBuffer:
         Empties buffer
         """
         self.frames = []
+        self.oldest_resident = 0
+        self.last_evicted = None
+        self.resident_bytes = 0
+        self.spilled_frames = 0
+        self.spill_seconds = 0
+        if self.spill_cache:
+            self.spill_cache.delete()
+            self.spill_cache = None
 
     def __len__(self):
+        if self.cache:
+            return self.cache.num_frames
         return len(self.frames)
 
     def __iter__(self):
+        """ Yields each frame in order, frames dropped by crop_frames are skipped so use Frame.frame_number """
         if self.cache:
             self.cache.open(mode="r")
-        return self
-
-    def __next__(self):
-        frame = self.get_frame(self.current_frame)
-        if frame is None:
-            raise StopIteration
-
-        self.current_frame += 1
-        return frame
+        for frame in self.iter_frames(range(len(self))):
+            if frame is not None:
+                yield frame
@@ -17,6 +17,8 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import numpy as np
+
 import ml_tools.tools as tools
 from ml_tools.tools import Rectangle
 
@@ -24,6 +26,22 @@ from ml_tools.tools import Rectangle
 class Region(Rectangle):
     """ Region is a rectangle extended to support mass. """
 
+    # record type used to store many regions in a numpy array, fields are in the same order as __init__
+    DTYPE = np.dtype(
+        [
+            ("x", np.int32),
+            ("y", np.int32),
+            ("width", np.int32),
+            ("height", np.int32),
+            ("mass", np.int32),
+            ("pixel_variance", np.float64),
+            ("id", np.int32),
+            ("frame_number", np.int32),
+            ("was_cropped", np.bool_),
+            ("is_along_border", np.bool_),
+        ]
+    )
+
     def __init__(
         self,
         topleft_x,
@@ -57,6 +75,28 @@ class Region(Rectangle):
             region_bounds[0], region_bounds[1], width, height, frame_number=frame_number
         )
 
+    @classmethod
+    def from_record(cls, record):
+        """ Creates a region from a tuple of Region.DTYPE values """
+        region = cls(*record[:-1])
+        region.is_along_border = record[-1]
+        return region
+
+    def to_record(self):
+        """ Returns this region as a tuple of Region.DTYPE values """
+        return (
+            self.x,
+            self.y,
+            self.width,
+            self.height,
+            self.mass,
+            self.pixel_variance or 0,
+            self.id,
+            self.frame_number,
+            self.was_cropped,
+            self.is_along_border,
+        )
+
     def calculate_mass(self, filtered, threshold):
         """ 
             calculates mass on this frame for this region 
@@ -0,0 +1,155 @@
+import math
+
+import numpy as np
+
+from ml_tools.tools import Rectangle
+from .region import Region
+from .track import Track
+
+FRAME_BOUNDS = Rectangle(1, 1, 158, 118)
+
+
+def reference_stats(regions):
+    """ The original list of Region implementation of Track.get_stats """
+    mass_history = [int(bound.mass) for bound in regions]
+    variance_history = [
+        bound.pixel_variance for bound in regions if bound.pixel_variance
+    ]
+    mid_x = [bound.mid_x for bound in regions]
+    mid_y = [bound.mid_y for bound in regions]
+    delta_x = [mid_x[0] - x for x in mid_x]
+    delta_y = [mid_y[0] - y for y in mid_y]
+    vel_x = [cur - prev for cur, prev in zip(mid_x[1:], mid_x[:-1])]
+    vel_y = [cur - prev for cur, prev in zip(mid_y[1:], mid_y[:-1])]
+
+    movement = sum((vx ** 2 + vy ** 2) ** 0.5 for vx, vy in zip(vel_x, vel_y))
+    max_offset = max((dx ** 2 + dy ** 2) ** 0.5 for dx, dy in zip(delta_x, delta_y))
+    delta_std = float(np.mean(variance_history)) ** 0.5
+    movement_points = (movement ** 0.5) + max_offset
+    delta_points = delta_std * 25.0
+    score = min(movement_points, 100) + min(delta_points, 100)
+    return {
+        "movement": float(movement),
+        "max_offset": float(max_offset),
+        "average_mass": float(np.mean(mass_history)),
+        "median_mass": float(np.median(mass_history)),
+        "delta_std": float(delta_std),
+        "score": float(score),
+    }
+
+
+def reference_smooth(regions, frame_bounds):
+    """
+    The original list of Region implementation of Track.smooth, which only kept the smoothed bounds.  It read
+    the second region before the loop so raised on 1 frame tracks, that read is left out here
+    """
+    smoothed = []
+    for i, current_frame in enumerate(regions):
+        prev_frame = regions[max(0, i - 1)]
+        next_frame = regions[min(len(regions) - 1, i + 1)]
+        frame_width = (prev_frame.width + current_frame.width + next_frame.width) / 3
+        frame_height = (
+            prev_frame.height + current_frame.height + next_frame.height
+        ) / 3
+        frame = Region(
+            int(current_frame.mid_x - frame_width / 2),
+            int(current_frame.mid_y - frame_height / 2),
+            int(frame_width),
+            int(frame_height),
+        )
+        frame.crop(frame_bounds)
+        smoothed.append(frame)
+    return smoothed
+
+
+def reference_trim(regions, start_frame):
+    """ The original list of Region implementation of Track.trim, returns the start frame and regions """
+    mass_history = [int(bound.mass) for bound in regions]
+    start = 0
+    while start < len(regions) and mass_history[start] <= 2:
+        start += 1
+    end = len(regions) - 1
+    while end > 0 and mass_history[end] <= 2:
+        end -= 1
+    if end < start:
+        return 0, []
+    return start_frame + start, regions[start : end + 1]
+
+
+def random_track(rng, num_frames, zero_variance=False):
+    track = Track("1", id=1)
+    track.start_frame = int(rng.randint(0, 40))
+    x, y = rng.randint(0, 150), rng.randint(0, 110)
+    for frame_number in range(track.start_frame, track.start_frame + num_frames):
+        x = int(np.clip(x + rng.randint(-4, 5), -3, 155))
+        y = int(np.clip(y + rng.randint(-4, 5), -3, 115))
+        variance = 0 if zero_variance or rng.rand() < 0.3 else rng.uniform(0, 5)
+        track.add_region(
+            Region(
+                x,
+                y,
+                int(rng.randint(2, 20)),
+                int(rng.randint(2, 20)),
+                mass=int(rng.choice([0, 1, 2, rng.randint(3, 50)])),
+                pixel_variance=variance,
+                frame_number=frame_number,
+            )
+        )
+    return track
+
+
+def regions_of(track):
+    return [region for region in track.bounds_history]
+
+
+def region_values(region):
+    return (region.x, region.y, region.width, region.height)
+
+
+class TestTrack:
+    def tracks(self):
+        rng = np.random.RandomState(7)
+        tracks = [random_track(rng, num_frames) for num_frames in [1, 2, 3, 10, 40]]
+        tracks += [random_track(rng, num_frames) for num_frames in range(1, 30)]
+        # no variance in any frame gives NaN stats
+        tracks.append(random_track(rng, 8, zero_variance=True))
+        return tracks
+
+    def test_get_stats(self):
+        for track in self.tracks():
+            stats = track.get_stats()
+            if len(track) <= 1:
+                assert stats == type(stats)()
+                continue
+            expected = reference_stats(regions_of(track))
+            for name, value in expected.items():
+                actual = getattr(stats, name)
+                if math.isnan(value):
+                    assert math.isnan(actual)
+                else:
+                    assert math.isclose(actual, value, rel_tol=1e-9, abs_tol=1e-9)
+
+    def test_smooth(self):
+        for track in self.tracks():
+            regions = regions_of(track)
+            expected = reference_smooth(regions, FRAME_BOUNDS)
+            track.smooth(FRAME_BOUNDS)
+            smoothed = regions_of(track)
+            assert [region_values(region) for region in smoothed] == [
+                region_values(region) for region in expected
+            ]
+            # unlike the original, everything but the bounds is kept
+            for region, original in zip(smoothed, regions):
+                assert region.mass == original.mass
+                assert region.pixel_variance == original.pixel_variance
+                assert region.frame_number == original.frame_number
+
+    def test_trim(self):
+        for track in self.tracks():
+            start_frame, expected = reference_trim(regions_of(track), track.start_frame)
+            track.trim()
+            assert track.start_frame == start_frame
+            assert len(track) == len(expected)
+            assert [region.frame_number for region in track.bounds_history] == [
+                region.frame_number for region in expected
+            ]
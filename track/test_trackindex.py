@@ -0,0 +1,65 @@
+import numpy as np
+
+from .region import Region
+from .track import Track
+from .trackindex import TrackIndex
+
+
+def reference_overlap_ratio(track, other_track, threshold=0.05):
+    """ The original frame by frame implementation of Track.get_overlap_ratio """
+    start = max(track.start_frame, other_track.start_frame)
+    end = min(track.end_frame, other_track.end_frame)
+    frames_overlapped = 0
+    for pos in range(start, end + 1):
+        our_index = pos - track.start_frame
+        other_index = pos - other_track.start_frame
+        if (
+            our_index >= 0
+            and other_index >= 0
+            and our_index < len(track)
+            and other_index < len(other_track)
+        ):
+            our_bounds = track.bounds_history[our_index]
+            other_bounds = other_track.bounds_history[other_index]
+            overlap = our_bounds.overlap_area(other_bounds) / our_bounds.area
+            if overlap >= threshold:
+                frames_overlapped += 1
+    return frames_overlapped / len(track)
+
+
+def random_track(track_id):
+    track = Track("1", id=track_id)
+    track.start_frame = np.random.randint(0, 40)
+    x, y = np.random.randint(0, 140), np.random.randint(0, 100)
+    for frame_number in range(track.start_frame, track.start_frame + 20):
+        x = int(np.clip(x + np.random.randint(-3, 4), 0, 140))
+        y = int(np.clip(y + np.random.randint(-3, 4), 0, 100))
+        region = Region(
+            x,
+            y,
+            np.random.randint(3, 20),
+            np.random.randint(3, 20),
+            mass=np.random.randint(0, 5),
+            frame_number=frame_number,
+        )
+        track.add_region(region)
+    track.trim()
+    return track
+
+
+class TestTrackIndex:
+    def test_overlap_ratio(self):
+        np.random.seed(5)
+        tracks = [random_track(i + 1) for i in range(30)]
+        index = TrackIndex(tracks)
+        for track in tracks:
+            if len(track) == 0:
+                continue
+            candidates = index.get_overlapping(track)
+            for other in tracks:
+                if other == track or len(other) == 0:
+                    continue
+                expected = reference_overlap_ratio(track, other)
+                assert track.get_overlap_ratio(other) == expected
+                if expected > 0:
+                    assert other in candidates
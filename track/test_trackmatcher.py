@@ -0,0 +1,100 @@
+import numpy as np
+
+from ml_tools.tools import Rectangle
+from .region import Region
+from .track import Track
+from .trackmatcher import TrackMatcher
+
+MOVING_VEL_THRESH = 4
+CROP_RECTANGLE = Rectangle(1, 1, 158, 118)
+
+
+def reference_match(tracks, regions):
+    """ The original python implementation of ClipTrackExtractor._match_existing_tracks """
+    scores = []
+    for track in tracks:
+        for region in regions:
+            score, size_change = track.get_track_region_score(region, MOVING_VEL_THRESH)
+            max_distance = np.clip(7 * track.last_mass, 900, 9025)
+            exiting = region.is_along_border and not track.last_bound.is_along_border
+            entering = not exiting and track.last_bound.is_along_border
+            min_change = 100 if entering or exiting else 50
+            max_size_change = np.clip(track.last_mass, min_change, 500)
+            if score > max_distance or size_change > max_size_change:
+                continue
+            scores.append((score, track, region))
+
+    scores.sort(
+        key=lambda record: record[1].frames_since_target_seen
+        + float(".{}".format(record[1]._id))
+    )
+    scores.sort(key=lambda record: record[0])
+
+    matches = []
+    matched_tracks = set()
+    used_regions = set()
+    for (score, track, region) in scores:
+        if track in matched_tracks or region in used_regions:
+            continue
+        matches.append((track, region))
+        matched_tracks.add(track)
+        used_regions.add(region)
+    return matches
+
+
+def random_region(frame_number):
+    x = np.random.randint(0, 150)
+    y = np.random.randint(0, 110)
+    region = Region(
+        x,
+        y,
+        np.random.randint(3, 30),
+        np.random.randint(3, 30),
+        mass=np.random.randint(0, 300),
+        frame_number=frame_number,
+    )
+    region.crop(CROP_RECTANGLE)
+    region.set_is_along_border(CROP_RECTANGLE)
+    return region
+
+
+def random_track(track_id):
+    track = Track("1", id=track_id)
+    track.start_frame = 0
+    for frame_number in range(np.random.randint(1, 4)):
+        track.add_region(random_region(frame_number))
+    track.frames_since_target_seen = np.random.randint(0, 3)
+    return track
+
+
+class TestTrackMatcher:
+    def test_matches_reference(self):
+        np.random.seed(11)
+        matcher = TrackMatcher(MOVING_VEL_THRESH)
+        for _ in range(200):
+            tracks = [random_track(i + 1) for i in range(np.random.randint(0, 12))]
+            regions = [random_region(5) for _ in range(np.random.randint(0, 30))]
+            expected = reference_match(tracks, regions)
+            assert matcher.match(tracks, regions) == expected
+
+    def test_hungarian(self):
+        np.random.seed(12)
+        matcher = TrackMatcher(MOVING_VEL_THRESH, TrackMatcher.HUNGARIAN)
+        greedy = TrackMatcher(MOVING_VEL_THRESH)
+        for _ in range(50):
+            tracks = [random_track(i + 1) for i in range(np.random.randint(1, 12))]
+            regions = [random_region(5) for _ in range(np.random.randint(1, 30))]
+            distance, _ = matcher.get_scores(tracks, regions)
+            index = {id(region): i for i, region in enumerate(regions)}
+
+            def total(matches):
+                return sum(
+                    distance[tracks.index(track), index[id(region)]]
+                    for track, region in matches
+                )
+
+            matches = matcher.match(tracks, regions)
+            greedy_matches = greedy.match(tracks, regions)
+            assert len(matches) >= len(greedy_matches)
+            if len(matches) == len(greedy_matches):
+                assert total(matches) <= total(greedy_matches) + 1e-6
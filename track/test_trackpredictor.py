@@ -0,0 +1,39 @@
+import numpy as np
+
+from .region import Region
+from .track import Track
+from .trackpredictor import KalmanTrackPredictor
+
+
+def moving_region(frame_number):
+    return Region(10 + 3 * frame_number, 20 + frame_number, 10, 10, mass=50)
+
+
+class TestKalmanTrackPredictor:
+    def test_constant_velocity(self):
+        predictor = KalmanTrackPredictor()
+        track = Track("1", id=1)
+        track.add_region(moving_region(0))
+        for frame_number in range(1, 20):
+            predictor.predict([track])
+            region = moving_region(frame_number)
+            predictor.update([(0, region)])
+            track.add_region(region)
+
+        position, velocity = predictor.predict([track])
+        assert np.allclose(velocity, [[3, 1]], atol=0.1)
+        expected = moving_region(20)
+        assert np.allclose(position, [[expected.mid_x, expected.mid_y]], atol=0.5)
+
+    def test_tracks_are_forgotten(self):
+        predictor = KalmanTrackPredictor()
+        tracks = [Track("1", id=i + 1) for i in range(3)]
+        for track in tracks:
+            track.add_region(moving_region(0))
+        predictor.predict(tracks)
+        predictor.update([(1, moving_region(1))])
+
+        position, _ = predictor.predict(tracks[1:2])
+        assert predictor.tracks == tracks[1:2]
+        assert position.shape == (1, 2)
+        assert position[0, 0] > moving_region(0).mid_x
@@ -20,13 +20,14 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 import datetime
 import numpy as np
 from collections import namedtuple
+from collections.abc import Sequence
 
 from ml_tools.tools import Rectangle, get_clipped_flow
 from ml_tools.dataset import TrackChannels
 import track.region
 from track.region import Region
 
-from ml_tools.tools import eucl_distance
+from ml_tools.tools import eucl_distance, overlap_areas
 
 
 class Track:
@@ -34,6 +35,7 @@ class Track:
 
     # keeps track of which id number we are up to.
     _track_id = 1
+    INITIAL_BOUNDS_SIZE = 16
 
     def __init__(self, clip_id, id=None):
         """
@@ -54,8 +56,9 @@ class Track:
         self.end_s = None
         self.current_frame_num = None
         self.frame_list = []
-        # our bounds over time
-        self.bounds_history = []
+        # our bounds over time, stored as Region.DTYPE records and grown as needed
+        self._bounds = np.empty(Track.INITIAL_BOUNDS_SIZE, dtype=Region.DTYPE)
+        self._num_bounds = 0
         # number frames since we lost target.
         self.frames_since_target_seen = 0
         # our current estimated horizontal velocity
@@ -81,6 +84,23 @@ class Track:
         track.add_region(region)
         return track
 
+    @classmethod
+    def from_bounds(cls, clip, track_id, bounds):
+        """
+        Creates a track with the bounds of a track already tracked in clip, to add frames to as metadata tracks
+        :param bounds: numpy array of Region.DTYPE records, one for each frame of the track
+        """
+        track = cls(clip.get_id(), track_id)
+        track.from_metadata = True
+        for record in bounds:
+            track._append_bounds(record)
+        track.frame_list = bounds["frame_number"].tolist()
+        track.start_frame = track.frame_list[0]
+        track.end_frame = track.frame_list[-1]
+        track.start_s = track.start_frame / float(clip.frames_per_second)
+        track.current_frame_num = 0
+        return track
+
     def get_id(self):
         return self._id
 
@@ -109,7 +129,7 @@ class Track:
         positions = data.get("positions")
         if not positions:
             return False
-        self.bounds_history = []
+        self._num_bounds = 0
         self.frame_list = []
         for position in positions:
             frame_number = round(position[0] * frames_per_second)
@@ -117,7 +137,7 @@ class Track:
                 self.start_frame = frame_number
             self.end_frame = frame_number
             region = Region.region_from_array(position[1], frame_number)
-            self.bounds_history.append(region)
+            self._append_bounds(region.to_record())
             self.frame_list.append(frame_number)
         self.current_frame_num = 0
         return True
@@ -128,26 +148,55 @@ class Track:
             for _ in range(frame_diff):
                 self.add_blank_frame()
 
-        self.bounds_history.append(region)
+        self._append_bounds(region.to_record())
         self.end_frame = region.frame_number
         self.prev_frame_num = region.frame_number
         self.update_velocity()
         self.frames_since_target_seen = 0
 
+    def _append_bounds(self, record):
+        if self._num_bounds == len(self._bounds):
+            bounds = np.empty(max(1, 2 * self._num_bounds), dtype=Region.DTYPE)
+            bounds[: self._num_bounds] = self._bounds
+            self._bounds = bounds
+        self._bounds[self._num_bounds] = record
+        self._num_bounds += 1
+
+    @property
+    def bounds(self):
+        """ Bounds over time as a numpy array of Region.DTYPE records """
+        return self._bounds[: self._num_bounds]
+
+    @property
+    def bounds_history(self):
+        """ Bounds over time as a sequence of regions, regions are created when accessed """
+        return BoundsHistory(self.bounds)
+
     def update_velocity(self):
-        if len(self.bounds_history) >= 2:
-            self.vel_x = self.bounds_history[-1].mid_x - self.bounds_history[-2].mid_x
-            self.vel_y = self.bounds_history[-1].mid_y - self.bounds_history[-2].mid_y
+        if len(self) >= 2:
+            mid_x, mid_y = self.get_mid_points(len(self) - 2)
+            self.vel_x = mid_x[1] - mid_x[0]
+            self.vel_y = mid_y[1] - mid_y[0]
         else:
             self.vel_x = self.vel_y = 0
 
+    def get_mid_points(self, start=0, end=None):
+        """ Returns x and y arrays of the mid points of the bounds between start and end """
+        bounds = self.bounds[start:end]
+        mid_x = bounds["x"] + bounds["width"] / 2
+        mid_y = bounds["y"] + bounds["height"] / 2
+        return mid_x, mid_y
+
     def add_frame_for_existing_region(self, frame, mass_delta_threshold, prev_filtered):
-        region = self.bounds_history[self.current_frame_num]
+        record = self.bounds[self.current_frame_num]
+        region = Region.from_record(record.item())
         if prev_filtered is not None:
             prev_filtered = region.subimage(prev_filtered)
         filtered = region.subimage(frame.filtered)
         region.calculate_mass(filtered, mass_delta_threshold)
         region.calculate_variance(filtered, prev_filtered)
+        record["mass"] = region.mass
+        record["pixel_variance"] = region.pixel_variance or 0
 
         if self.prev_frame_num and frame.frame_number:
             frame_diff = frame.frame_number - self.prev_frame_num - 1
@@ -162,12 +211,13 @@ class Track:
 
     def add_blank_frame(self, buffer_frame=None):
         """ Maintains same bounds as previously, does not reset framce_since_target_seen counter """
-        region = self.last_bound.copy()
-        region.mass = 0
-        region.pixel_variance = 0
-        region.frame_number += 1
-        self.bounds_history.append(region)
-        self.prev_frame_num = region.frame_number
+        record = self.bounds[-1].copy()
+        record["mass"] = 0
+        record["pixel_variance"] = 0
+        record["frame_number"] += 1
+        record["is_along_border"] = False
+        self._append_bounds(record)
+        self.prev_frame_num = int(record["frame_number"])
         self.vel_x = self.vel_y = 0
         self.frames_since_target_seen += 1
 
@@ -181,21 +231,17 @@ class Track:
         if len(self) <= 1:
             return TrackMovementStatistics()
         # get movement vectors
-        mass_history = [int(bound.mass) for bound in self.bounds_history]
-        variance_history = [
-            bound.pixel_variance
-            for bound in self.bounds_history
-            if bound.pixel_variance
-        ]
-        mid_x = [bound.mid_x for bound in self.bounds_history]
-        mid_y = [bound.mid_y for bound in self.bounds_history]
-        delta_x = [mid_x[0] - x for x in mid_x]
-        delta_y = [mid_y[0] - y for y in mid_y]
-        vel_x = [cur - prev for cur, prev in zip(mid_x[1:], mid_x[:-1])]
-        vel_y = [cur - prev for cur, prev in zip(mid_y[1:], mid_y[:-1])]
-
-        movement = sum((vx ** 2 + vy ** 2) ** 0.5 for vx, vy in zip(vel_x, vel_y))
-        max_offset = max((dx ** 2 + dy ** 2) ** 0.5 for dx, dy in zip(delta_x, delta_y))
+        mass_history = np.int32(self.bounds["mass"])
+        variance_history = self.bounds["pixel_variance"]
+        variance_history = variance_history[variance_history != 0]
+        mid_x, mid_y = self.get_mid_points()
+        delta_x = mid_x[0] - mid_x
+        delta_y = mid_y[0] - mid_y
+        vel_x = mid_x[1:] - mid_x[:-1]
+        vel_y = mid_y[1:] - mid_y[:-1]
+
+        movement = np.sum(np.sqrt(vel_x ** 2 + vel_y ** 2))
+        max_offset = np.max(np.sqrt(delta_x ** 2 + delta_y ** 2))
 
         # the standard deviation is calculated by averaging the per frame variances.
         # this ends up being slightly different as I'm using /n rather than /(n-1) but that
@@ -222,58 +268,59 @@ class Track:
         Smooths out any quick changes in track dimensions
         :param frame_bounds The boundaries of the video frame.
         """
-        if len(self.bounds_history) == 0:
+        if len(self) == 0:
             return
 
-        new_bounds_history = []
-        prev_frame = self.bounds_history[0]
-        current_frame = self.bounds_history[0]
-        next_frame = self.bounds_history[1]
-
-        for i in range(len(self.bounds_history)):
-
-            prev_frame = self.bounds_history[max(0, i - 1)]
-            current_frame = self.bounds_history[i]
-            next_frame = self.bounds_history[min(len(self.bounds_history) - 1, i + 1)]
-
-            frame_x = current_frame.mid_x
-            frame_y = current_frame.mid_y
-            frame_width = (
-                prev_frame.width + current_frame.width + next_frame.width
-            ) / 3
-            frame_height = (
-                prev_frame.height + current_frame.height + next_frame.height
-            ) / 3
-            frame = Region(
-                int(frame_x - frame_width / 2),
-                int(frame_y - frame_height / 2),
-                int(frame_width),
-                int(frame_height),
-            )
-            frame.crop(frame_bounds)
-
-            new_bounds_history.append(frame)
-
-        self.bounds_history = new_bounds_history
+        bounds = self.bounds
+        # average the dimensions with the previous and next frame
+        width = np.float64(bounds["width"])
+        height = np.float64(bounds["height"])
+        width = (np.roll(width, 1) + width + np.roll(width, -1)) / 3
+        height = (np.roll(height, 1) + height + np.roll(height, -1)) / 3
+        width[0] = (2 * bounds["width"][0] + bounds["width"][min(1, len(self) - 1)]) / 3
+        width[-1] = (
+            bounds["width"][max(0, len(self) - 2)] + 2 * bounds["width"][-1]
+        ) / 3
+        height[0] = (
+            2 * bounds["height"][0] + bounds["height"][min(1, len(self) - 1)]
+        ) / 3
+        height[-1] = (
+            bounds["height"][max(0, len(self) - 2)] + 2 * bounds["height"][-1]
+        ) / 3
+
+        mid_x, mid_y = self.get_mid_points()
+        left = np.trunc(mid_x - width / 2)
+        top = np.trunc(mid_y - height / 2)
+        right = left + np.trunc(width)
+        bottom = top + np.trunc(height)
+
+        # crop to the frame
+        left = np.maximum(left, frame_bounds.left)
+        top = np.maximum(top, frame_bounds.top)
+        right = np.minimum(right, frame_bounds.right)
+        bottom = np.minimum(bottom, frame_bounds.bottom)
+
+        bounds["x"] = left
+        bounds["y"] = top
+        bounds["width"] = right - left
+        bounds["height"] = bottom - top
 
     def trim(self):
         """
         Removes empty frames from start and end of track
         """
-        mass_history = [int(bound.mass) for bound in self.bounds_history]
-        start = 0
-        while start < len(self) and mass_history[start] <= 2:
-            start += 1
-        end = len(self) - 1
-        while end > 0 and mass_history[end] <= 2:
-            end -= 1
+        mass_history = np.int32(self.bounds["mass"])
+        has_mass = np.nonzero(mass_history > 2)[0]
 
-        if end < start:
+        if len(has_mass) == 0:
             self.start_frame = 0
-            self.bounds_history = []
+            self._num_bounds = 0
         else:
-            self.start_frame += start
-            self.bounds_history = self.bounds_history[start : end + 1]
+            start = has_mass[0]
+            end = has_mass[-1]
+            self.start_frame += int(start)
+            self._bounds = self.bounds[start : end + 1].copy()
+            self._num_bounds = len(self._bounds)
 
     def get_track_region_score(self, region: Region, moving_vel_thresh):
         """
@@ -320,32 +367,69 @@ class Track:
             return 0.0
 
         start = max(self.start_frame, other_track.start_frame)
-        end = min(self.end_frame, other_track.end_frame)
-
-        frames_overlapped = 0
+        end = min(
+            self.end_frame,
+            other_track.end_frame,
+            self.start_frame + len(self) - 1,
+            other_track.start_frame + len(other_track) - 1,
+        )
+        if end < start:
+            return 0.0
 
-        for pos in range(start, end + 1):
-            our_index = pos - self.start_frame
-            other_index = pos - other_track.start_frame
-            if (
-                our_index >= 0
-                and other_index >= 0
-                and our_index < len(self)
-                and other_index < len(other_track)
-            ):
-                our_bounds = self.bounds_history[our_index]
-                other_bounds = other_track.bounds_history[other_index]
-                overlap = our_bounds.overlap_area(other_bounds) / our_bounds.area
-                if overlap >= threshold:
-                    frames_overlapped += 1
+        our_bounds = self.get_bounds_array(
+            start - self.start_frame, end + 1 - self.start_frame
+        )
+        other_bounds = other_track.get_bounds_array(
+            start - other_track.start_frame, end + 1 - other_track.start_frame
+        )
+        our_area = (our_bounds[:, 2] - our_bounds[:, 0]) * (
+            our_bounds[:, 3] - our_bounds[:, 1]
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            overlap = overlap_areas(our_bounds, other_bounds) / our_area
+        frames_overlapped = np.count_nonzero(overlap >= threshold)
 
         return frames_overlapped / len(self)
 
+    def get_bounds_array(self, start=0, end=None):
+        """
+        Returns bounds history as an array
+        :param start: (optional) first index of bounds history to include
+        :param end: (optional) index after the last index to include
+        :return: numpy array of shape [frames, 4] of left, top, right, bottom values
+        """
+        bounds = self.bounds[start:end]
+        return np.stack(
+            (
+                bounds["x"],
+                bounds["y"],
+                bounds["x"] + bounds["width"],
+                bounds["y"] + bounds["height"],
+            ),
+            axis=1,
+        )
+
     def crop_by_region_at_trackframe(self, frame, track_frame_number, clip_flow=True):
         bounds = self.bounds_history[track_frame_number]
         return self.crop_by_region(frame, bounds)
 
     def crop_by_region(self, frame, region, clip_flow=True, filter_mask_by_region=True):
+        if frame.crop is not None:
+            # the frame only covers its crop of the full frame
+            if (
+                region.left < frame.crop.left
+                or region.top < frame.crop.top
+                or region.right > frame.crop.right
+                or region.bottom > frame.crop.bottom
+            ):
+                raise ValueError(
+                    "Region {} is outside the crop {} kept of frame {}".format(
+                        region, frame.crop, frame.frame_number
+                    )
+                )
+            region = region.copy()
+            region.x -= frame.crop.x
+            region.y -= frame.crop.y
         thermal = region.subimage(frame.thermal)
         filtered = region.subimage(frame.filtered)
         if frame.flow is not None:
@@ -378,17 +462,17 @@ class Track:
 
     @property
     def last_mass(self):
-        return self.bounds_history[-1].mass
+        return int(self.bounds["mass"][-1])
 
     @property
     def last_bound(self) -> Region:
-        return self.bounds_history[-1]
+        return Region.from_record(self.bounds[-1].item())
 
     def __repr__(self):
         return "Track: frames# {}".format(self.get_id(), len(self))
 
     def __len__(self):
-        return len(self.bounds_history)
+        return self._num_bounds
 
     @classmethod
     def get_best_human_tag(cls, track_meta, tag_precedence, min_confidence=-1):
@@ -429,6 +513,27 @@ class Track:
         return prec + confidence
 
 
+class BoundsHistory(Sequence):
+    """ Read only sequence of regions, backed by an array of Region.DTYPE records """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [
+                Region.from_record(record) for record in self.bounds[index].tolist()
+            ]
+        return Region.from_record(self.bounds[index].item())
+
+    def __iter__(self):
+        for record in self.bounds.tolist():
+            yield Region.from_record(record)
+
+
 TrackMovementStatistics = namedtuple(
     "TrackMovementStatistics",
     "movement max_offset score average_mass median_mass delta_std",
@@ -0,0 +1,67 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from ml_tools.tools import overlap_areas
+
+
+class TrackIndex:
+    """
+    Indexes tracks by the frames they cover and the bounding box of all their regions, so that only tracks
+    which are together in both time and space need to be compared frame by frame.
+    """
+
+    def __init__(self, tracks):
+        self.tracks = [track for track in tracks if len(track) > 0]
+        self.start = np.int32([track.start_frame for track in self.tracks])
+        # last frame which has bounds, end_frame isn't updated when a track is trimmed
+        self.end = np.int32(
+            [
+                min(track.end_frame, track.start_frame + len(track) - 1)
+                for track in self.tracks
+            ]
+        )
+        self.extent = np.empty((len(self.tracks), 4), dtype=np.int32)
+        for i, track in enumerate(self.tracks):
+            bounds = track.get_bounds_array()
+            self.extent[i, :2] = np.min(bounds[:, :2], axis=0)
+            self.extent[i, 2:] = np.max(bounds[:, 2:], axis=0)
+
+    def get_overlapping(self, track):
+        """
+        Returns tracks which could overlap with track in at least one frame
+        :param track: track to compare, does not need to be in the index
+        :return: list of tracks, excluding track
+        """
+        if len(track) == 0 or len(self.tracks) == 0:
+            return []
+        end = min(track.end_frame, track.start_frame + len(track) - 1)
+        bounds = track.get_bounds_array()
+        extent = np.concatenate(
+            (np.min(bounds[:, :2], axis=0), np.max(bounds[:, 2:], axis=0))
+        )
+        candidates = (
+            (self.start <= end)
+            & (self.end >= track.start_frame)
+            & (overlap_areas(self.extent, extent) > 0)
+        )
+        return [
+            self.tracks[i] for i in np.nonzero(candidates)[0] if self.tracks[i] != track
+        ]
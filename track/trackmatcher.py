@@ -0,0 +1,219 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from .trackpredictor import KalmanTrackPredictor
+
+
+class TrackMatcher:
+    """
+    Matches regions of interest to tracks.  Scores for every track and region pair are calculated at once as
+    matrices, using the same scoring as Track.get_track_region_score.
+    Tracks are expected to move by their velocity between their last two bounds, or with the "kalman" prediction
+    by a Kalman filter of their mid points, which smooths velocity over more than one frame.  The Kalman filter
+    keeps state between frames, so match must be called once every frame with all active tracks.
+    """
+
+    GREEDY = "greedy"
+    HUNGARIAN = "hungarian"
+    METHODS = [GREEDY, HUNGARIAN]
+
+    VELOCITY = "velocity"
+    KALMAN = "kalman"
+    PREDICTIONS = [VELOCITY, KALMAN]
+
+    def __init__(
+        self, moving_vel_thresh, method=GREEDY, verbose=False, prediction=VELOCITY
+    ):
+        self.moving_vel_thresh = moving_vel_thresh
+        self.method = method
+        self.verbose = verbose
+        self.prediction = prediction
+        self.predictor = None
+        if prediction == TrackMatcher.KALMAN:
+            self.predictor = KalmanTrackPredictor()
+
+    def match(self, tracks, regions):
+        """
+        Finds the best matching region for each track
+        :param tracks: list of tracks
+        :param regions: list of regions
+        :return: list of (track, region) tuples
+        """
+        movement = velocity = None
+        if self.predictor is not None:
+            # every track is predicted, even without regions to match
+            movement, velocity = self.predict_movement(tracks)
+        if len(tracks) == 0 or len(regions) == 0:
+            return []
+
+        distance, size_change = self.get_scores(tracks, regions, movement, velocity)
+        max_distance, max_size_change = self.get_limits(tracks, regions)
+        valid = (distance <= max_distance) & (size_change <= max_size_change)
+        if self.verbose:
+            self._log_rejected(
+                tracks, distance, size_change, max_distance, max_size_change
+            )
+
+        if self.method == TrackMatcher.HUNGARIAN:
+            matches = self._assign_hungarian(distance, valid)
+        else:
+            matches = self._assign_greedy(tracks, distance, valid)
+        if self.predictor is not None:
+            self.predictor.update([(t, regions[r]) for t, r in matches])
+        return [(tracks[t], regions[r]) for t, r in matches]
+
+    def predict_movement(self, tracks):
+        """
+        Predicts the mid points of tracks with the Kalman filter
+        :return: tuple of expected movement from the last bound of each track and velocity, arrays of shape
+        [tracks, 2]
+        """
+        position, velocity = self.predictor.predict(tracks)
+        last_mid = np.float64(
+            [[track.last_bound.mid_x, track.last_bound.mid_y] for track in tracks]
+        ).reshape(-1, 2)
+        # the last bound may be from a few frames ago if the track hasn't been seen since
+        return position - last_mid, velocity
+
+    def get_scores(self, tracks, regions, movement=None, velocity=None):
+        """
+        Calculates the distance score and size change of every track region pair
+        :param movement: (optional) array of shape [tracks, 2] of the expected movement of each track from its last
+        bound, defaults to the velocity of each track
+        :param velocity: (optional) array of shape [tracks, 2] used to decide if tracks are moving, defaults to
+        movement
+        :return: tuple of distance, size_change matrices of shape [tracks, regions]
+        """
+        bounds = np.float64([bounds_array(track.last_bound) for track in tracks])
+        if movement is None:
+            movement = np.float64([[track.vel_x, track.vel_y] for track in tracks])
+        if velocity is None:
+            velocity = movement
+        region_bounds = np.float64([bounds_array(region) for region in regions])
+
+        x, y, width, height = [bounds[:, i, np.newaxis] for i in range(4)]
+        vel_x, vel_y = movement[:, 0, np.newaxis], movement[:, 1, np.newaxis]
+        r_x, r_y, r_width, r_height = region_bounds.T
+
+        # moving tracks are scored on their mid points, otherwise by both corners
+        moving = (
+            np.abs(velocity[:, 0, np.newaxis]) + np.abs(velocity[:, 1, np.newaxis])
+            >= self.moving_vel_thresh
+        )
+        expected_x = np.trunc(x + width / 2 + vel_x)
+        expected_y = np.trunc(y + height / 2 + vel_y)
+        mid_distance = (expected_x - (r_x + r_width / 2)) ** 2 + (
+            expected_y - (r_y + r_height / 2)
+        ) ** 2
+
+        expected_x = np.trunc(x + vel_x)
+        expected_y = np.trunc(y + vel_y)
+        corner_distance = (expected_x - r_x) ** 2 + (expected_y - r_y) ** 2
+        corner_distance += (expected_x + width - (r_x + r_width)) ** 2 + (
+            expected_y + height - (r_y + r_height)
+        ) ** 2
+        corner_distance /= 2.0
+
+        distance = np.where(moving, mid_distance, corner_distance)
+
+        area = width * height
+        size_change = (np.abs(r_width * r_height - area) / (area + 50)) * 100
+        return distance, size_change
+
+    def get_limits(self, tracks, regions):
+        """
+        Calculates the maximum distance and size change allowed for every track region pair
+        :return: tuple of max_distance, max_size_change arrays broadcastable to [tracks, regions]
+        """
+        last_mass = np.float64([track.last_mass for track in tracks])[:, np.newaxis]
+        track_border = np.array([track.last_bound.is_along_border for track in tracks])
+        region_border = np.array([region.is_along_border for region in regions])
+
+        # we give larger tracks more freedom to find a match as they might move quite a bit.
+        max_distance = np.clip(7 * last_mass, 900, 9025)
+
+        # tracks entering or exiting the frame are allowed to change size more
+        entering_or_exiting = track_border[:, np.newaxis] | region_border
+        min_change = np.where(entering_or_exiting, 100, 50)
+        max_size_change = np.clip(last_mass, min_change, 500)
+        return max_distance, max_size_change
+
+    def _assign_greedy(self, tracks, distance, valid):
+        """
+        Assigns the best scoring pairs first, ties are broken by frames since the track was seen and then track id,
+        this keeps tracking consistent.
+        """
+        track_index, region_index = np.nonzero(valid)
+        tie_break = np.float64(
+            [
+                track.frames_since_target_seen + float(".{}".format(track.get_id()))
+                for track in tracks
+            ]
+        )
+        order = np.lexsort(
+            (tie_break[track_index], distance[track_index, region_index])
+        )
+
+        matches = []
+        matched_tracks = set()
+        matched_regions = set()
+        for i in order:
+            t, r = track_index[i], region_index[i]
+            if t in matched_tracks or r in matched_regions:
+                continue
+            matches.append((t, r))
+            matched_tracks.add(t)
+            matched_regions.add(r)
+        return matches
+
+    def _assign_hungarian(self, distance, valid):
+        """ Assigns pairs so that the total distance score of all matches is minimised. """
+        # invalid pairs are given a cost higher than any valid pair could have
+        invalid_cost = np.max(distance) * distance.size + 1
+        cost = np.where(valid, distance, invalid_cost)
+        track_index, region_index = linear_sum_assignment(cost)
+        return [(t, r) for t, r in zip(track_index, region_index) if valid[t, r]]
+
+    def _log_rejected(
+        self, tracks, distance, size_change, max_distance, max_size_change
+    ):
+        max_distance = np.broadcast_to(max_distance, distance.shape)
+        max_size_change = np.broadcast_to(max_size_change, distance.shape)
+        for t, r in zip(*np.nonzero(distance > max_distance)):
+            logging.info(
+                "track {} distance score {} bigger than max score {}".format(
+                    tracks[t].get_id(), distance[t, r], max_distance[t, r]
+                )
+            )
+        for t, r in zip(
+            *np.nonzero((distance <= max_distance) & (size_change > max_size_change))
+        ):
+            logging.info(
+                "track {} size_change {} bigger than max size_change {}".format(
+                    tracks[t].get_id(), size_change[t, r], max_size_change[t, r]
+                )
+            )
+
+
+def bounds_array(region):
+    return [region.x, region.y, region.width, region.height]
@@ -0,0 +1,99 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+
+class KalmanTrackPredictor:
+    """
+    Constant velocity Kalman filters of the mid points of tracks.  The states of all tracks are kept in one array
+    so every track is predicted and updated at once.  Each state is mid_x, mid_y, vel_x, vel_y in pixels and
+    pixels per frame.
+    """
+
+    TRANSITION = np.float64([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]])
+
+    def __init__(
+        self, process_noise=0.5, measurement_noise=4.0, initial_velocity_variance=25.0
+    ):
+        self.measurement_noise = measurement_noise
+        self.initial_velocity_variance = initial_velocity_variance
+        # noise of a random acceleration each frame
+        self.process_covariance = process_noise * np.float64(
+            [[0.25, 0, 0.5, 0], [0, 0.25, 0, 0.5], [0.5, 0, 1, 0], [0, 0.5, 0, 1],]
+        )
+        self.tracks = []
+        self.state = np.zeros((0, 4))
+        self.covariance = np.zeros((0, 4, 4))
+
+    def predict(self, tracks):
+        """
+        Advances the state of tracks by a frame.  Tracks which haven't been seen before are started from the mid
+        point of their last bound, and any other tracks are forgotten.
+        :return: predicted mid points and velocities as arrays of shape [tracks, 2]
+        """
+        rows = {id(track): row for row, track in enumerate(self.tracks)}
+        state = np.empty((len(tracks), 4))
+        covariance = np.empty((len(tracks), 4, 4))
+        known = np.array([id(track) in rows for track in tracks], dtype=np.bool_)
+        if np.any(known):
+            known_rows = [rows[id(track)] for track, seen in zip(tracks, known) if seen]
+            state[known] = self.state[known_rows]
+            covariance[known] = self.covariance[known_rows]
+        if not np.all(known):
+            new_tracks = [track for track, seen in zip(tracks, known) if not seen]
+            state[~known] = [
+                [track.last_bound.mid_x, track.last_bound.mid_y, 0, 0]
+                for track in new_tracks
+            ]
+            covariance[~known] = np.diag(
+                [self.measurement_noise] * 2 + [self.initial_velocity_variance] * 2
+            )
+
+        self.tracks = list(tracks)
+        self.state = state @ KalmanTrackPredictor.TRANSITION.T
+        self.covariance = (
+            KalmanTrackPredictor.TRANSITION
+            @ covariance
+            @ KalmanTrackPredictor.TRANSITION.T
+            + self.process_covariance
+        )
+        return self.state[:, :2], self.state[:, 2:]
+
+    def update(self, matches):
+        """
+        Corrects the predicted state of tracks with the mid points of the regions they were matched to
+        :param matches: list of (track index, region) tuples, indices are into the tracks last predicted
+        """
+        if len(matches) == 0:
+            return
+        rows = np.array([row for row, _ in matches])
+        measured = np.float64([[region.mid_x, region.mid_y] for _, region in matches])
+        state = self.state[rows]
+        covariance = self.covariance[rows]
+
+        # the measurement is the position part of the state, so the innovation covariance is its top left corner
+        innovation = measured - state[:, :2]
+        innovation_covariance = covariance[:, :2, :2] + self.measurement_noise * np.eye(
+            2
+        )
+        gain = covariance[:, :, :2] @ np.linalg.inv(innovation_covariance)
+        self.state[rows] = state + np.einsum("nij,nj->ni", gain, innovation)
+        self.covariance[rows] = covariance - gain @ covariance[:, :2, :]